@@ -0,0 +1,219 @@
+"""
+File and image attachments, streamed from disk and thumbnailed off the
+event loop.
+"""
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib.util import find_spec
+from typing import AsyncIterator
+
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+PILLOW_AVAILABLE = find_spec("PIL") is not None
+
+DEFAULT_DIRECTORY = "thumbnail_cache"
+# files picked in a browser are uploaded to the server here first
+UPLOAD_DIRECTORY = "uploads"
+# seconds an upload url handed to the browser stays valid
+UPLOAD_URL_EXPIRES = 600
+# bytes of thumbnails kept on disk before the least recently used are dropped
+DEFAULT_MAX_BYTES = 50 * 2**20
+# bytes of a file in memory at a time while it is uploaded
+CHUNK_SIZE = 2**20
+# longest side of a thumbnail in pixels
+THUMBNAIL_SIZE = 256
+# processes making thumbnails
+THUMBNAIL_WORKERS = min(2, os.cpu_count() or 1)
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"}
+
+
+def attachment_type(path: str) -> str:
+    """
+    Message type of an attached file, "image" or "file".
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    return "image" if extension in IMAGE_EXTENSIONS else "file"
+
+
+def format_size(size: int) -> str:
+    """File size for people, e.g. "3.2 MB"."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def content_type(path: str) -> str:
+    """Mime type of a file from its name."""
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+async def stream_file(path: str, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    Chunks of a file read through a memory map, one chunk in memory at a
+    time.
+
+    The kernel is asked to read the next chunk ahead while the current one
+    is sent, so copying a chunk out of the map does not wait on the disk.
+    """
+
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            prefetch = hasattr(view, "madvise")
+            if prefetch:
+                view.madvise(mmap.MADV_SEQUENTIAL)
+                view.madvise(mmap.MADV_WILLNEED, 0, min(chunk_size, size))
+            for start in range(0, size, chunk_size):
+                following = start + chunk_size
+                if prefetch and following < size:
+                    view.madvise(
+                        mmap.MADV_WILLNEED,
+                        following,
+                        min(chunk_size, size - following),
+                    )
+                yield view[start:following]
+                # let the ui run between two chunks
+                await asyncio.sleep(0)
+
+
+def make_thumbnail(source: str, destination: str, size: int) -> bool:
+    """
+    Write a png thumbnail of an image. False when the image cannot be read
+    or Pillow is not installed.
+
+    Runs in the thumbnail processes.
+    """
+
+    try:
+        from PIL import Image  # type: ignore  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return False
+    try:
+        with Image.open(source) as image:
+            # jpegs are decoded at the smallest scale still above the size
+            image.draft("RGB", (size, size))
+            image.thumbnail((size, size))
+            if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                image = image.convert("RGB")
+            image.save(destination, "PNG")
+    except (OSError, ValueError) as error:
+        logger.warning("Could not make a thumbnail of %s: %s", source, error)
+        return False
+    return True
+
+
+class ThumbnailCache(DiskCache):
+    """
+    Thumbnails of attached images, one png per image file and size.
+
+    Thumbnails are made in a process pool, decoding a large image never
+    holds up the event loop, and every image is only thumbnailed once even
+    when asked for by several bubbles at the same time.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_DIRECTORY,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        size: int = THUMBNAIL_SIZE,
+    ):
+        super().__init__(directory, max_bytes, ".png")
+        self.size = size
+        self._pool: ProcessPoolExecutor | None = None
+        self._pending: dict[str, asyncio.Future] = {}
+
+    def key(self, path: str) -> str:
+        """
+        Cache key of an image file, a changed file gets a new key.
+        """
+
+        stat = os.stat(path)
+        identity = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return f"{hashlib.sha256(identity.encode()).hexdigest()}-{self.size}"
+
+    async def thumbnail(self, path: str) -> str | None:
+        """
+        Thumbnail of the image, made first when not cached. None when the
+        image cannot be thumbnailed.
+        """
+
+        try:
+            key = self.key(path)
+        except OSError:
+            return None
+        cached = self.lookup(key)
+        if cached is not None or not PILLOW_AVAILABLE:
+            return cached
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(self._make(key, path))
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        # a cancelled bubble does not cancel the thumbnail others wait for
+        return await asyncio.shield(pending)
+
+    async def _make(self, key: str, path: str) -> str | None:
+        temporary = self.temporary_path(key)
+        try:
+            made = await asyncio.get_running_loop().run_in_executor(
+                self._executor(), make_thumbnail, path, temporary, self.size
+            )
+        except (BrokenProcessPool, RuntimeError, OSError) as error:
+            logger.warning("Thumbnail processes failed: %s", error)
+            self.shutdown()
+            made = False
+        if not made:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            return None
+        self.commit(key, temporary)
+        return self.path(key)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawned, not forked, the app process runs threads
+            self._pool = ProcessPoolExecutor(
+                THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def shutdown(self):
+        """
+        Stop the thumbnail processes.
+        """
+
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+_caches: dict[str, ThumbnailCache] = {}
+
+
+def open_thumbnails(directory: str = DEFAULT_DIRECTORY) -> ThumbnailCache:
+    """
+    Thumbnail cache of the directory, shared by every session of the process.
+    """
+
+    cache = _caches.get(directory)
+    if cache is None:
+        cache = _caches[directory] = ThumbnailCache(directory)
+    return cache
@@ -0,0 +1,3 @@
+"""
+Benchmarks for the hot UI paths, run from the project root.
+"""
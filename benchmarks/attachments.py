@@ -0,0 +1,191 @@
+"""
+Memory and event loop stalls while uploading a large attachment and making
+image thumbnails.
+
+Run from the project root:
+    python -m benchmarks.attachments [file size in MB] [images]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+
+from benchmarks.ui import summary
+
+# seconds between two ticks of the stall probe
+TICK = 0.005
+
+
+class UploadStub:
+    """
+    Files endpoint that reads and drops the uploads, counting their bytes.
+    """
+
+    def __init__(self):
+        self.received = 0
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> str:
+        """
+        Listen on a free port and return the api url.
+        """
+
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self._server.sockets[0].getsockname()[1]}/v1"
+
+    async def close(self):
+        """
+        Stop listening.
+        """
+
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            while length:
+                chunk = await reader.read(min(length, 2**16))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                self.received += len(chunk)
+            body = b'{"id": "file-stub", "object": "file"}'
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def stalls(work) -> tuple[object, list[float]]:
+    """
+    Run the work while a probe measures how late each of its ticks is, in
+    milliseconds.
+    """
+
+    lateness = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lateness.append(max(time.perf_counter() - start - TICK, 0) * 1000)
+
+    task = asyncio.create_task(probe())
+    try:
+        result = await work
+    finally:
+        done.set()
+        await task
+    return result, lateness or [0.0]
+
+
+async def bench_upload(workdir: str, megabytes: int) -> dict:
+    """
+    Upload a file of the size, tracing the memory allocated meanwhile.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from attachments import stream_file
+    from chat_api import upload_file
+
+    path = os.path.join(workdir, "large.bin")
+    with open(path, "wb") as file:
+        block = os.urandom(2**20)
+        for _ in range(megabytes):
+            file.write(block)
+    size = os.path.getsize(path)
+
+    stub = UploadStub()
+    api_url = await stub.start()
+    async with httpx.AsyncClient(timeout=120) as client:
+        tracemalloc.start()
+        start = time.perf_counter()
+        file_id, lateness = await stalls(
+            upload_file(api_url, "large.bin", stream_file(path), size, client=client)
+        )
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    await stub.close()
+    return {
+        "file_mb": megabytes,
+        "file_id": file_id,
+        "received_bytes": stub.received,
+        "seconds": round(seconds, 3),
+        "peak_traced_mb": round(peak / 2**20, 2),
+        "loop_stall": summary(lateness),
+    }
+
+
+async def bench_thumbnails(workdir: str, images: int) -> dict:
+    """
+    Thumbnail large images, then again from the cache.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from attachments import PILLOW_AVAILABLE, ThumbnailCache
+
+    if not PILLOW_AVAILABLE:
+        return {"skipped": "Pillow is not installed"}
+    from PIL import Image  # type: ignore
+
+    paths = []
+    for index in range(images):
+        path = os.path.join(workdir, f"photo-{index}.jpg")
+        Image.effect_noise((4000, 3000), 64 + index).convert("RGB").save(path)
+        paths.append(path)
+
+    cache = ThumbnailCache(os.path.join(workdir, "thumbnails"))
+    results = {"images": images}
+    try:
+        for name in ("uncached", "cached"):
+            start = time.perf_counter()
+            thumbnails, lateness = await stalls(
+                asyncio.gather(*(cache.thumbnail(path) for path in paths))
+            )
+            results[name] = {
+                "seconds": round(time.perf_counter() - start, 3),
+                "made": sum(thumbnail is not None for thumbnail in thumbnails),
+                "loop_stall": summary(lateness),
+            }
+    finally:
+        cache.shutdown()
+    results["cache"] = cache.stats()
+    return results
+
+
+def main(megabytes: int = 200, images: int = 8):
+    """
+    Print the upload and thumbnail measurements as json.
+    """
+
+    async def run():
+        with tempfile.TemporaryDirectory() as workdir:
+            return {
+                "upload": await bench_upload(workdir, megabytes),
+                "thumbnails": await bench_thumbnails(workdir, images),
+            }
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
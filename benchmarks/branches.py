@@ -0,0 +1,140 @@
+"""
+Storage and rendering cost of a heavily edited conversation.
+
+Run from the project root:
+    python -m benchmarks.branches [messages] [edits]
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.headless import make_page, run_app
+from benchmarks.ui import SAMPLE_BOT, SAMPLE_USER
+
+# messages from the end of the conversation among which one is edited
+RECENT = 20
+
+
+def build_conversation(session, messages: int, edits: int) -> int:
+    """
+    Store a conversation, then edit one of its last user messages and carry
+    on chatting back to the same length, again and again. Returns the
+    messages a copy per branch would store.
+    """
+
+    conversation = session.conversation
+    conversation.new()
+
+    def chat():
+        while len(conversation.history) < messages:
+            if len(conversation.history) % 2 == 0:
+                conversation.append(
+                    "user", f"{len(conversation.history)}. {SAMPLE_USER}"
+                )
+            else:
+                conversation.append("assistant", SAMPLE_BOT)
+
+    chat()
+    generator = random.Random(0)
+    for edit in range(edits):
+        index = generator.randrange(max(0, messages - RECENT), messages, 2)
+        conversation.edit(index, f"Edit {edit}. {SAMPLE_USER}")
+        chat()
+    conversation.store.flush()
+    return messages * (edits + 1)
+
+
+def main(messages: int = 1000, edits: int = 200):
+    """
+    Print the stored rows and the cost of switching versions as json.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from components import add_messages, switch_branch
+    from session import sessions
+    from update_scheduler import scheduler
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        # the app opens its store in the working directory
+        os.chdir(workdir)
+        loop = asyncio.new_event_loop()
+        try:
+            page, connection = make_page(loop)
+            loop.run_until_complete(run_app(app.main, page))
+            session = sessions.sessions[page.session_id]
+            message_container = session.message_container
+            conversation = session.conversation
+
+            copied = build_conversation(session, messages, edits)
+            stored = (
+                conversation.store._reader()
+                .execute(
+                    "SELECT COUNT(*) FROM messages WHERE conversation_id = ?",
+                    (conversation.id,),
+                )
+                .fetchone()[0]
+            )
+
+            message_container.clear()
+            add_messages(page, message_container, conversation.messages())
+
+            # full rebuild of the branch shown, what switching cost before
+            sent = connection.bytes_sent
+            start = time.perf_counter()
+            message_container.clear()
+            add_messages(page, message_container, conversation.messages())
+            rebuild_ms = (time.perf_counter() - start) * 1000
+            rebuild_bytes = connection.bytes_sent - sent
+
+            # back and forth between the versions of the last edited message
+            fork = max(
+                index
+                for index in range(len(conversation.history))
+                if conversation.branch(index) is not None
+            )
+            samples = []
+            sent = connection.bytes_sent
+            for step in (-1, 1) * 10:
+                record = next(
+                    record
+                    for record in message_container.records
+                    if record.get("id") == conversation.ids[fork]
+                )
+                start = time.perf_counter()
+                loop.run_until_complete(switch_branch(page, session, record, step))
+                scheduler(page).flush()
+                samples.append((time.perf_counter() - start) * 1000)
+            switch_bytes = (connection.bytes_sent - sent) // len(samples)
+
+            results = {
+                "messages": messages,
+                "edits": edits,
+                "stored_messages": stored,
+                "copied_messages": copied,
+                "branch_length": len(conversation.history),
+                "fork_index": fork,
+                "rebuild": {
+                    "ms": round(rebuild_ms, 3),
+                    "bytes": rebuild_bytes,
+                },
+                "switch": {
+                    "mean_ms": round(sum(samples) / len(samples), 3),
+                    "max_ms": round(max(samples), 3),
+                    "bytes": switch_bytes,
+                },
+            }
+        finally:
+            loop.close()
+            os.chdir(cwd)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,131 @@
+"""
+A flet page without a client, for running the app in benchmarks.
+"""
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+import flet as ft  # type: ignore
+from flet_core.event import Event  # type: ignore
+from flet_core.local_connection import LocalConnection  # type: ignore
+from flet_core.protocol import (  # type: ignore
+    ClientActions,
+    ClientMessage,
+    CommandEncoder,
+    PageCommandResponsePayload,
+    PageCommandsBatchResponsePayload,
+)
+
+
+class HeadlessConnection(LocalConnection):
+    """
+    Connection that applies the page commands and only counts what would
+    have been sent to the client.
+
+    It answers the client storage calls of the page from ``storage``, the
+    local storage of the client, every connection is a client of its own
+    unless they are given the same one.
+    """
+
+    def __init__(self, storage: dict | None = None):
+        super().__init__()
+        self.page_url = "http://localhost"
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.storage = {} if storage is None else storage
+        self.page: ft.Page | None = None
+
+    def send_command(self, session_id: str, command):
+        result, message = self._process_command(command)
+        if message:
+            self._send(message)
+        if command.name == "invokeMethod":
+            self._answer(*command.values[:2], command.attrs)
+        return PageCommandResponsePayload(result=result, error="")
+
+    def _answer(self, method_id: str, method: str, arguments: dict):
+        if method == "clientStorage:get":
+            value = self.storage.get(arguments["key"])
+            result = None if value is None else json.dumps(value)
+        elif method == "clientStorage:set":
+            self.storage[arguments["key"]] = arguments["value"]
+            result = "true"
+        else:
+            return
+        data = json.dumps({"method_id": method_id, "result": result, "error": None})
+        # the page waits for the answer once the command is sent
+        self.page.loop.call_soon_threadsafe(
+            asyncio.ensure_future,
+            self.page.on_event_async(Event("page", "invoke_method_result", data)),
+        )
+
+    def send_commands(self, session_id: str, commands: list):
+        results = []
+        messages = []
+        for command in commands:
+            result, message = self._process_command(command)
+            if command.name in ["add", "get"]:
+                results.append(result)
+            if message:
+                messages.append(message)
+        if messages:
+            self._send(ClientMessage(ClientActions.PAGE_CONTROLS_BATCH, messages))
+        return PageCommandsBatchResponsePayload(results=results, error="")
+
+    def _send(self, message: ClientMessage):
+        self.messages_sent += 1
+        self.bytes_sent += len(
+            json.dumps(message, cls=CommandEncoder, separators=(",", ":"))
+        )
+
+
+def payload_size(control: ft.Control) -> int:
+    """
+    Bytes sent to the client to add the control.
+    """
+
+    commands = control._build_add_commands()  # pylint: disable=protected-access
+    return len(json.dumps(commands, cls=CommandEncoder, separators=(",", ":")))
+
+
+_session_ids = count(1)
+
+
+def make_page(
+    loop: asyncio.AbstractEventLoop, storage: dict | None = None
+) -> tuple[ft.Page, HeadlessConnection]:
+    """
+    Page of a light mode client, and its connection. Pages given the same
+    storage are the same user.
+
+    Sync event handlers run one at a time on a single worker thread, so
+    ``run_app`` can wait for them.
+    """
+
+    connection = HeadlessConnection(storage)
+    page = connection.page = ft.Page(
+        connection,
+        f"headless-{next(_session_ids)}",
+        loop=loop,
+        executor=ThreadPoolExecutor(max_workers=1),
+    )
+    page._set_attr("platformBrightness", "light")  # pylint: disable=protected-access
+    return page, connection
+
+
+async def run_app(target, page: ft.Page):
+    """
+    Run the app on the page until the events it started are handled.
+    """
+
+    await target(page)
+    # page.go() schedules the route change from the loop thread
+    await asyncio.sleep(0)
+    pending = asyncio.all_tasks() - {asyncio.current_task()}
+    if pending:
+        await asyncio.wait(pending)
+    # sync handlers were queued on the worker thread, wait until it is idle
+    await asyncio.sleep(0)
+    await page.loop.run_in_executor(page.executor, lambda: None)
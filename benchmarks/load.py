@@ -0,0 +1,508 @@
+"""
+Load test of the app served to browsers: simulated websocket clients chat
+with a local stub of the api, at rising numbers of concurrent sessions.
+
+Every level starts a fresh app server process, connects the clients, lets
+each of them send, stream and now and then stop replies, and reports the
+throughput, time to first token, tail latencies and the memory of the
+server per session.
+
+The app is served by flet's fastapi server, which needs uvicorn:
+    pip install fastapi uvicorn websockets
+
+Run from the project root:
+    python -m benchmarks.load [sessions ...] [--turns 3] [--token-rate 50]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.stub_llm import StubLLM
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_USER = "Generate me some sleek ui code for my flutter app"
+# what the browser tells the server about itself when it connects
+CLIENT_DETAILS = {
+    "pageName": "",
+    "pageRoute": "/",
+    "pageWidth": "1280",
+    "pageHeight": "800",
+    "windowWidth": "1280",
+    "windowHeight": "800",
+    "windowTop": "0",
+    "windowLeft": "0",
+    "isPWA": "false",
+    "isWeb": "true",
+    "isDebug": "false",
+    "platform": "linux",
+    "platformBrightness": "light",
+    "media": "{}",
+    "sessionId": "",
+}
+
+
+def serve(port: int, api_url: str):
+    """
+    Serve the app on the port, every session talking to the api url.
+
+    Runs in the app server process, the working directory holds its store.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import flet.fastapi as flet_fastapi  # type: ignore
+    import uvicorn  # type: ignore
+
+    import main as app
+    from session import sessions
+
+    async def session(page):
+        await app.main(page)
+        settings = sessions.sessions[page.session_id].settings
+        settings.api_url = api_url
+        # every reply goes to the api, not to the disk cache
+        settings.cache_responses = False
+
+    uvicorn.run(
+        flet_fastapi.app(session, assets_dir=os.path.join(ROOT, "assets")),
+        host="127.0.0.1",
+        port=port,
+        log_level="warning",
+    )
+
+
+def free_port() -> int:
+    """A port nobody listens on right now."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def rss_mb(pid: int) -> float | None:
+    """Resident memory of the process, None where /proc is missing."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def cpu_seconds(pid: int) -> float | None:
+    """User and system cpu time of the process, None where /proc is missing."""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentiles(samples: list[float]) -> dict:
+    """
+    Median and tail of timings in seconds, in milliseconds.
+    """
+
+    if not samples:
+        return {}
+    if len(samples) == 1:
+        cuts = samples * 99
+    else:
+        cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 1),
+        "p95_ms": round(cuts[94] * 1000, 1),
+        "p99_ms": round(cuts[98] * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+class SimulatedClient:
+    """
+    Browser session speaking the flet websocket protocol.
+
+    Keeps the tree of controls the server sends, and types and clicks
+    through it like a user would. Counts the updates that put text into a
+    markdown control, that is where replies stream to.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.timeout = timeout
+        self.controls: dict[str, dict] = {}
+        self.text_updates = 0
+        self.last_text = 0.0
+        self.failures = 0
+        self.closed = False
+        self._websocket = None
+        self._reader: asyncio.Task | None = None
+        self._changed = asyncio.Condition()
+
+    async def connect(self):
+        """
+        Open the session and wait until the chat is shown.
+        """
+
+        # pylint: disable=import-outside-toplevel
+        from websockets.asyncio.client import connect  # type: ignore
+
+        self._websocket = await connect(self.url, max_size=None)
+        await self._send("registerWebClient", CLIENT_DETAILS)
+        self._reader = asyncio.create_task(self._read())
+        await self.wait_for(lambda: self.find("textfield"))
+
+    async def close(self):
+        """
+        Leave like a closed browser tab.
+        """
+
+        if self._websocket is not None:
+            await self._websocket.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+    def find(self, control_type: str, **attrs) -> str | None:
+        """
+        Id of a control of the type with the attribute values, if shown.
+        """
+
+        for control in self.controls.values():
+            if control.get("t") == control_type and all(
+                control.get(name) == value for name, value in attrs.items()
+            ):
+                return control["i"]
+        return None
+
+    async def wait_for(self, predicate, timeout: float | None = None):
+        """
+        Wait until the predicate holds on the controls, returns its value.
+        """
+
+        async with self._changed:
+            value = await asyncio.wait_for(
+                self._changed.wait_for(lambda: self.closed or predicate()),
+                timeout or self.timeout,
+            )
+        if self.closed:
+            raise ConnectionError("the server closed the session")
+        return value
+
+    async def chat(self, prompt: str, stop_after: float | None = None) -> dict:
+        """
+        Send the prompt and wait for the reply, stopping it ``stop_after``
+        seconds after its first token when given.
+        """
+
+        field = self.find("textfield")
+        await self._send(
+            "updateControlProps", {"props": [{"i": field, "value": prompt}]}
+        )
+        await self._event(field, "change", prompt)
+        send = await self.wait_for(lambda: self.find("iconbutton", icon="arrow_upward"))
+
+        updates, failures = self.text_updates, self.failures
+        start = time.perf_counter()
+        await self._event(send, "click")
+        await self.wait_for(lambda: self.find("iconbutton", icon="stop"))
+        await self.wait_for(lambda: self.text_updates > updates)
+        first_token = self.last_text - start
+
+        stopped = False
+        if stop_after is not None:
+            await asyncio.sleep(stop_after)
+            stop = self.find("iconbutton", icon="stop")
+            if stop is not None:
+                stop_start = time.perf_counter()
+                await self._event(stop, "click")
+                stopped = True
+        await self.wait_for(lambda: self.find("iconbutton", icon="mic"))
+        end = time.perf_counter()
+        return {
+            "first_token": first_token,
+            "reply": end - start,
+            "stop": end - stop_start if stopped else None,
+            "failed": self.failures > failures,
+        }
+
+    async def _send(self, action: str, payload):
+        await self._websocket.send(json.dumps({"action": action, "payload": payload}))
+
+    async def _event(self, target: str, name: str, data: str = ""):
+        await self._send(
+            "pageEventFromWeb",
+            {"eventTarget": target, "eventName": name, "eventData": data},
+        )
+
+    async def _read(self):
+        try:
+            async for message in self._websocket:
+                message = json.loads(message)
+                await self._apply(message["action"], message["payload"])
+                async with self._changed:
+                    self._changed.notify_all()
+        except Exception:  # pylint: disable=broad-exception-caught
+            pass
+        finally:
+            self.closed = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def _apply(self, action: str, payload):
+        if action == "registerWebClient":
+            self.controls = payload["session"]["controls"]
+        elif action == "pageControlsBatch":
+            for message in payload:
+                await self._apply(message["action"], message["payload"])
+        elif action == "addPageControls":
+            for control in payload["controls"]:
+                parent = self.controls.get(control["p"])
+                if parent is not None and control["i"] not in parent["c"]:
+                    if "at" in control:
+                        parent["c"].insert(int(control["at"]), control["i"])
+                    else:
+                        parent["c"].append(control["i"])
+                self.controls[control["i"]] = control
+                self._received(control)
+        elif action == "updateControlProps":
+            for props in payload["props"]:
+                control = self.controls.get(props["i"])
+                if control is not None:
+                    control.update(props)
+                    self._received(control)
+        elif action == "removeControl":
+            for control_id in payload["ids"]:
+                control = self.controls.get(control_id)
+                parent = self.controls.get(control["p"]) if control else None
+                if parent is not None and control_id in parent["c"]:
+                    parent["c"].remove(control_id)
+                self._forget(control_id)
+        elif action == "cleanControl":
+            for control_id in payload["ids"]:
+                control = self.controls.get(control_id)
+                if control is not None:
+                    for child in control["c"]:
+                        self._forget(child)
+                    control["c"] = []
+        elif action == "invokeMethod":
+            # nothing to do in a simulated browser, report success
+            result = {"method_id": payload["methodId"], "result": None, "error": None}
+            await self._event("page", "invoke_method_result", json.dumps(result))
+        elif action == "sessionCrashed":
+            raise ConnectionError(payload)
+
+    def _received(self, control: dict):
+        if control.get("t") == "markdown" and control.get("value"):
+            self.text_updates += 1
+            self.last_text = time.perf_counter()
+            if "Request failed" in control["value"]:
+                self.failures += 1
+
+    def _forget(self, control_id: str):
+        control = self.controls.pop(control_id, None)
+        if control is not None:
+            for child in control["c"]:
+                self._forget(child)
+
+
+async def run_client(url: str, index: int, options, rng: random.Random) -> dict:
+    """
+    One user: connect, chat for the turns, leave.
+    """
+
+    client = SimulatedClient(url, options.timeout)
+    turns = []
+    errors = 0
+    start = time.perf_counter()
+    try:
+        await client.connect()
+        connected = time.perf_counter() - start
+        for turn in range(options.turns):
+            stop_after = (
+                rng.uniform(0.1, 0.5) if rng.random() < options.stop_rate else None
+            )
+            try:
+                turns.append(
+                    await client.chat(
+                        f"{index}.{turn} {SAMPLE_USER}", stop_after=stop_after
+                    )
+                )
+            except asyncio.TimeoutError:
+                errors += 1
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * options.think_time)
+    except (OSError, asyncio.TimeoutError):
+        return {"connect": None, "turns": turns, "errors": errors + 1}
+    finally:
+        await client.close()
+    return {"connect": connected, "turns": turns, "errors": errors}
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    """
+    Wait until the app server answers http.
+    """
+
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("the app server exited, is uvicorn installed?")
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("the app server did not start")
+
+
+async def run_level(count: int, options, stub: StubLLM, api_url: str) -> dict:
+    """
+    Start an app server, run ``count`` clients against it, stop it.
+    """
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.load", "--serve", str(port), api_url],
+            cwd=workdir,
+            env={**os.environ, "PYTHONPATH": ROOT},
+        )
+        try:
+            await wait_ready(f"http://127.0.0.1:{port}/", process)
+            idle_rss = rss_mb(process.pid)
+            cpu_start = cpu_seconds(process.pid)
+            before = stub.stats()
+            peak_rss = idle_rss or 0
+
+            async def sample():
+                nonlocal peak_rss
+                while True:
+                    peak_rss = max(peak_rss, rss_mb(process.pid) or 0)
+                    await asyncio.sleep(0.2)
+
+            sampler = asyncio.create_task(sample())
+            rng = random.Random(options.seed)
+            start = time.perf_counter()
+
+            async def delayed(index: int):
+                # clients arrive spread over the ramp up
+                await asyncio.sleep(options.ramp * index / count)
+                return await run_client(
+                    f"ws://127.0.0.1:{port}/ws",
+                    index,
+                    options,
+                    random.Random(rng.random()),
+                )
+
+            results = await asyncio.gather(*(delayed(index) for index in range(count)))
+            elapsed = time.perf_counter() - start
+            sampler.cancel()
+            cpu_end = cpu_seconds(process.pid)
+            after = stub.stats()
+        finally:
+            process.terminate()
+            process.wait()
+
+    turns = [turn for result in results for turn in result["turns"]]
+    completed = [turn for turn in turns if not turn["failed"] and turn["stop"] is None]
+    cpu = (
+        round((cpu_end - cpu_start) / elapsed * 100, 1)
+        if cpu_start is not None and cpu_end is not None
+        else None
+    )
+    return {
+        "sessions": count,
+        "connected": sum(result["connect"] is not None for result in results),
+        "connect": percentiles(
+            [result["connect"] for result in results if result["connect"] is not None]
+        ),
+        "replies": len(turns),
+        "completed": len(completed),
+        "stopped": sum(turn["stop"] is not None for turn in turns),
+        "failed": sum(turn["failed"] for turn in turns),
+        "timeouts": sum(result["errors"] for result in results),
+        "replies_per_s": round(len(turns) / elapsed, 2),
+        "tokens_per_s": round((after["tokens"] - before["tokens"]) / elapsed, 1),
+        "max_streaming": after["max_streaming"],
+        "first_token": percentiles(
+            [turn["first_token"] for turn in turns if not turn["failed"]]
+        ),
+        "reply": percentiles([turn["reply"] for turn in completed]),
+        "stop": percentiles(
+            [turn["stop"] for turn in turns if turn["stop"] is not None]
+        ),
+        "server_cpu_percent": cpu,
+        "server_rss_idle_mb": idle_rss,
+        "server_rss_peak_mb": peak_rss or None,
+        "server_rss_per_session_mb": (
+            round((peak_rss - idle_rss) / count, 2) if idle_rss else None
+        ),
+    }
+
+
+async def run(options):
+    """
+    Run every level against one stub api, print the results as json lines.
+    """
+
+    stub = StubLLM(
+        token_rate=options.token_rate,
+        latency=options.latency,
+        jitter=options.jitter,
+        reply_tokens=options.reply_tokens,
+        error_rate=options.error_rate,
+        disconnect_rate=options.disconnect_rate,
+        rate_limit=options.rate_limit,
+        seed=options.seed,
+    )
+    api_url = await stub.start()
+    try:
+        for count in options.sessions:
+            stub.max_streaming = 0
+            print(
+                json.dumps(await run_level(count, options, stub, api_url)), flush=True
+            )
+    finally:
+        await stub.close()
+
+
+def main():
+    """
+    Parse the options and run the levels, or serve the app for one.
+    """
+
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]), sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load")
+    parser.add_argument("sessions", type=int, nargs="*", default=[1, 10, 50])
+    parser.add_argument("--turns", type=int, default=3, help="replies per session")
+    parser.add_argument("--think-time", type=float, default=1.0, help="seconds")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds")
+    parser.add_argument("--stop-rate", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="per second")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="seconds")
+    parser.add_argument("--reply-tokens", type=int, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, help="api requests per second")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Bytes sent and server time while streaming a very long reply, as a single
+markdown control and split into segments.
+
+Run from the project root:
+    python -m benchmarks.long_reply [code_lines]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+import flet as ft  # type: ignore
+
+from benchmarks.headless import make_page
+from color_scheme import color_config
+from components import bot_message_bubble, switch_color_mode
+from streaming import MarkdownStream
+from update_scheduler import scheduler
+
+PARAGRAPH = (
+    "This part of the answer explains the next step in plain words, with a "
+    "bit of `inline code` and a [link](https://flet.dev) here and there.\n\n"
+)
+# characters per streamed delta
+DELTA_CHARS = 40
+
+
+def long_reply(code_lines: int) -> str:
+    """
+    Reply of paragraphs and three code blocks of ``code_lines`` lines.
+    """
+
+    code = "".join(
+        f"    value_{i} = compute({i})  # step {i}\n" for i in range(code_lines)
+    )
+    parts = []
+    for block in range(3):
+        parts.append(PARAGRAPH * 20)
+        parts.append(f"```python\ndef block_{block}():\n{code}```\n\n")
+    parts.append(PARAGRAPH * 5)
+    return "".join(parts)
+
+
+def single_markdown_bubble(page: ft.Page, message: str) -> ft.Container:
+    """Bot bubble as it was, one markdown control for the whole reply."""
+    markdown = color_config.of(page).themed(
+        ft.Markdown(value=message, extension_set=ft.MarkdownExtensionSet.GITHUB_WEB),
+        code_theme="CODE_THEME",
+    )
+    return ft.Container(content=markdown, padding=15)
+
+
+def measure(build, reply: str) -> dict:
+    """
+    Stream the reply into a bubble, then switch the color mode twice.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        page, connection = make_page(loop)
+        updates = scheduler(page)
+        bubble = build(page, "")
+        page.add(bubble)
+
+        async def stream():
+            writer = MarkdownStream(bubble.content, interval=0, updates=updates)
+            for start in range(0, len(reply), DELTA_CHARS):
+                writer.write(reply[start : start + DELTA_CHARS])
+                # one frame per delta, the worst case for the old bubble
+                updates.flush()
+            writer.close()
+            updates.flush()
+            return writer.flush_count
+
+        sent = connection.bytes_sent
+        start = time.perf_counter()
+        flushes = loop.run_until_complete(stream())
+        stream_ms = (time.perf_counter() - start) * 1000
+        stream_bytes = connection.bytes_sent - sent
+
+        sent = connection.bytes_sent
+        switch_color_mode(page, "dark")
+        switch_color_mode(page, "light")
+        theme_bytes = (connection.bytes_sent - sent) // 2
+    finally:
+        loop.close()
+    return {
+        "flushes": flushes,
+        "stream_bytes": stream_bytes,
+        "stream_ms": round(stream_ms, 1),
+        "bytes_per_flush": stream_bytes // max(1, flushes),
+        "theme_switch_bytes": theme_bytes,
+    }
+
+
+def main(code_lines: int = 1000):
+    """
+    Print both measurements as json.
+    """
+
+    reply = long_reply(code_lines)
+    print(
+        json.dumps(
+            {
+                "reply_chars": len(reply),
+                "reply_lines": reply.count("\n"),
+                "single_markdown": measure(single_markdown_bubble, reply),
+                "segmented": measure(
+                    lambda page, message: bot_message_bubble(page, message), reply
+                ),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
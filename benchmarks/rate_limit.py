@@ -0,0 +1,120 @@
+"""
+Requests of many sessions against a rate limited api, sent straight away
+and through the request scheduler.
+
+Run from the project root:
+    python -m benchmarks.rate_limit [sessions] [requests per session] [limit]
+"""
+
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+
+import httpx
+
+import request_scheduler
+from benchmarks.stub_llm import StubLLM
+from chat_api import close_clients, stream_chat
+from request_scheduler import RequestScheduler, scheduled_stream
+
+# parallel request loops of the one session that sends a lot
+HEAVY_LOOPS = 5
+MESSAGES = [{"role": "user", "content": "Generate me some sleek ui code"}]
+
+
+async def measure(sessions: int, requests: int, limit: float, scheduled: bool) -> dict:
+    """
+    Every session sends its requests one after the other, session 0 in
+    ``HEAVY_LOOPS`` loops at once. Returns what got through and when.
+    """
+
+    stub = StubLLM(
+        token_rate=200, latency=0.05, jitter=0, reply_tokens=20, rate_limit=limit
+    )
+    api_url = await stub.start()
+    requests_scheduler = RequestScheduler(limit * 60, max_in_flight=sessions * 2)
+    rng = random.Random(0)
+    completed = failed = 0
+    # seconds from asking to the first token, of the light sessions
+    light_waits = []
+
+    async def send(owner: int):
+        nonlocal completed, failed
+        start = time.perf_counter()
+        if scheduled:
+            deltas = scheduled_stream(
+                requests_scheduler,
+                owner,
+                lambda: stream_chat(api_url, MESSAGES),
+                rng=rng,
+            )
+        else:
+            deltas = stream_chat(api_url, MESSAGES)
+        first = None
+        try:
+            async for _ in deltas:
+                if first is None:
+                    first = time.perf_counter() - start
+            completed += 1
+        except httpx.HTTPError:
+            failed += 1
+        if owner != 0 and first is not None:
+            light_waits.append(first)
+
+    async def loop(owner: int, count: int):
+        for _ in range(count):
+            await send(owner)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(loop(0, requests) for _ in range(HEAVY_LOOPS)),
+        *(loop(owner, requests) for owner in range(1, sessions)),
+    )
+    elapsed = time.perf_counter() - start
+    await stub.close()
+    await close_clients()
+    return {
+        "completed": completed,
+        "failed": failed,
+        "api_requests": stub.requests,
+        "rate_limited_responses": stub.rate_limited,
+        "seconds": round(elapsed, 2),
+        "completed_per_s": round(completed / elapsed, 2),
+        "light_first_token_p50_ms": (
+            round(statistics.median(light_waits) * 1000, 1) if light_waits else None
+        ),
+        "light_first_token_max_ms": (
+            round(max(light_waits) * 1000, 1) if light_waits else None
+        ),
+        "scheduler": requests_scheduler.stats() if scheduled else None,
+    }
+
+
+def main(sessions: int = 20, requests: int = 5, limit: float = 20.0):
+    """
+    Print both runs as json.
+    """
+
+    # short backoffs, the stub asks for a second anyway
+    request_scheduler.BACKOFF_BASE = 0.25
+    results = {
+        "sessions": sessions,
+        "requests_per_session": requests,
+        "heavy_session_loops": HEAVY_LOOPS,
+        "api_limit_per_s": limit,
+        "direct": asyncio.run(measure(sessions, requests, limit, scheduled=False)),
+        "scheduled": asyncio.run(measure(sessions, requests, limit, scheduled=True)),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(
+        *(
+            float(arg) if index == 2 else int(arg)
+            for index, arg in enumerate(sys.argv[1:])
+        )
+    )
@@ -0,0 +1,110 @@
+"""
+Full-text search latency over a large chat history.
+
+Run from the project root:
+    python -m benchmarks.search [number of messages]
+"""
+
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from itertools import accumulate
+from string import ascii_lowercase
+
+from storage import ConversationStore
+
+
+def vocabulary(size: int = 5000, seed: int = 0) -> list[str]:
+    """
+    Made up words of 3 to 10 letters.
+    """
+
+    rng = random.Random(seed)
+    words: set[str] = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(ascii_lowercase, k=rng.randint(3, 10))))
+    shuffled = sorted(words)
+    rng.shuffle(shuffled)
+    return shuffled
+
+
+# zipf-like word frequencies, like real chat text
+VOCABULARY = vocabulary()
+WEIGHTS = list(accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+# a frequent, a mid frequency and a rare word, two words and a missing word,
+# typed out (trailing space) and while typing (matched as a prefix)
+WORDS = [
+    VOCABULARY[2],
+    VOCABULARY[40],
+    VOCABULARY[900],
+    f"{VOCABULARY[12]} {VOCABULARY[80]}",
+    "nothing",
+]
+QUERIES = [word + " " for word in WORDS] + WORDS + [VOCABULARY[12][:3]]
+MESSAGES_PER_CONVERSATION = 20
+
+
+def fill(store: ConversationStore, messages: int, seed: int = 0):
+    """
+    Store random conversations with the given number of messages in total.
+    """
+
+    rng = random.Random(seed)
+    for start in range(0, messages, MESSAGES_PER_CONVERSATION):
+        conversation_id = store.create_conversation(
+            " ".join(rng.choices(VOCABULARY, cum_weights=WEIGHTS, k=4))
+        )
+        for n in range(min(MESSAGES_PER_CONVERSATION, messages - start)):
+            store.append_message(
+                conversation_id,
+                "user" if n % 2 == 0 else "assistant",
+                " ".join(
+                    rng.choices(VOCABULARY, cum_weights=WEIGHTS, k=rng.randint(8, 60))
+                ),
+            )
+    store.flush()
+
+
+def main(messages: int = 100_000, rounds: int = 20):
+    """
+    Print the search latency per query as json.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ConversationStore(os.path.join(directory, "bench.db"))
+        start = time.perf_counter()
+        fill(store, messages)
+        fill_seconds = time.perf_counter() - start
+
+        results = {}
+        for query in QUERIES:
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                found = store.search(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            results[query] = {
+                "results": len(found),
+                "p50_ms": round(statistics.median(timings), 3),
+                "max_ms": round(max(timings), 3),
+            }
+        store.close()
+
+    print(
+        json.dumps(
+            {
+                "messages": messages,
+                "index_seconds": round(fill_seconds, 2),
+                "queries": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
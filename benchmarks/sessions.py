@@ -0,0 +1,118 @@
+"""
+Memory held by many concurrent sessions before and after idle eviction.
+
+Run from the project root:
+    python -m benchmarks.sessions [sessions] [messages per session]
+"""
+
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.headless import make_page, run_app
+
+SAMPLE_USER = "Generate me some sleek ui code for my flutter app"
+SAMPLE_BOT = (
+    "Sure, let me do that for you.\n```python\nfor i in range(10):\n\tprint(i)\n```"
+)
+
+
+def start_sessions(loop: asyncio.AbstractEventLoop, count: int, messages: int):
+    """
+    Start sessions each showing a stored conversation they sent.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import main
+    from components import add_messages
+    from session import sessions
+
+    started = []
+    for _ in range(count):
+        page, _ = make_page(loop)
+        loop.run_until_complete(run_app(main.main, page))
+        session = sessions.sessions[page.session_id]
+        session.message_container.clear()
+        session.conversation.new()
+        for index in range(messages):
+            role = "user" if index % 2 == 0 else "assistant"
+            session.conversation.append(
+                role, SAMPLE_USER if role == "user" else SAMPLE_BOT
+            )
+        add_messages(page, session.message_container, session.conversation.history)
+        # as sending the last message did
+        session.context.build(
+            session.conversation.history,
+            session.settings.model_instruction,
+            session.settings.context_budget,
+        )
+        started.append(session)
+    return started
+
+
+def main(count: int = 200, messages: int = 500):
+    """
+    Print the memory of the sessions while active and once evicted as json.
+    """
+
+    from session import sessions  # pylint: disable=import-outside-toplevel
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        # the app opens its store in the working directory
+        os.chdir(workdir)
+        loop = asyncio.new_event_loop()
+        try:
+            tracemalloc.start()
+            started = start_sessions(loop, count, messages)
+            gc.collect()
+            active_bytes = tracemalloc.get_traced_memory()[0]
+            active_chars = sessions.memory()
+
+            # every client left long enough ago
+            for session in started:
+                session.pause()
+                session.idle_since -= sessions.idle_timeout
+            start = time.perf_counter()
+            evicted = sessions.sweep()
+            sweep_ms = (time.perf_counter() - start) * 1000
+            gc.collect()
+            idle_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            start = time.perf_counter()
+            started[0].resume()
+            restore_ms = (time.perf_counter() - start) * 1000
+        finally:
+            loop.close()
+            os.chdir(cwd)
+
+    print(
+        json.dumps(
+            {
+                "sessions": count,
+                "messages_per_session": messages,
+                "active_mb": round(active_bytes / 2**20, 1),
+                "active_message_chars": active_chars,
+                "evicted_sessions": evicted,
+                "sweep_ms": round(sweep_ms, 3),
+                "idle_mb": round(idle_bytes / 2**20, 1),
+                "idle_message_chars": sessions.memory() - started[0].memory(),
+                "idle_counted_messages": sum(
+                    session.context.counted for session in started[1:]
+                ),
+                "restore_one_ms": round(restore_ms, 3),
+                "restored_messages": len(started[0].conversation.history),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
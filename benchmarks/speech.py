@@ -0,0 +1,109 @@
+"""
+Read Aloud latency with and without the speech cache, against the stub
+text to speech endpoint.
+
+Run from the project root:
+    python -m benchmarks.speech [texts]
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.stub_tts import StubTTS
+
+SAMPLE_TEXT = (
+    "Sure, let me do that for you. Here is a loop printing the numbers up to "
+    "ten, run it and tell me if you need anything else. "
+)
+
+
+async def fetch(client: httpx.AsyncClient, url: str) -> tuple[float, float, int]:
+    """
+    Seconds to the first chunk and to the end of the audio, and its size.
+    """
+
+    start = time.perf_counter()
+    first = None
+    size = 0
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            if first is None:
+                first = time.perf_counter() - start
+            size += len(chunk)
+    return first or 0.0, time.perf_counter() - start, size
+
+
+def summary(samples: list[float]) -> dict:
+    """Mean and worst of samples in seconds, as milliseconds."""
+    return {
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+    }
+
+
+async def run(texts: int) -> dict:
+    """
+    Read every text twice, then once more by a second voice and with
+    several players asking for the same text at the same time.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from chat_api import stream_speech
+    from speech import AudioCache, SpeechServer, speech_key
+
+    stub = StubTTS()
+    api_url = await stub.start()
+    with tempfile.TemporaryDirectory() as directory:
+        server = SpeechServer(AudioCache(directory))
+        results = {}
+        async with httpx.AsyncClient(timeout=30) as client:
+
+            async def url(text: str, voice: str) -> str:
+                return await server.url(
+                    speech_key(text, voice),
+                    lambda: stream_speech(api_url, text, voice, client=client),
+                )
+
+            texts_read = [f"{index}. {SAMPLE_TEXT * 4}" for index in range(texts)]
+            for name in ("uncached", "cached"):
+                samples = [
+                    await fetch(client, await url(text, "Alloy")) for text in texts_read
+                ]
+                results[name] = {
+                    "first_chunk": summary([first for first, _, _ in samples]),
+                    "complete": summary([total for _, total, _ in samples]),
+                    "audio_bytes": samples[0][2],
+                }
+
+            # another voice is another audio
+            await fetch(client, await url(texts_read[0], "Echo"))
+
+            # players asking at once share one synthesis
+            shared = await url("Read by everybody at once.", "Alloy")
+            await asyncio.gather(*(fetch(client, shared) for _ in range(8)))
+
+        results["upstream_requests"] = stub.requests
+        results["syntheses"] = server.syntheses
+        results["cache"] = server.cache.stats()
+        await server.close()
+    await stub.close()
+    return results
+
+
+def main(texts: int = 10):
+    """
+    Print the latencies and counters as json.
+    """
+
+    results = asyncio.run(run(texts))
+    print(json.dumps({"texts": texts, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
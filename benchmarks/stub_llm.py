@@ -0,0 +1,229 @@
+"""
+Local stand-in for an OpenAI compatible chat completions endpoint.
+
+Streams ``POST .../chat/completions`` replies as server sent events at a
+set token rate, after a set latency, and fails a share of the requests on
+purpose, so the app can be tried and load tested without an api.
+
+Run from the project root and set the Api Url to the printed url:
+    python -m benchmarks.stub_llm [port] [tokens per second]
+"""
+
+import asyncio
+import json
+import random
+import sys
+import time
+
+WORDS = (
+    "Sure here is how the layout of your app could look with a column of "
+    "cards and a floating button that opens the editor in place"
+).split()
+
+
+class StubLLM:
+    """
+    Counts the requests it answered, the tokens it streamed and the streams
+    open at the same time.
+
+    Parameters:
+    - token_rate = tokens per second of every stream
+    - latency = seconds before the first token, ``jitter`` seconds more at
+      most
+    - reply_tokens = tokens per reply
+    - error_rate = share of requests answered with a 500
+    - disconnect_rate = share of streams cut off halfway
+    - rate_limit = requests per second answered before the rest get a 429,
+      no limit when None
+    """
+
+    def __init__(
+        self,
+        token_rate: float = 50.0,
+        latency: float = 0.2,
+        jitter: float = 0.1,
+        reply_tokens: int = 100,
+        error_rate: float = 0.0,
+        disconnect_rate: float = 0.0,
+        rate_limit: float | None = None,
+        seed: int | None = None,
+    ):
+        self.token_rate = token_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.disconnects = 0
+        self.tokens = 0
+        self.streaming = 0
+        self.max_streaming = 0
+        self.port: int | None = None
+        self._random = random.Random(seed)
+        # token bucket of the rate limit, one second worth of requests
+        self._allowance = rate_limit or 0.0
+        self._allowance_at = time.monotonic()
+        self._server: asyncio.Server | None = None
+        # open connection -> the task answering it
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    async def start(self, port: int = 0) -> str:
+        """
+        Listen on the port, a free one by default. Returns the api url.
+        """
+
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def close(self):
+        """
+        Stop listening.
+        """
+
+        if self._server is not None:
+            self._server.close()
+            # idle kept alive connections end their handlers once closed
+            handlers = list(self._connections.values())
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def stats(self) -> dict:
+        """What the server answered so far."""
+        return {
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            "disconnects": self.disconnects,
+            "tokens": self.tokens,
+            "max_streaming": self.max_streaming,
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # connections are kept alive, the app pools them
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while await self._answer(reader, writer):
+                pass
+        except (asyncio.IncompleteReadError, ValueError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _answer(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bool:
+        head = await reader.readuntil(b"\r\n\r\n")
+        method, target, _ = head.split(b"\r\n", 1)[0].split(b" ", 2)
+        length = 0
+        for line in head.split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value)
+        await reader.readexactly(length)
+        if method == b"HEAD":
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            return True
+        if method != b"POST" or not target.endswith(b"/chat/completions"):
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            return True
+
+        self.requests += 1
+        if not self._allow():
+            self.rate_limited += 1
+            error = b'{"error": {"message": "Rate limit reached"}}'
+            writer.write(
+                b"HTTP/1.1 429 Too Many Requests\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Retry-After: 1\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (len(error), error)
+            )
+            return True
+        await asyncio.sleep(self.latency + self._random.random() * self.jitter)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            error = b'{"error": {"message": "Injected failure"}}'
+            writer.write(
+                b"HTTP/1.1 500 Internal Server Error\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (len(error), error)
+            )
+            return True
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        cut_at = (
+            self.reply_tokens // 2
+            if self._random.random() < self.disconnect_rate
+            else None
+        )
+        self.streaming += 1
+        self.max_streaming = max(self.max_streaming, self.streaming)
+        try:
+            start = time.monotonic()
+            for index in range(self.reply_tokens):
+                if index == cut_at:
+                    self.disconnects += 1
+                    return False
+                token = WORDS[index % len(WORDS)] + " "
+                event = json.dumps({"choices": [{"delta": {"content": token}}]})
+                self._write_chunk(writer, f"data: {event}\n\n".encode())
+                self.tokens += 1
+                await writer.drain()
+                # paced from the start, a slow loop does not slow the rate
+                delay = start + (index + 1) / self.token_rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self._write_chunk(writer, b"data: [DONE]\n\n")
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            self.streaming -= 1
+        return True
+
+    def _allow(self) -> bool:
+        if self.rate_limit is None:
+            return True
+        now = time.monotonic()
+        self._allowance = min(
+            self.rate_limit,
+            self._allowance + (now - self._allowance_at) * self.rate_limit,
+        )
+        self._allowance_at = now
+        if self._allowance < 1:
+            return False
+        self._allowance -= 1
+        return True
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes):
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+
+async def serve(port: int, token_rate: float):
+    """
+    Serve until interrupted.
+    """
+
+    stub = StubLLM(token_rate=token_rate)
+    print(await stub.start(port), flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        serve(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 8766,
+            float(sys.argv[2]) if len(sys.argv) > 2 else 50.0,
+        )
+    )
@@ -0,0 +1,97 @@
+"""
+Local stand-in for a text to speech endpoint.
+
+Answers ``POST .../audio/speech`` with fake mp3 bytes in fixed chunks after
+a synthesis delay, so Read Aloud can be tried and measured without an api.
+
+Run from the project root and set the Api Url to the printed url:
+    python -m benchmarks.stub_tts [port]
+"""
+
+import asyncio
+import json
+import sys
+
+# bytes of audio per character of input, about what 128 kbit/s speech takes
+BYTES_PER_CHAR = 1000
+CHUNK_SIZE = 8 * 1024
+
+
+class StubTTS:
+    """
+    Counts the requests it answered and the seconds it waits before the
+    first chunk and between chunks.
+    """
+
+    def __init__(self, first_chunk_delay: float = 0.3, chunk_delay: float = 0.005):
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        self.port: int | None = None
+        self._server: asyncio.Server | None = None
+
+    async def start(self, port: int = 0) -> str:
+        """
+        Listen on the port, a free one by default. Returns the api url.
+        """
+
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def close(self):
+        """
+        Stop listening.
+        """
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            body = json.loads(await reader.readexactly(length) or b"{}")
+            if not head.split(b" ", 2)[1].endswith(b"/audio/speech"):
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                return
+            self.requests += 1
+            audio = (body.get("voice", "") + body.get("input", "")).encode()
+            size = max(len(body.get("input", "")) * BYTES_PER_CHAR, 1)
+            audio = (audio * (size // max(len(audio), 1) + 1))[:size]
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: audio/mpeg\r\n"
+                b"Transfer-Encoding: chunked\r\n\r\n"
+            )
+            await asyncio.sleep(self.first_chunk_delay)
+            for start in range(0, len(audio), CHUNK_SIZE):
+                chunk = audio[start : start + CHUNK_SIZE]
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+                await asyncio.sleep(self.chunk_delay)
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(port: int):
+    """
+    Serve until interrupted.
+    """
+
+    stub = StubTTS()
+    print(await stub.start(port), flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8765))
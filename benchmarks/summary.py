@@ -0,0 +1,114 @@
+"""
+Prompt size of a long chat with and without the rolling summary, made by
+a deterministic local summarizer instead of the api.
+
+Run from the project root:
+    python -m benchmarks.summary [turns] [threshold]
+"""
+
+import asyncio
+import hashlib
+import json
+import sys
+import time
+
+from benchmarks.ui import SAMPLE_BOT, SAMPLE_USER
+from context_window import DEFAULT_BUDGET, ContextWindow
+from summary import RollingSummary
+
+# characters of summary the stub keeps, the newest ones
+SUMMARY_CHARS = 2000
+# turns of the chat a summary takes to come back
+SUMMARY_TURNS = 3
+
+
+class StubSummarizer:
+    """
+    Summarizer that keeps the first words of every message, the same
+    messages always give the same summary. It answers after ``turns``
+    passes of the event loop, so it is done at the same turn on every run.
+    """
+
+    def __init__(self, turns: int = SUMMARY_TURNS, words: int = 8):
+        self.turns = turns
+        self.words = words
+        self.calls = 0
+        self.summarized_words = 0
+
+    async def __call__(self, summary: str, messages: list[dict]) -> str:
+        self.calls += 1
+        self.summarized_words += sum(
+            len(message["content"].split()) for message in messages
+        )
+        for _ in range(self.turns):
+            await asyncio.sleep(0)
+        lines = [
+            f"{message['role']}: {' '.join(message['content'].split()[:self.words])}"
+            for message in messages
+        ]
+        return "\n".join([summary, *lines]).strip()[-SUMMARY_CHARS:]
+
+
+async def chat(turns: int, threshold: int | None) -> dict:
+    """
+    Chat for the turns, compacting the requests when a threshold is given.
+    Returns the tokens of the requests sent.
+    """
+
+    context = ContextWindow()
+    summary = RollingSummary(context)
+    summarize = StubSummarizer()
+    history: list[dict] = []
+    sizes = []
+    build_ms = []
+    digest = hashlib.sha256()
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"{turn}. {SAMPLE_USER}"})
+        start = time.perf_counter()
+        message, covered = (
+            summary.compact(history, summarize, threshold)
+            if threshold is not None
+            else (None, 0)
+        )
+        request = context.build(history, "", DEFAULT_BUDGET, message, covered)
+        build_ms.append((time.perf_counter() - start) * 1000)
+        sizes.append(sum(context.message_tokens(message) for message in request))
+        digest.update(json.dumps(request).encode())
+        history.append({"role": "assistant", "content": SAMPLE_BOT})
+        # one pass of the loop per turn, the background summary goes on
+        await asyncio.sleep(0)
+    await summary.wait()
+    return {
+        "mean_tokens": round(sum(sizes) / len(sizes)),
+        "max_tokens": max(sizes),
+        "total_tokens": sum(sizes),
+        "last_tokens": sizes[-1],
+        "history_tokens": context.total,
+        "summarized_messages": summary.covered,
+        "summaries": summarize.calls,
+        "summary_input_words": summarize.summarized_words,
+        "mean_build_ms": round(sum(build_ms) / len(build_ms), 4),
+        "requests_sha256": digest.hexdigest()[:16],
+    }
+
+
+def main(turns: int = 500, threshold: int = 8000):
+    """
+    Print the request sizes as json.
+    """
+
+    compacted = asyncio.run(chat(turns, threshold))
+    again = asyncio.run(chat(turns, threshold))
+    results = {
+        "turns": turns,
+        "threshold": threshold,
+        "budget": DEFAULT_BUDGET,
+        "full": asyncio.run(chat(turns, None)),
+        "summarized": compacted,
+        "deterministic": again["requests_sha256"] == compacted["requests_sha256"],
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,43 @@
+"""
+Serialized payload size of a bot message with and without the shared theme.
+
+Run from the project root:
+    python -m benchmarks.theme_payload
+"""
+
+import json
+
+from benchmarks.headless import payload_size
+from color_scheme import color_config
+from components import bot_message_bubble, bot_message_theme
+
+SAMPLE = (
+    "Sure, let me do that for you.\n```python\nfor i in range(10):\n\tprint(i)\n```"
+)
+
+
+def main():
+    """
+    Print the payload size per bot message before and after as json.
+    """
+
+    shared = bot_message_bubble(None, SAMPLE)
+    inline = bot_message_bubble(None, SAMPLE)
+    # what every bot message used to carry
+    inline.theme = bot_message_theme(color_config.of(None))
+
+    before = payload_size(inline)
+    after = payload_size(shared)
+    print(
+        json.dumps(
+            {
+                "bytes_per_message_before": before,
+                "bytes_per_message_after": after,
+                "saved_percent": round(100 * (before - after) / before, 1),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
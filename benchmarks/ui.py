@@ -0,0 +1,360 @@
+"""
+Startup time, control build cost and tree size of the app, without a display.
+
+Run from the project root:
+    python -m benchmarks.ui [repeat]
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import flet as ft  # type: ignore
+
+from benchmarks.headless import make_page, payload_size, run_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TREE_SIZES = [10, 100, 1000]
+HISTORY_SIZE = 50_000
+SAMPLE_USER = "Generate me some sleek ui code for my flutter app"
+SAMPLE_BOT = (
+    "Sure, let me do that for you.\n```python\nfor i in range(10):\n\tprint(i)\n```"
+)
+
+# run in a fresh interpreter so nothing is imported yet
+STARTUP_SCRIPT = """
+import asyncio, json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from benchmarks.headless import make_page, run_app
+loop = asyncio.new_event_loop()
+page, _ = make_page(loop)
+loop.run_until_complete(run_app(main.main, page))
+ready = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "main_ms": (ready - imported) * 1000}))
+"""
+
+
+def summary(samples_ms: list[float]) -> dict:
+    """
+    Median and spread of timings in milliseconds.
+    """
+
+    return {
+        "p50_ms": round(statistics.median(samples_ms), 3),
+        "min_ms": round(min(samples_ms), 3),
+        "max_ms": round(max(samples_ms), 3),
+    }
+
+
+def timed(function, repeat: int) -> dict:
+    """
+    Time repeated calls of the function.
+    """
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summary(samples)
+
+
+def bench_startup(workdir: str, repeat: int) -> dict:
+    """
+    Cold import of the app and setup of its page by main().
+    """
+
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE="1")
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            cwd=workdir,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return {
+        "import": summary([run["import_ms"] for run in runs]),
+        "main": summary([run["main_ms"] for run in runs]),
+    }
+
+
+def start_app(loop: asyncio.AbstractEventLoop):
+    """
+    Run main() on a headless page and return the page, its connection and
+    the message list.
+    """
+
+    import main  # pylint: disable=import-outside-toplevel
+
+    page, connection = make_page(loop)
+    loop.run_until_complete(run_app(main.main, page))
+    message_container = page.views[0].controls[0].content.controls[0]
+    message_container.clear()
+    message_container.update()
+    return page, connection, message_container
+
+
+def bench_build(loop: asyncio.AbstractEventLoop, repeat: int) -> dict:
+    """
+    Cost of the controls built on the hot paths.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from components import (
+        bot_message,
+        bot_message_bubble,
+        navigation_drawer,
+        user_message,
+        user_message_bubble,
+    )
+    from conversation import Conversation
+    from storage import open_store
+    from update_scheduler import scheduler
+
+    page, _, message_container = start_app(loop)
+    store = open_store()
+    for index in range(50):
+        conversation_id = store.create_conversation(f"Conversation {index}")
+        store.append_message(conversation_id, "user", SAMPLE_USER)
+    store.flush()
+
+    results = {
+        "user_message_bubble": timed(
+            lambda: user_message_bubble(page, SAMPLE_USER), repeat
+        ),
+        "bot_message_bubble": timed(
+            lambda: bot_message_bubble(page, SAMPLE_BOT), repeat
+        ),
+        # appended to the list and sent to the client
+        "user_message": timed(
+            lambda: (
+                user_message(page, message_container, SAMPLE_USER, "text"),
+                scheduler(page).flush(),
+            ),
+            repeat,
+        ),
+        "bot_message": timed(
+            lambda: (
+                bot_message(page, message_container, SAMPLE_BOT, "text"),
+                scheduler(page).flush(),
+            ),
+            repeat,
+        ),
+        "navigation_drawer": timed(
+            lambda: navigation_drawer(page, message_container, Conversation(store)),
+            repeat,
+        ),
+    }
+    # let the history pages the drawers asked for load
+    settle(loop)
+    return results
+
+
+def sample_messages(size: int) -> list[dict]:
+    """
+    Conversation of alternating user and bot messages.
+    """
+
+    return [
+        (
+            {"role": "user", "content": SAMPLE_USER}
+            if index % 2 == 0
+            else {"role": "assistant", "content": SAMPLE_BOT}
+        )
+        for index in range(size)
+    ]
+
+
+def bench_tree_size(loop: asyncio.AbstractEventLoop) -> dict:
+    """
+    Serialized size of the main view holding a conversation of n messages.
+    """
+
+    from components import add_messages  # pylint: disable=import-outside-toplevel
+
+    results = {}
+    for size in TREE_SIZES:
+        page, connection, message_container = start_app(loop)
+        sent = connection.bytes_sent
+        add_messages(page, message_container, sample_messages(size))
+        results[str(size)] = {
+            "tree_bytes": payload_size(page.views[0]),
+            "update_bytes": connection.bytes_sent - sent,
+            "live_messages": message_container.live_count(),
+        }
+    return results
+
+
+def settle(loop: asyncio.AbstractEventLoop):
+    """
+    Run the loop until every task scheduled on it is done.
+    """
+
+    async def wait():
+        await asyncio.sleep(0)
+        pending = asyncio.all_tasks() - {asyncio.current_task()}
+        if pending:
+            await asyncio.wait(pending)
+
+    loop.run_until_complete(wait())
+
+
+def bench_send(loop: asyncio.AbstractEventLoop, repeat: int) -> dict:
+    """
+    Websocket messages sent while typing and sending a message, without an
+    api url so the reply is the hint to set one.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from update_scheduler import FRAME_INTERVAL, scheduler
+
+    page, connection, _ = start_app(loop)
+    _, text_field, switch_send = page.views[0].controls[1].content.controls[1].controls
+    sent = connection.messages_sent, connection.bytes_sent
+    for _ in range(repeat):
+        for end in range(1, len(SAMPLE_USER) + 1, 8):
+            text_field.value = SAMPLE_USER[:end]
+            loop.run_until_complete(text_field.on_change(None))
+        loop.run_until_complete(switch_send.content.on_click(None))
+        settle(loop)
+        # the last frame of the send
+        loop.run_until_complete(asyncio.sleep(2 * FRAME_INTERVAL))
+    return {
+        "sends": repeat,
+        "messages_per_send": (connection.messages_sent - sent[0]) / repeat,
+        "bytes_per_send": (connection.bytes_sent - sent[1]) // repeat,
+        "scheduler": scheduler(page).stats(),
+    }
+
+
+def bench_history(loop: asyncio.AbstractEventLoop, size: int = HISTORY_SIZE) -> dict:
+    """
+    Opening the navigation menu and paging through a long message history,
+    against building every history item up front.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from components import message_history_date, message_history_item
+    from components import navigation_drawer
+    from conversation import Conversation
+    from history_list import HistoryList, history_date_label
+    from storage import ConversationStore
+
+    store = ConversationStore("history.db")
+    now = time.time()
+    with sqlite3.connect("history.db") as connection:
+        # one conversation every ten minutes back from now
+        connection.executemany(
+            "INSERT INTO conversations (title, created_at, updated_at)"
+            " VALUES (?, ?, ?)",
+            (
+                (f"Conversation {index}", now - index * 600, now - index * 600)
+                for index in range(size)
+            ),
+        )
+
+    page, connection, message_container = start_app(loop)
+    sent = connection.bytes_sent
+    start = time.perf_counter()
+    # what the menu button of the appbar does
+    view = page.views[0]
+    view.drawer = navigation_drawer(page, message_container, Conversation(store))
+    view.drawer.open = True
+    view.update()
+    opened = time.perf_counter()
+    settle(loop)
+    first_page = time.perf_counter()
+    open_bytes = connection.bytes_sent - sent
+
+    history = HistoryList(store, lambda row: ft.Text(row["title"]), ft.Text)
+    pages = []
+    while not history.exhausted and len(pages) < 100:
+        page_start = time.perf_counter()
+        loop.run_until_complete(history.load_more())
+        pages.append((time.perf_counter() - page_start) * 1000)
+
+    start_eager = time.perf_counter()
+    controls = []
+    last_label = None
+    for item in store.list_conversations(limit=size):
+        label = history_date_label(item["updated_at"])
+        if label != last_label:
+            controls.append(message_history_date(page, label))
+            last_label = label
+        controls.append(message_history_item(page, item["title"]))
+    eager_ms = (time.perf_counter() - start_eager) * 1000
+    store.close()
+
+    return {
+        "conversations": size,
+        "open_ms": round((opened - start) * 1000, 3),
+        "first_page_ms": round((first_page - start) * 1000, 3),
+        "open_bytes": open_bytes,
+        "next_page": summary(pages),
+        "eager_build_ms": round(eager_ms, 3),
+    }
+
+
+def bench_theme_switch(loop: asyncio.AbstractEventLoop) -> dict:
+    """
+    Light to dark switch of the main view holding the largest conversation.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from components import add_messages, switch_color_mode
+
+    page, connection, message_container = start_app(loop)
+    add_messages(page, message_container, sample_messages(TREE_SIZES[-1]))
+    sent = connection.messages_sent, connection.bytes_sent
+    start = time.perf_counter()
+    switch_color_mode(page, "dark")
+    elapsed = (time.perf_counter() - start) * 1000
+    result = {
+        "messages": TREE_SIZES[-1],
+        "switch_ms": round(elapsed, 3),
+        "updates_sent": connection.messages_sent - sent[0],
+        "update_bytes": connection.bytes_sent - sent[1],
+    }
+    switch_color_mode(page, "light")
+    return result
+
+
+def main(repeat: int = 200):
+    """
+    Print every measurement as json.
+    """
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        # the app opens its store in the working directory
+        os.chdir(workdir)
+        loop = asyncio.new_event_loop()
+        try:
+            results = {
+                "startup": bench_startup(workdir, max(1, repeat // 40)),
+                "build": bench_build(loop, repeat),
+                "tree_size": bench_tree_size(loop),
+                "theme_switch": bench_theme_switch(loop),
+                "send": bench_send(loop, max(1, repeat // 10)),
+                "history": bench_history(loop),
+            }
+        finally:
+            loop.close()
+            os.chdir(cwd)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
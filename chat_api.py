@@ -0,0 +1,297 @@
+"""
+Client for OpenAI compatible chat completion endpoints.
+"""
+
+import json
+import time
+import uuid
+from importlib.util import find_spec
+from typing import AsyncIterator, Awaitable, Callable
+
+import httpx
+
+HTTP2_AVAILABLE = find_spec("h2") is not None
+
+# seconds an idle connection is kept open in the pool
+KEEPALIVE_EXPIRY = 60
+DEFAULT_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=20,
+    keepalive_expiry=KEEPALIVE_EXPIRY,
+)
+DEFAULT_TIMEOUT = httpx.Timeout(60, connect=10)
+
+
+# shared clients by (endpoint origin, http2)
+_clients: dict[tuple[str, bool], httpx.AsyncClient] = {}
+_warmed_up: dict[str, float] = {}
+
+
+def endpoint_origin(api_url: str) -> str:
+    """
+    Scheme, host and port of the api url, what a connection pool is kept for.
+    """
+
+    url = httpx.URL(api_url.strip())
+    return str(url.copy_with(path="/", query=None, fragment=None))
+
+
+def get_client(api_url: str, http2: bool = False) -> httpx.AsyncClient:
+    """
+    Shared http client of the endpoint.
+
+    The client keeps connections alive between requests, so only the first
+    message pays for the tcp and tls handshakes. HTTP/2 is only used when
+    asked for and the h2 package is installed. Sessions with other timeouts
+    share the client, the timeout is passed with every request.
+    """
+
+    http2 = http2 and HTTP2_AVAILABLE
+    key = (endpoint_origin(api_url), http2)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        client = _clients[key] = httpx.AsyncClient(
+            http2=http2, timeout=DEFAULT_TIMEOUT, limits=DEFAULT_LIMITS
+        )
+    return client
+
+
+async def warm_up(
+    api_url: str, http2: bool = False, timeout: httpx.Timeout = DEFAULT_TIMEOUT
+):
+    """
+    Open a connection to the endpoint ahead of the first message.
+
+    Does nothing when a connection was opened recently enough to still be
+    alive in the pool.
+    """
+
+    try:
+        origin = endpoint_origin(api_url)
+    except httpx.InvalidURL:
+        return
+    now = time.monotonic()
+    last = _warmed_up.get(origin)
+    if last is not None and now - last < KEEPALIVE_EXPIRY:
+        return
+    _warmed_up[origin] = now
+    try:
+        await get_client(api_url, http2).head(origin, timeout=timeout)
+    except httpx.HTTPError:
+        # the real request reports the error, this was only a head start
+        _warmed_up.pop(origin, None)
+
+
+async def close_clients():
+    """
+    Close every shared client and its connections.
+    """
+
+    clients = list(_clients.values())
+    _clients.clear()
+    _warmed_up.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def completions_url(api_url: str) -> str:
+    """
+    Resolve the chat completions endpoint from the api url in the settings.
+
+    Both a base url (``https://host/v1``) and the full endpoint are accepted.
+    """
+
+    api_url = api_url.strip().rstrip("/")
+    if api_url.endswith("/chat/completions"):
+        return api_url
+    return api_url + "/chat/completions"
+
+
+def speech_url(api_url: str) -> str:
+    """
+    Resolve the text to speech endpoint from the api url in the settings.
+    """
+
+    api_url = api_url.strip().rstrip("/")
+    if api_url.endswith("/audio/speech"):
+        return api_url
+    api_url = api_url.removesuffix("/chat/completions")
+    return api_url + "/audio/speech"
+
+
+def files_url(api_url: str) -> str:
+    """
+    Resolve the file upload endpoint from the api url in the settings.
+    """
+
+    api_url = api_url.strip().rstrip("/")
+    if api_url.endswith("/files"):
+        return api_url
+    api_url = api_url.removesuffix("/chat/completions")
+    return api_url + "/files"
+
+
+def parse_sse_line(line: str) -> str | None:
+    """
+    Parse one server sent event line into a content delta.
+
+    Returns an empty string for lines without content and None once the
+    stream is done.
+    """
+
+    if not line.startswith("data:"):
+        return ""
+    data = line[len("data:") :].strip()
+    if data == "[DONE]":
+        return None
+    try:
+        chunk = json.loads(data)
+    except json.JSONDecodeError:
+        return ""
+    choices = chunk.get("choices") or [{}]
+    delta = choices[0].get("delta") or {}
+    return delta.get("content") or ""
+
+
+async def stream_chat(
+    api_url: str,
+    messages: list[dict],
+    api_token: str | None = None,
+    model: str = "gpt-4o-mini",
+    client: httpx.AsyncClient | None = None,
+    trace: Callable[[str, dict], Awaitable[None]] | None = None,
+    timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+) -> AsyncIterator[str]:
+    """
+    Stream the reply of the model as text deltas.
+
+    Parameters:
+    - api_url = base url or full chat completions endpoint
+    - messages = list of {"role", "content"} dicts
+    - api_token = bearer token, None if the api needs none
+    - client = http client to send with, the shared one of the endpoint
+      when None
+    - trace = told about the steps of the request, see the trace extension
+      of httpx
+    """
+
+    headers = {"Accept": "text/event-stream"}
+    if api_token:
+        headers["Authorization"] = f"Bearer {api_token}"
+    payload = {"model": model, "messages": messages, "stream": True}
+
+    if client is None:
+        client = get_client(api_url)
+    async with client.stream(
+        "POST",
+        completions_url(api_url),
+        json=payload,
+        headers=headers,
+        timeout=timeout,
+        extensions={"trace": trace} if trace is not None else None,
+    ) as response:
+        response.raise_for_status()
+        done = False
+        async for line in response.aiter_lines():
+            # read on past [DONE] to the end of the body, a response that is
+            # read to the end hands its connection back to the pool
+            if done:
+                continue
+            delta = parse_sse_line(line)
+            if delta is None:
+                done = True
+            elif delta:
+                yield delta
+
+
+async def stream_speech(
+    api_url: str,
+    text: str,
+    voice: str,
+    api_token: str | None = None,
+    model: str = "tts-1",
+    client: httpx.AsyncClient | None = None,
+    timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+) -> AsyncIterator[bytes]:
+    """
+    Stream the text read aloud as mp3 audio.
+
+    Parameters:
+    - api_url = base url, chat completions or speech endpoint
+    - voice = one of the voice models of the settings, e.g. "Alloy"
+    - api_token = bearer token, None if the api needs none
+    """
+
+    headers = {}
+    if api_token:
+        headers["Authorization"] = f"Bearer {api_token}"
+    payload = {
+        "model": model,
+        "input": text,
+        "voice": voice.lower(),
+        "response_format": "mp3",
+    }
+
+    if client is None:
+        client = get_client(api_url)
+    async with client.stream(
+        "POST", speech_url(api_url), json=payload, headers=headers, timeout=timeout
+    ) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            yield chunk
+
+
+async def upload_file(
+    api_url: str,
+    filename: str,
+    content: AsyncIterator[bytes],
+    size: int,
+    content_type: str = "application/octet-stream",
+    api_token: str | None = None,
+    purpose: str = "user_data",
+    client: httpx.AsyncClient | None = None,
+    timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+) -> str:
+    """
+    Upload a file to the files endpoint and return its id.
+
+    The multipart body is streamed from ``content``, so the file is never
+    held in memory as a whole.
+
+    Parameters:
+    - content = chunks of the file, ``size`` bytes in total
+    - api_token = bearer token, None if the api needs none
+    """
+
+    boundary = uuid.uuid4().hex
+    filename = filename.replace('"', "%22").replace("\r", "").replace("\n", "")
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="purpose"\r\n\r\n{purpose}\r\n'
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    async def body() -> AsyncIterator[bytes]:
+        yield head
+        async for chunk in content:
+            yield chunk
+        yield tail
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + size + len(tail)),
+    }
+    if api_token:
+        headers["Authorization"] = f"Bearer {api_token}"
+
+    if client is None:
+        client = get_client(api_url)
+    response = await client.post(
+        files_url(api_url), content=body(), headers=headers, timeout=timeout
+    )
+    response.raise_for_status()
+    return response.json()["id"]
@@ -5,14 +5,28 @@ Color scheme for this application.
 # pylint: disable=missing-function-docstring
 # pylint: disable=invalid-name
 
+import weakref
+from typing import Any, Callable
+
+import flet as ft  # type: ignore
+
+# name of a color property, or a function of the config for values derived
+# from the colors (opacity, text styles, themes)
+Token = str | Callable[["ColorConfig"], Any]
+
 
 class ColorConfig:
     """
     Configuration class for managing color schemes.
+
+    Controls built with ``themed`` remember which token each of their
+    properties comes from, so a mode change only patches those properties.
     """
 
     def __init__(self, mode: str = "light"):
         self._mode = mode  # Default mode
+        # control -> {property: token}, forgotten with the control
+        self._bindings: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
 
     @property
     def mode(self):
@@ -24,6 +38,42 @@ class ColorConfig:
             raise ValueError(f"Mode must be 'light' or 'dark'. Your mode: {mode}")
         self._mode = mode
 
+    def resolve(self, token: Token):
+        return token(self) if callable(token) else getattr(self, token)
+
+    def themed(self, control, **tokens: Token):
+        """
+        Set properties of the control from color tokens and keep them in
+        sync with the mode. Returns the control.
+        """
+
+        for name, token in tokens.items():
+            setattr(control, name, self.resolve(token))
+        self._bindings.setdefault(control, {}).update(tokens)
+        return control
+
+    def switch(self, mode: str) -> list:
+        """
+        Change the mode and patch the themed controls in place.
+
+        Returns the controls that changed, nothing is sent to the client.
+        """
+
+        if mode == self._mode:
+            return []
+        self.mode = mode
+        changed = []
+        for control, tokens in list(self._bindings.items()):
+            patched = False
+            for name, token in tokens.items():
+                value = self.resolve(token)
+                if getattr(control, name) != value:
+                    setattr(control, name, value)
+                    patched = True
+            if patched:
+                changed.append(control)
+        return changed
+
     @property
     def PRIMARY(self):
         return "#CED4DA" if self._mode == "light" else "#A7AFB6"
@@ -53,4 +103,28 @@ class ColorConfig:
         return "#CED4DA" if self._mode == "light" else "#242930"
 
 
-color_config = ColorConfig()
+class SessionColorConfig:
+    """
+    The color configs of the sessions, one per page.
+
+    Each page gets its own mode and themed controls. Flet does not run
+    every handler with the page in context, so the components look the
+    config up from the page they build for, ``color_config.of(page)``.
+    Controls built without a page use a default config.
+    """
+
+    def __init__(self):
+        # page -> ColorConfig, forgotten with the page
+        self._configs: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._default = ColorConfig()
+
+    def of(self, page: ft.Page | None) -> ColorConfig:
+        if page is None:
+            return self._default
+        config = self._configs.get(page)
+        if config is None:
+            config = self._configs[page] = ColorConfig()
+        return config
+
+
+color_config = SessionColorConfig()
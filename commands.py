@@ -0,0 +1,279 @@
+"""
+Slash commands typed into the message field.
+"""
+
+import asyncio
+import base64
+from bisect import insort
+from typing import Awaitable, Callable
+
+import flet as ft  # type: ignore
+
+from session import Session
+from update_scheduler import scheduler
+
+# commands suggested at most for a prefix
+MAX_SUGGESTIONS = 6
+# seconds of typing pause before the suggestions are shown again
+SUGGEST_DELAY = 0.15
+
+# (session, text after the command name) -> note shown to the user, if any
+CommandHandler = Callable[[Session, str], Awaitable[str | None]]
+
+
+class Command:
+    """
+    A slash command, ``/name args``.
+    """
+
+    def __init__(
+        self, name: str, description: str, handler: CommandHandler, usage: str = ""
+    ):
+        self.name = name
+        self.description = description
+        self.handler = handler
+        self.usage = usage
+
+    @property
+    def syntax(self) -> str:
+        """How the command is typed."""
+        return f"/{self.name} {self.usage}".rstrip()
+
+
+class _Node:
+    __slots__ = ("children", "first", "terminal")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # the first names below the node in order, at most the limit
+        self.first: list[str] = []
+        self.terminal = False
+
+
+class CommandTrie:
+    """
+    Command names by prefix.
+
+    Every node keeps the first ``limit`` names under it, so completing a
+    prefix only walks down the prefix, however many names there are.
+    Adding or removing a name updates the nodes along its path.
+    """
+
+    def __init__(self, limit: int = MAX_SUGGESTIONS):
+        self.limit = limit
+        self._root = _Node()
+
+    def insert(self, name: str):
+        """
+        Add a name.
+        """
+
+        path = self._path(name, create=True)
+        if path[-1].terminal:
+            return
+        path[-1].terminal = True
+        for node in path:
+            if name not in node.first:
+                insort(node.first, name)
+                del node.first[self.limit :]
+
+    def remove(self, name: str):
+        """
+        Remove a name, if there.
+        """
+
+        path = self._path(name)
+        if path is None or not path[-1].terminal:
+            return
+        path[-1].terminal = False
+        for depth in range(len(name), -1, -1):
+            node = path[depth]
+            if name not in node.first:
+                # nodes above only list names that come before it
+                break
+            prefix = name[:depth]
+            names = [prefix] if node.terminal else []
+            for child in node.children.values():
+                names.extend(child.first)
+            node.first = sorted(names)[: self.limit]
+            if depth and not node.first:
+                del path[depth - 1].children[name[depth - 1]]
+
+    def complete(self, prefix: str) -> list[str]:
+        """The first names starting with the prefix, in order."""
+        path = self._path(prefix)
+        return [] if path is None else list(path[-1].first)
+
+    def _path(self, name: str, create: bool = False) -> list[_Node] | None:
+        node = self._root
+        path = [node]
+        for char in name:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = _Node()
+            node = child
+            path.append(node)
+        return path
+
+
+class CommandRegistry:
+    """
+    The slash commands of the app, shared by every session. More commands
+    can be registered at any time.
+    """
+
+    def __init__(self):
+        self.commands: dict[str, Command] = {}
+        self.trie = CommandTrie()
+
+    def register(
+        self, name: str, description: str, handler: CommandHandler, usage: str = ""
+    ) -> Command:
+        """
+        Add a command, replacing one of the same name.
+        """
+
+        command = self.commands[name] = Command(name, description, handler, usage)
+        self.trie.insert(name)
+        return command
+
+    def command(self, name: str, description: str, usage: str = ""):
+        """
+        Register the decorated handler as a command.
+        """
+
+        def decorator(handler: CommandHandler) -> CommandHandler:
+            self.register(name, description, handler, usage)
+            return handler
+
+        return decorator
+
+    def unregister(self, name: str):
+        """
+        Remove a command, if there.
+        """
+
+        if self.commands.pop(name, None) is not None:
+            self.trie.remove(name)
+
+    def suggest(self, text: str) -> list[Command]:
+        """
+        Commands completing what is typed, while only a command name is.
+        """
+
+        if not text.startswith("/") or any(char.isspace() for char in text):
+            return []
+        return [self.commands[name] for name in self.trie.complete(text[1:])]
+
+    def parse(self, text: str) -> tuple[Command, str] | None:
+        """
+        The command typed and the text after its name, None when the text is
+        not a registered command and goes to the model instead.
+        """
+
+        if not text.startswith("/"):
+            return None
+        name, _, args = text[1:].strip().partition(" ")
+        command = self.commands.get(name)
+        return None if command is None else (command, args.strip())
+
+
+commands = CommandRegistry()
+
+
+@commands.command("help", "List the commands, or explain one", "[command]")
+async def help_command(_: Session, args: str) -> str:
+    """Usage of every command, or of the one named."""
+    if args:
+        command = commands.commands.get(args.lstrip("/"))
+        if command is None:
+            return f"No command /{args.lstrip('/')}"
+        return f"{command.syntax}\n{command.description}"
+    return "\n".join(
+        f"{command.syntax}  {command.description}"
+        for _, command in sorted(commands.commands.items())
+    )
+
+
+@commands.command("new", "Start a new chat")
+async def new_command(session: Session, _: str) -> None:
+    """Start an empty conversation, the open one stays stored."""
+    session.conversation.new()
+    session.message_container.clear()
+    scheduler(session.page).mark(session.message_container)
+
+
+@commands.command("clear", "Clear the screen, the chat and its context stay")
+async def clear_command(session: Session, _: str) -> None:
+    """Remove the messages shown, new ones are shown again."""
+    session.message_container.clear()
+    scheduler(session.page).mark(session.message_container)
+
+
+@commands.command("model", "Show or change the model", "[name]")
+async def model_command(session: Session, args: str) -> str:
+    """Name of the model of the session, changed to the one given."""
+    if args:
+        session.settings.model = args
+        return f"Model set to {args}"
+    return f"Model: {session.settings.model}"
+
+
+# platforms with a save dialog, the app and its files are on the same machine
+async def save_dialog(page: ft.Page, file_name: str) -> str | None:
+    """
+    Path picked in the save dialog of the device, None when cancelled.
+    """
+
+    picked = asyncio.get_running_loop().create_future()
+
+    async def on_result(e: ft.FilePickerResultEvent):
+        if not picked.done():
+            picked.set_result(e.path)
+
+    picker = ft.FilePicker(on_result=on_result)
+    page.overlay.append(picker)
+    page.update()
+    try:
+        picker.save_file(file_name=file_name, allowed_extensions=["md"])
+        return await picked
+    finally:
+        page.overlay.remove(picker)
+        page.update()
+
+
+@commands.command("export", "Save this chat as markdown")
+async def export_command(session: Session, _: str) -> str | None:
+    """Hand the messages of the open branch to the user as a markdown file."""
+    conversation = session.conversation
+    if not conversation.history:
+        return "Nothing to export yet"
+    text = "\n\n".join(
+        f"**{message['role']}**\n\n{message['content']}"
+        for message in conversation.history
+    )
+    page = session.page
+    if page.web:
+        # the server never writes the file, the browser gets it as a download
+        data = base64.b64encode((text + "\n").encode()).decode()
+        page.launch_url(f"data:application/octet-stream;base64,{data}")
+        return "Exported, see your downloads"
+
+    # desktop and mobile apps run the server on the device, a data URL would
+    # not download anything there
+    path = await save_dialog(page, f"chat-{conversation.id or 'new'}.md")
+    if not path:
+        return None
+
+    def write():
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+
+    try:
+        # off the event loop, a long chat is a big file
+        await asyncio.to_thread(write)
+    except OSError as error:
+        return f"Could not export: {error}"
+    return f"Exported to {path}"
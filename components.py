@@ -2,108 +2,666 @@
 Reusable components
 """
 
+import asyncio
+import base64
+import os
+import uuid
+from contextlib import aclosing
+from functools import partial
 from typing import Callable
 import flet as ft  # type: ignore
-from color_scheme import color_config
+import httpx
+from attachments import (
+    THUMBNAIL_SIZE,
+    UPLOAD_DIRECTORY,
+    UPLOAD_URL_EXPIRES,
+    attachment_type,
+    content_type,
+    format_size,
+    open_thumbnails,
+    stream_file,
+)
+from chat_api import (
+    completions_url,
+    get_client,
+    stream_chat,
+    stream_speech,
+    upload_file,
+    warm_up,
+)
+from color_scheme import ColorConfig, color_config
+from commands import SUGGEST_DELAY, Command, commands
+from conversation import Conversation
+from history_list import HistoryList
+from message_list import MessageList
+from request_scheduler import open_request_scheduler, scheduled_stream
+from response_cache import ResponseCache, cached_stream, request_key
+from session import Session
+from speech import open_speech_server, speech_key
+from settings import Settings
+from streaming import MarkdownStream, SegmentedMarkdown
+from summary import Summarizer, summary_request
+from telemetry import RequestTrace, describe, open_telemetry
+from update_scheduler import scheduler
 
+# percent of an upload between two updates of its progress
+UPLOAD_PROGRESS_STEP = 5
 
-def appbar(page: ft.Page, navigation_menu: ft.NavigationDrawer):
+# immutable parts of the message bubbles, shared by every bubble of every
+# session instead of allocated per message
+USER_BUBBLE_PADDING = ft.Padding(top=15, left=24, bottom=15, right=24)
+USER_BUBBLE_MARGIN = ft.Margin(top=0, left=36, bottom=0, right=15)
+
+
+def appbar(page: ft.Page, open_menu: Callable[[], None]):
     """
     Appbar component
+
+    Parameters:
+    - open_menu = opens the navigation menu, building it on first use
     """
 
     return ft.AppBar(
-        leading=ft.IconButton(
-            icon=ft.icons.MENU,
-            on_click=lambda _: page.open(navigation_menu),
-            icon_color=color_config.TEXT_COLOR,
-            hover_color=ft.colors.TRANSPARENT,
-            highlight_color=ft.colors.with_opacity(0.3, color=color_config.TEXT_COLOR),
+        leading=icon_button(
+            page,
+            ft.IconButton(
+                icon=ft.icons.MENU,
+                on_click=lambda _: open_menu(),
+                hover_color=ft.colors.TRANSPARENT,
+            ),
         ),
-        title=ft.Text(
-            value="Greetings New",
-            size=14,
-            weight=ft.FontWeight.BOLD,
-            animate_opacity=ft.Animation(duration=300, curve=ft.AnimationCurve.EASE_IN),
-            color=color_config.TEXT_COLOR,
-            selectable=True,
+        title=color_config.of(page).themed(
+            ft.Text(
+                value="Greetings New",
+                size=14,
+                weight=ft.FontWeight.BOLD,
+                animate_opacity=ft.Animation(
+                    duration=300, curve=ft.AnimationCurve.EASE_IN
+                ),
+                selectable=True,
+            ),
+            color="TEXT_COLOR",
         ),
         center_title=True,
         force_material_transparency=True,
     )
 
 
-def message_content():
+def icon_button(page: ft.Page, button: ft.IconButton):
+    """
+    Theme the icon and highlight colors of an icon button
+    """
+
+    return color_config.of(page).themed(
+        button,
+        icon_color="TEXT_COLOR",
+        highlight_color=lambda c: ft.colors.with_opacity(0.3, color=c.TEXT_COLOR),
+    )
+
+
+def themed_text(page: ft.Page, value: str, **kwargs):
+    """
+    Text in the text color of the mode
+    """
+
+    return color_config.of(page).themed(ft.Text(value, **kwargs), color="TEXT_COLOR")
+
+
+def themed_icon(page: ft.Page, name: str):
+    """
+    Icon in the text color of the mode
+    """
+
+    return color_config.of(page).themed(ft.Icon(name=name), color="TEXT_COLOR")
+
+
+def switch_color_mode(page: ft.Page, mode: str):
+    """
+    Switch between light and dark mode in place
+
+    Only the themed properties of the controls on the page change, and they
+    are sent in a single update.
+    """
+
+    changed = [
+        control
+        for control in color_config.of(page).switch(mode)
+        if control.page is page
+    ]
+    if changed:
+        page.update(*changed)
+
+
+def message_content(page: ft.Page, session: Session | None = None):
     """
     Message content of bot and the user
     """
 
-    return ft.ListView(spacing=12, auto_scroll=True, expand=True)
+    def regenerate():
+        if session is not None and session.regenerate is not None:
+            page.run_task(session.regenerate)
+
+    def read(text: str):
+        if session is not None:
+            page.run_task(read_aloud, page, session, text)
+
+    def edit(record: dict):
+        if session is None or session.edit is None:
+            return
+
+        def save(content: str):
+            page.run_task(session.edit, record, content)
+
+        page.open(edit_message_dialog(page, record.get("content", ""), save))
+
+    def switch(record: dict, step: int):
+        if session is not None:
+            page.run_task(switch_branch, page, session, record, step)
+
+    return MessageList(
+        build=lambda record: message_bubble(
+            page, record, regenerate, read, edit, switch
+        ),
+        spacing=12,
+        auto_scroll=True,
+        expand=True,
+    )
+
+
+# bot message themes by color mode, shared by every bot message
+_bot_message_themes: dict[str, ft.Theme] = {}
+
+
+def bot_message_theme(config: ColorConfig):
+    """
+    Text theme of the bot messages, built once per color mode
+    """
+
+    theme = _bot_message_themes.get(config.mode)
+    if theme is None:
+        theme = ft.Theme(
+            text_theme=ft.TextTheme(
+                display_large=ft.TextStyle(
+                    size=34,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # Large display text
+                display_medium=ft.TextStyle(
+                    size=30,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # Medium display text
+                display_small=ft.TextStyle(
+                    size=26,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # Small display text
+                title_large=ft.TextStyle(
+                    size=24,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # H2
+                title_medium=ft.TextStyle(
+                    size=22,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # H3
+                title_small=ft.TextStyle(
+                    size=20,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # H4
+                headline_large=ft.TextStyle(
+                    size=28,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # H1
+                headline_medium=ft.TextStyle(
+                    size=24,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # H2
+                headline_small=ft.TextStyle(
+                    size=20,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # H3
+                body_large=ft.TextStyle(
+                    size=18,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # Body text
+                body_medium=ft.TextStyle(
+                    size=16,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # Body text
+                body_small=ft.TextStyle(
+                    size=14,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # Smaller body text
+                label_large=ft.TextStyle(
+                    size=18,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # Large labels
+                label_medium=ft.TextStyle(
+                    size=16,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # Medium labels
+                label_small=ft.TextStyle(
+                    size=14,
+                    color=config.TEXT_COLOR,
+                    font_family="Montserrat",
+                ),  # Small labels
+            )
+        )
+        _bot_message_themes[config.mode] = theme
+    return theme
+
 
+def message_area(page: ft.Page, message_container: MessageList):
+    """
+    Area holding the messages
 
-def user_input_options(page: ft.Page, message_container: ft.ListView):
+    The bot message theme is set once here instead of on every bot message,
+    so a message only costs its own content. The messages are stacked, so
+    the debug overlay can be shown over them.
+    """
+
+    return color_config.of(page).themed(
+        ft.Container(
+            content=ft.Stack([message_container], fit=ft.StackFit.EXPAND),
+            expand=True,
+        ),
+        theme=bot_message_theme,
+    )
+
+
+def show_debug_overlay(
+    page: ft.Page, session: Session, area: ft.Container, visible: bool
+):
+    """
+    Show or hide the timings of the last request over the message area,
+    building the overlay when first shown.
+    """
+
+    if session.debug_panel is None:
+        if not visible:
+            return
+        session.debug_panel = color_config.of(page).themed(
+            ft.Container(
+                content=themed_text(
+                    page, describe(None, {}), size=11, font_family="monospace"
+                ),
+                padding=10,
+                border_radius=8,
+                opacity=0.9,
+                top=8,
+                right=8,
+            ),
+            bgcolor="CONTAINER_COLOR",
+        )
+        area.content.controls.append(session.debug_panel)
+        scheduler(page).mark(area.content)
+    session.debug_panel.visible = visible
+    scheduler(page).mark(session.debug_panel)
+
+
+def user_input_options(page: ft.Page, session: Session):
     """
     User input options such as sending text, file or images
     """
 
-    def on_send_click(_: ft.ControlEvent):
-        # DO SOMETHING HERE ON SEND REQUEST
+    message_container = session.message_container
+    settings = session.settings
+    conversation = session.conversation
+    # every control a handler changes goes out in one patch per frame
+    updates = scheduler(page)
+
+    async def on_send_click(_: ft.ControlEvent):
+        prompt = text_field.value
+        if not prompt or session.reply_task is not None:
+            return
+
+        parsed = commands.parse(prompt)
+        if parsed is not None:
+            await run_command(*parsed)
+            return
+
         switch_send.content = loading_response_button
-        switch_send.update()
+        updates.mark(switch_send)
 
-        user_message(page, message_container, text_field.value, "text")
+        message_id = conversation.append("user", prompt)
+        user_message(page, message_container, prompt, "text", id=message_id)
         text_field.value = ""
-        text_field.update()
+        updates.mark(text_field)
+
+        await reply()
+
+    async def edit(record: dict, content: str):
+        # a new version of a stored user message, answered anew
+        index = conversation.index(record.get("id"))
+        position = message_container.position(record)
+        if session.reply_task is not None or index is None or position is None:
+            return
+
+        switch_send.content = loading_response_button
+        updates.mark(switch_send)
+
+        message_id = conversation.edit(index, content)
+        message_container.truncate(position)
+        user_message(
+            page,
+            message_container,
+            content,
+            "text",
+            id=message_id,
+            branch=conversation.branch(index),
+        )
+        await reply()
+
+    async def regenerate():
+        # only the last reply, and only once it is complete
+        records = message_container.records
+        if (
+            session.reply_task is not None
+            or not records
+            or records[-1].get("role") != "assistant"
+        ):
+            return
+
+        switch_send.content = loading_response_button
+        updates.mark(switch_send)
+
+        message_container.pop()
+        updates.mark(message_container)
+        if conversation.history and conversation.history[-1]["role"] == "assistant":
+            conversation.pop()
+        await reply(refresh=True)
+
+    def on_wait(reason: str | None):
+        # queued behind other sessions or backing off, stop works either way
+        if reason is None:
+            switch_send.content = loading_response_button
+        else:
+            queued_button.tooltip = reason
+            switch_send.content = queued_button
+            updates.mark(queued_button)
+        updates.mark(switch_send)
+
+    async def reply(refresh: bool = False):
+        # the whole history stays shown, only the request is compacted
+        summary, start = None, 0
+        if settings.summarize_history and settings.api_url:
+            summary, start = session.summary.compact(
+                conversation.history,
+                api_summarizer(settings, page.session_id),
+                settings.summary_threshold,
+                conversation.ids,
+            )
+        messages = session.context.build(
+            conversation.history,
+            settings.model_instruction,
+            settings.context_budget,
+            summary,
+            start,
+        )
+        telemetry = open_telemetry()
+        # bytes are only measured while somebody looks at them
+        trace = RequestTrace(
+            page, count_bytes=settings.debug_overlay or bool(telemetry.export_path)
+        )
+        task = session.reply_task = asyncio.create_task(
+            stream_bot_reply(
+                page,
+                message_container,
+                settings,
+                messages,
+                cache=session.cache,
+                refresh=refresh,
+                on_wait=on_wait,
+                trace=trace,
+            )
+        )
+        try:
+            reply = await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            # stopped before the request was even sent
+            reply = ""
+            trace.finish("stopped")
+        finally:
+            session.reply_task = None
+        if reply:
+            conversation.append("assistant", reply)
+
+        await telemetry.record(trace)
+        if session.debug_panel is not None and settings.debug_overlay:
+            session.debug_panel.content.value = describe(trace, telemetry.summary())
+            updates.mark(session.debug_panel.content)
+
+        switch_send.content = mic_button
+        updates.mark(switch_send)
+
+    async def on_focus(_: ft.ControlEvent):
+        # connect while the user is still typing, not when they hit send
+        if settings.api_url:
+            await warm_up(settings.api_url, settings.http2, settings.timeout)
+
+    async def run_command(command: Command, args: str):
+        text_field.value = ""
+        updates.mark(text_field)
+        hide_suggestions()
+        switch_send.content = mic_button
+        updates.mark(switch_send)
+        note = await command.handler(session, args)
+        if note:
+            page.open(ft.SnackBar(ft.Text(note)))
+
+    def pick_suggestion(command: Command):
+        text_field.value = f"/{command.name} " if command.usage else f"/{command.name}"
+        updates.mark(text_field)
+        hide_suggestions()
+        text_field.focus()
+
+    def suggestion(command: Command) -> ft.Control:
+        # built once per command and reused while typing
+        control = suggestion_controls.get(command)
+        if control is None:
+            control = suggestion_controls[command] = ft.Container(
+                content=ft.Row(
+                    controls=[
+                        themed_text(page, command.syntax, weight=ft.FontWeight.BOLD),
+                        themed_text(
+                            page,
+                            command.description,
+                            size=13,
+                            expand=True,
+                            no_wrap=True,
+                            overflow=ft.TextOverflow.ELLIPSIS,
+                        ),
+                    ],
+                    spacing=12,
+                ),
+                padding=ft.Padding(top=8, left=15, bottom=8, right=15),
+                border_radius=12,
+                ink=True,
+                on_click=lambda _: pick_suggestion(command),
+            )
+        return control
+
+    def show_suggestions():
+        nonlocal suggest_timer
+        suggest_timer = None
+        matches = commands.suggest(text_field.value or "")
+        controls = [suggestion(command) for command in matches]
+        if controls == suggestion_list.controls and suggestions.visible == bool(
+            controls
+        ):
+            return
+        suggestion_list.controls = controls
+        suggestions.visible = bool(controls)
+        updates.mark(suggestions)
+
+    def hide_suggestions():
+        nonlocal suggest_timer
+        if suggest_timer is not None:
+            suggest_timer.cancel()
+            suggest_timer = None
+        if suggestions.visible:
+            suggestions.visible = False
+            suggestion_list.controls = []
+            updates.mark(suggestions)
+
+    async def change_input(_: ft.ControlEvent):
+        # suggestions follow once typing pauses, a keystroke only moves the
+        # timer, and go away right away once no command is typed
+        nonlocal suggest_timer
+        if (text_field.value or "").startswith("/"):
+            if suggest_timer is not None:
+                suggest_timer.cancel()
+            suggest_timer = asyncio.get_running_loop().call_later(
+                SUGGEST_DELAY, show_suggestions
+            )
+        else:
+            hide_suggestions()
 
-    def change_input(_: ft.ControlEvent):
+        if switch_send.content in (loading_response_button, queued_button):
+            return
         if text_field.value and switch_send.content == mic_button:
             switch_send.content = send_button
-            switch_send.update()
+            updates.mark(switch_send)
         else:
             if switch_send.content != mic_button and not text_field.value:
                 switch_send.content = mic_button
-                switch_send.update()
+                updates.mark(switch_send)
 
-    def on_stop_click(_: ft.ControlEvent):
+    async def on_stop_click(_: ft.ControlEvent):
+        await session.stop()
         switch_send.content = mic_button
-        switch_send.update()
+        updates.mark(switch_send)
 
-    send_button = ft.IconButton(
-        icon=ft.icons.ARROW_UPWARD,
-        icon_color=color_config.TEXT_COLOR,
-        hover_color=ft.colors.TRANSPARENT,
-        highlight_color=ft.colors.with_opacity(0.3, color=color_config.TEXT_COLOR),
-        padding=12,
-        on_click=on_send_click,
+    def on_attach_click(_: ft.ControlEvent):
+        if file_picker not in page.overlay:
+            # only part of the page once somebody attaches something
+            page.overlay.append(file_picker)
+            page.update()
+        file_picker.pick_files(allow_multiple=True)
+
+    # names of the files the browser is uploading to the server, by the
+    # name they are stored under
+    uploading: dict[str, str] = {}
+
+    async def attach(path: str, name: str):
+        try:
+            size = os.path.getsize(path)
+        except OSError as error:
+            page.open(ft.SnackBar(ft.Text(f"Could not attach {name}: {error}")))
+            return
+        record = user_message(
+            page,
+            message_container,
+            name,
+            attachment_type(name),
+            path=path,
+            size=size,
+        )
+        await upload_attachment(page, session, record)
+
+    async def on_files_picked(e: ft.FilePickerResultEvent):
+        if session.reply_task is not None or not e.files:
+            return
+        if not settings.api_url:
+            page.open(ft.SnackBar(ft.Text("Set your Api Url in the settings first.")))
+            return
+        if not page.web:
+            # pickers of the device give paths, the files are read from there
+            for file in e.files:
+                if file.path is None:
+                    page.open(ft.SnackBar(ft.Text(f"Could not attach {file.name}")))
+                else:
+                    await attach(file.path, file.name)
+            return
+
+        # a browser gives no paths, the page uploads the files to the server
+        uploads = []
+        for file in e.files:
+            stored = f"{uuid.uuid4().hex}-{file.name}"
+            try:
+                url = page.get_upload_url(stored, UPLOAD_URL_EXPIRES)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                page.open(ft.SnackBar(ft.Text(f"Could not attach files: {error}")))
+                return
+            uploading[stored] = file.name
+            uploads.append(ft.FilePickerUploadFile(stored, upload_url=url))
+        file_picker.upload(uploads)
+
+    async def on_file_uploaded(e: ft.FilePickerUploadEvent):
+        if e.error:
+            name = uploading.pop(e.file_name, e.file_name)
+            page.open(ft.SnackBar(ft.Text(f"Could not attach {name}: {e.error}")))
+        elif e.progress == 1 and e.file_name in uploading:
+            name = uploading.pop(e.file_name)
+            await attach(os.path.join(UPLOAD_DIRECTORY, e.file_name), name)
+
+    attach_button = icon_button(
+        page,
+        ft.IconButton(
+            icon=ft.icons.ATTACH_FILE,
+            hover_color=ft.colors.TRANSPARENT,
+            padding=12,
+            on_click=on_attach_click,
+        ),
+    )
+    file_picker = ft.FilePicker(on_result=on_files_picked, on_upload=on_file_uploaded)
+
+    send_button = icon_button(
+        page,
+        ft.IconButton(
+            icon=ft.icons.ARROW_UPWARD,
+            hover_color=ft.colors.TRANSPARENT,
+            padding=12,
+            on_click=on_send_click,
+        ),
+    )
+
+    mic_button = icon_button(
+        page,
+        ft.IconButton(
+            icon=ft.icons.MIC,
+            hover_color=ft.colors.TRANSPARENT,
+            padding=12,
+            offset=ft.transform.Offset(0, 0),
+        ),
     )
 
-    mic_button = ft.IconButton(
-        icon=ft.icons.MIC,
-        icon_color=color_config.TEXT_COLOR,
-        hover_color=ft.colors.TRANSPARENT,
-        highlight_color=ft.colors.with_opacity(0.3, color=color_config.TEXT_COLOR),
-        padding=12,
-        offset=ft.transform.Offset(0, 0),
+    loading_response_button = icon_button(
+        page,
+        ft.IconButton(
+            icon=ft.icons.STOP,
+            hover_color=ft.colors.TRANSPARENT,
+            padding=12,
+            on_click=on_stop_click,
+        ),
     )
 
-    loading_response_button = ft.IconButton(
-        icon=ft.icons.STOP,
-        icon_color=color_config.TEXT_COLOR,
-        hover_color=ft.colors.TRANSPARENT,
-        highlight_color=ft.colors.with_opacity(0.3, color=color_config.TEXT_COLOR),
-        padding=12,
-        on_click=on_stop_click,
+    queued_button = icon_button(
+        page,
+        ft.IconButton(
+            icon=ft.icons.HOURGLASS_EMPTY,
+            hover_color=ft.colors.TRANSPARENT,
+            padding=12,
+            on_click=on_stop_click,
+        ),
     )
 
     text_field = ft.TextField(
         expand=True,
         hint_text="Type your message or /help",
-        hint_style=ft.TextStyle(
-            size=14,
-            color=ft.colors.with_opacity(0.5, color_config.TEXT_COLOR_MESSAGE_BUBBLE),
-        ),
-        color=color_config.TEXT_COLOR_MESSAGE_BUBBLE,
-        bgcolor=color_config.INPUT_FIELDS_ICONS_COLOR,
         border_radius=26,
         content_padding=ft.Padding(top=9, left=15, bottom=9, right=15),
         text_size=15,
@@ -112,11 +670,30 @@ def user_input_options(page: ft.Page, message_container: ft.ListView):
         shift_enter=True,
         focused_border_color=ft.colors.TRANSPARENT,
         border_color=ft.colors.TRANSPARENT,
-        cursor_color=color_config.TEXT_COLOR_MESSAGE_BUBBLE,
         selection_color=ft.colors.BLUE_300,
         # animate_size=ft.Animation(200, curve=ft.AnimationCurve.LINEAR),
         on_change=change_input,
+        on_focus=on_focus,
+    )
+    color_config.of(page).themed(
+        text_field,
+        hint_style=lambda c: ft.TextStyle(
+            size=14,
+            color=ft.colors.with_opacity(0.5, c.TEXT_COLOR_MESSAGE_BUBBLE),
+        ),
+        color="TEXT_COLOR_MESSAGE_BUBBLE",
+        bgcolor="INPUT_FIELDS_ICONS_COLOR",
+        cursor_color="TEXT_COLOR_MESSAGE_BUBBLE",
+    )
+
+    # commands completing what is typed, over the input row
+    suggestion_list = ft.Column(spacing=0)
+    suggestions = color_config.of(page).themed(
+        ft.Container(content=suggestion_list, border_radius=16, visible=False),
+        bgcolor="CONTAINER_COLOR",
     )
+    suggestion_controls: dict[Command, ft.Control] = {}
+    suggest_timer: asyncio.TimerHandle | None = None
 
     switch_send = ft.AnimatedSwitcher(
         content=mic_button,
@@ -127,10 +704,19 @@ def user_input_options(page: ft.Page, message_container: ft.ListView):
         transition=ft.AnimatedSwitcherTransition.SCALE,
     )
 
+    session.regenerate = regenerate
+    session.edit = edit
+
     return ft.Container(
-        content=ft.Row(
-            controls=[text_field, switch_send],
-            alignment=ft.MainAxisAlignment.CENTER,
+        content=ft.Column(
+            controls=[
+                suggestions,
+                ft.Row(
+                    controls=[attach_button, text_field, switch_send],
+                    alignment=ft.MainAxisAlignment.CENTER,
+                ),
+            ],
+            spacing=4,
         ),
         padding=ft.Padding(top=0, left=15, bottom=0, right=15),
         margin=ft.Margin(top=0, left=0, bottom=10, right=0),
@@ -138,162 +724,662 @@ def user_input_options(page: ft.Page, message_container: ft.ListView):
 
 
 def user_message(
-    page: ft.Page, message_container: ft.ListView, message: str, message_type: str
+    page: ft.Page,
+    message_container: MessageList,
+    message: str,
+    message_type: str,
+    **fields,
 ):
     """
     Message of the user
 
+    Returns the record of the message.
+
     Parameters:
-    - message_container = flet ListView
-    - message = the message string
+    - message_container = message list of the conversation
+    - message = the message string, the file name of an attachment
     - message_type = whether the user input is a text, file or an image
+    - fields = more fields of the record, the path and size of an attachment
     """
 
-    if message_type == "text":
-        message_container.controls.append(
+    record = None
+    if message_type in ("text", "file", "image"):
+        record = {"role": "user", "content": message, "type": message_type, **fields}
+        message_container.append(record)
+    scheduler(page).mark(message_container)
+    return record
+
+
+def user_message_bubble(
+    page: ft.Page,
+    message: str,
+    on_edit: Callable[[], None] | None = None,
+    branch: tuple[int, int] | None = None,
+    on_switch: Callable[[int], None] | None = None,
+):
+    """
+    Chat bubble of a user message
+
+    Parameters:
+    - on_edit = opens the editor of the message
+    - branch = position of an edited message among its versions and their
+      number, shown with arrows calling ``on_switch(-1)`` and ``on_switch(1)``
+    """
+
+    bubble = color_config.of(page).themed(
+        ft.Container(
+            content=color_config.of(page).themed(
+                ft.Text(value=message, size=16, text_align=ft.TextAlign.RIGHT),
+                color="TEXT_COLOR_MESSAGE_BUBBLE",
+            ),
+            padding=USER_BUBBLE_PADDING,
+            border_radius=26,
+            margin=USER_BUBBLE_MARGIN,
+            ink=True,
+            ink_color=ft.colors.GREY_200,
+            on_long_press=lambda _: page.open(show_user_message_menu(page, on_edit)),
+        ),
+        bgcolor="PRIMARY",
+    )
+    if branch is None:
+        return bubble
+
+    position, count = branch
+
+    def arrow(icon: str, step: int, disabled: bool):
+        return icon_button(
+            page,
+            ft.IconButton(
+                icon=icon,
+                icon_size=18,
+                disabled=disabled,
+                hover_color=ft.colors.TRANSPARENT,
+                on_click=lambda _: on_switch(step) if on_switch is not None else None,
+            ),
+        )
+
+    return ft.Column(
+        controls=[
+            bubble,
             ft.Container(
-                content=ft.Text(
-                    value=message,
-                    size=16,
-                    text_align=ft.TextAlign.RIGHT,
-                    color=color_config.TEXT_COLOR_MESSAGE_BUBBLE,
+                content=ft.Row(
+                    controls=[
+                        arrow(ft.icons.CHEVRON_LEFT, -1, position <= 1),
+                        themed_text(page, f"{position} / {count}", size=12),
+                        arrow(ft.icons.CHEVRON_RIGHT, 1, position >= count),
+                    ],
+                    alignment=ft.MainAxisAlignment.END,
+                    spacing=0,
                 ),
-                bgcolor=color_config.PRIMARY,
-                padding=ft.Padding(top=15, left=24, bottom=15, right=24),
-                border_radius=26,
-                margin=ft.Margin(top=0, left=36, bottom=0, right=15),
-                ink=True,
-                ink_color=ft.colors.GREY_200,
-                on_long_press=lambda _: page.open(show_user_message_menu(page)),
-            )
+                margin=ft.Margin(top=0, left=0, bottom=0, right=15),
+            ),
+        ],
+        spacing=0,
+        horizontal_alignment=ft.CrossAxisAlignment.END,
+    )
+
+
+def edit_message_dialog(page: ft.Page, message: str, on_save: Callable[[str], None]):
+    """
+    Dialog editing the text of a user message
+    """
+
+    def save(_: ft.ControlEvent):
+        page.close(dialog)
+        if field.value and field.value.strip() and field.value != message:
+            on_save(field.value)
+
+    field = color_config.of(page).themed(
+        ft.TextField(
+            value=message,
+            multiline=True,
+            min_lines=1,
+            max_lines=8,
+            autofocus=True,
+            border_radius=16,
+        ),
+        color="TEXT_COLOR",
+        border_color="TEXT_COLOR",
+        cursor_color="TEXT_COLOR",
+    )
+    dialog = color_config.of(page).themed(
+        ft.AlertDialog(
+            title=themed_text(page, "Edit Message", size=18),
+            content=field,
+            actions=[
+                ft.TextButton("Cancel", on_click=lambda _: page.close(dialog)),
+                ft.TextButton("Save", on_click=save),
+            ],
+        ),
+        bgcolor="BACKGROUND_COLOR",
+    )
+    return dialog
+
+
+async def switch_branch(page: ft.Page, session: Session, record: dict, step: int):
+    """
+    Show another version of an edited message and the replies under it
+
+    Only the messages from the edited one on are rebuilt, the ones before
+    are shared by every version and keep their controls.
+    """
+
+    conversation = session.conversation
+    message_container = session.message_container
+    index = conversation.index(record.get("id"))
+    position = message_container.position(record)
+    if session.reply_task is not None or index is None or position is None:
+        return
+    # reading the branch may wait for queued writes
+    if not await asyncio.to_thread(conversation.switch, index, step):
+        return
+    message_container.truncate(position)
+    message_container.extend(
+        [dict(message, type="text") for message in conversation.messages(index)]
+    )
+    scheduler(page).mark(message_container)
+
+
+def attachment_bubble(page: ft.Page, record: dict):
+    """
+    Chat bubble of an attached file or image
+
+    The thumbnail of an image is filled in once it is made, the bubble shows
+    a spinner until then. The status line shows the upload progress.
+    """
+
+    def bubble_text(value: str, size: int):
+        return color_config.of(page).themed(
+            ft.Text(value, size=size, no_wrap=True, overflow=ft.TextOverflow.ELLIPSIS),
+            color="TEXT_COLOR_MESSAGE_BUBBLE",
         )
-    message_container.update()
+
+    status = bubble_text(record.get("status", format_size(record["size"])), 12)
+    details = ft.Column(
+        controls=[bubble_text(record.get("content", ""), 16), status],
+        spacing=2,
+        horizontal_alignment=ft.CrossAxisAlignment.END,
+    )
+
+    if record.get("type") == "image":
+        preview = ft.Container(
+            content=ft.ProgressRing(width=24, height=24, stroke_width=2),
+            width=THUMBNAIL_SIZE,
+            height=THUMBNAIL_SIZE,
+            alignment=ft.alignment.center,
+            border_radius=16,
+        )
+
+        async def show_thumbnail():
+            path = await open_thumbnails().thumbnail(record["path"])
+            if path is None:
+                preview.content = color_config.of(page).themed(
+                    ft.Icon(name=ft.icons.IMAGE_OUTLINED, size=48),
+                    color="TEXT_COLOR_MESSAGE_BUBBLE",
+                )
+            else:
+                data = await asyncio.to_thread(read_base64, path)
+                preview.content = ft.Image(src_base64=data, fit=ft.ImageFit.CONTAIN)
+            if preview.page is not None:
+                scheduler(page).mark(preview)
+
+        page.run_task(show_thumbnail)
+        content = ft.Column(
+            controls=[preview, details],
+            spacing=8,
+            horizontal_alignment=ft.CrossAxisAlignment.END,
+            tight=True,
+        )
+    else:
+        content = ft.Row(
+            controls=[
+                color_config.of(page).themed(
+                    ft.Icon(name=ft.icons.INSERT_DRIVE_FILE_OUTLINED, size=32),
+                    color="TEXT_COLOR_MESSAGE_BUBBLE",
+                ),
+                details,
+            ],
+            tight=True,
+        )
+
+    return color_config.of(page).themed(
+        ft.Container(
+            content=content,
+            padding=USER_BUBBLE_PADDING,
+            border_radius=26,
+            margin=USER_BUBBLE_MARGIN,
+            alignment=ft.alignment.center_right,
+        ),
+        bgcolor="PRIMARY",
+    )
+
+
+def read_base64(path: str) -> str:
+    """
+    Base64 of a small file, what images are sent to the page as.
+    """
+
+    with open(path, "rb") as file:
+        return base64.b64encode(file.read()).decode()
+
+
+async def upload_attachment(page: ft.Page, session: Session, record: dict):
+    """
+    Upload an attached file to the api and add it to the conversation
+
+    The file is streamed from disk in chunks, the status line of its bubble
+    shows the progress in steps of UPLOAD_PROGRESS_STEP percent.
+    """
+
+    settings = session.settings
+    size = record["size"]
+
+    def show_status(value: str):
+        record["status"] = value
+        bubble = session.message_container.find(record)
+        if bubble is not None and bubble.page is not None:
+            # the status line closes the details, the last part of the bubble
+            status = bubble.content.controls[-1].controls[-1]
+            status.value = value
+            scheduler(page).mark(status)
+
+    async def chunks():
+        sent = 0
+        shown = 0
+        async for chunk in stream_file(record["path"]):
+            yield chunk
+            sent += len(chunk)
+            percent = sent * 100 // size
+            if percent >= shown + UPLOAD_PROGRESS_STEP and sent < size:
+                shown = percent
+                show_status(f"Uploading {percent}%")
+
+    show_status("Uploading 0%")
+    try:
+        file_id = await upload_file(
+            settings.api_url,
+            record["content"],
+            chunks(),
+            size,
+            content_type(record["path"]),
+            settings.token,
+            client=get_client(settings.api_url, settings.http2),
+            timeout=settings.timeout,
+        )
+    except (httpx.HTTPError, httpx.InvalidURL, OSError, KeyError, ValueError) as error:
+        show_status(f"Upload failed: {error}")
+        return
+    show_status(format_size(size))
+    session.conversation.append(
+        "user", f"Attached {record['type']}: {record['content']} (file id {file_id})"
+    )
 
 
 def bot_message(
-    page: ft.Page, message_container: ft.ListView, message: str, message_type: str
+    page: ft.Page, message_container: MessageList, message: str, message_type: str
 ):
     """
     Message of the bot
+
+    Returns the markdown of the message so a streamed reply can grow it in
+    place.
     """
 
+    markdown = None
     if message_type == "text":
-        message_container.controls.append(
-            ft.Container(
-                content=ft.Markdown(
-                    value=message,
-                    extension_set=ft.MarkdownExtensionSet.GITHUB_WEB,
-                    code_theme=color_config.CODE_THEME,
+        markdown = message_container.append(
+            {"role": "assistant", "content": message, "type": message_type}
+        ).content
+    scheduler(page).mark(message_container)
+    return markdown
+
+
+def add_messages(
+    page: ft.Page,
+    message_container: MessageList,
+    messages: list[dict],
+    page_size: int | None = None,
+):
+    """
+    Add many messages at once
+
+    Parameters:
+    - messages = list of {"role", "content"} dicts, with the "id" and
+      "branch" of stored messages
+    - page_size = number of messages sent per update, all of them in a
+      single update when None
+    """
+
+    records = [
+        {
+            **message,
+            "role": message.get("role", "user"),
+            "content": message.get("content", ""),
+            "type": message.get("type", "text"),
+        }
+        for message in messages
+    ]
+    if not records:
+        # a cleared list still has to reach the client
+        message_container.update()
+    step = page_size or len(records) or 1
+    for start in range(0, len(records), step):
+        message_container.extend(records[start : start + step])
+        message_container.update()
+
+
+def bot_message_bubble(
+    page: ft.Page,
+    message: str,
+    on_regenerate: Callable[[], None] | None = None,
+    on_read_aloud: Callable[[str], None] | None = None,
+    expanded: set[int] | None = None,
+):
+    """
+    Chat bubble of a bot message
+
+    The reply is split into paragraph and code block segments, only the
+    code blocks follow the code theme of the mode.
+    """
+
+    def build_markdown(code: bool):
+        markdown = ft.Markdown(extension_set=ft.MarkdownExtensionSet.GITHUB_WEB)
+        if code:
+            color_config.of(page).themed(markdown, code_theme="CODE_THEME")
+        return markdown
+
+    markdown = SegmentedMarkdown(message, build_markdown, expanded)
+
+    def read_aloud():
+        # the text at the time of the click, the reply may still be streaming
+        if on_read_aloud is not None:
+            on_read_aloud(markdown.value)
+
+    return ft.Container(
+        content=markdown,
+        padding=15,
+        ink=True,
+        ink_color=ft.colors.BLACK26,
+        on_long_press=lambda _x: page.open(
+            show_bot_message_menu(page, on_regenerate, read_aloud)
+        ),
+    )
+
+
+def message_bubble(
+    page: ft.Page,
+    record: dict,
+    on_regenerate: Callable[[], None] | None = None,
+    on_read_aloud: Callable[[str], None] | None = None,
+    on_edit: Callable[[dict], None] | None = None,
+    on_switch_branch: Callable[[dict, int], None] | None = None,
+):
+    """
+    Build the chat bubble of a message record
+
+    Only stored user messages, the ones with an "id", can be edited.
+    """
+
+    if record.get("role") == "user":
+        if record.get("type") in ("file", "image"):
+            return attachment_bubble(page, record)
+        stored = record.get("id") is not None
+        return user_message_bubble(
+            page,
+            record.get("content", ""),
+            partial(on_edit, record) if on_edit is not None and stored else None,
+            record.get("branch"),
+            (
+                partial(on_switch_branch, record)
+                if on_switch_branch is not None
+                else None
+            ),
+        )
+    return bot_message_bubble(
+        page,
+        record.get("content", ""),
+        on_regenerate,
+        on_read_aloud,
+        record.setdefault("expanded", set()),
+    )
+
+
+async def read_aloud(page: ft.Page, session: Session, text: str):
+    """
+    Play the text read by the voice model of the settings.
+
+    The audio is streamed through the local speech server, which plays it
+    from the first synthesized chunk on and serves it from the disk cache
+    when the same text was read by the same voice before. A browser cannot
+    reach that server, on web the audio is sent with the page once it is
+    synthesized and cached.
+    """
+
+    settings = session.settings
+    if not settings.api_url:
+        page.open(ft.SnackBar(ft.Text("Set your Api Url in the settings first.")))
+        return
+    if not text.strip():
+        return
+
+    server = open_speech_server()
+    client = get_client(settings.api_url, settings.http2)
+    key = speech_key(text, settings.voice_model)
+
+    def source():
+        return stream_speech(
+            settings.api_url,
+            text,
+            settings.voice_model,
+            settings.token,
+            client=client,
+            timeout=settings.timeout,
+        )
+
+    if page.web:
+        try:
+            audio = await server.load(key, source)
+        except (httpx.HTTPError, httpx.InvalidURL, OSError) as error:
+            page.open(ft.SnackBar(ft.Text(f"Could not read aloud: {error}")))
+            return
+        playing = {"src_base64": base64.b64encode(audio).decode()}
+    else:
+        playing = {"src": await server.url(key, source)}
+
+    player = session.player
+    if player is None:
+        player = session.player = ft.Audio(autoplay=True, **playing)
+        page.overlay.append(player)
+        page.update()
+    elif all(getattr(player, name) == value for name, value in playing.items()):
+        player.seek(0)
+        player.resume()
+    else:
+        for name, value in playing.items():
+            setattr(player, name, value)
+        player.update()
+
+
+async def stream_bot_reply(
+    page: ft.Page,
+    message_container: MessageList,
+    settings: Settings,
+    messages: list[dict],
+    cache: ResponseCache | None = None,
+    refresh: bool = False,
+    on_wait: Callable[[str | None], None] | None = None,
+    trace: RequestTrace | None = None,
+) -> str:
+    """
+    Stream the reply to the request messages into a new bot message
+
+    Returns the text of the reply. Cancelling the task running this closes
+    the request, marks the message as stopped and returns the partial reply.
+    A reply in the cache is replayed unless ``refresh`` is set, a complete
+    reply is stored in it.
+
+    Requests to the api wait for their turn in the request scheduler of the
+    api url and token, ``on_wait`` is told why while they do and None once
+    they go out.
+
+    A given ``trace`` is finished with the timings of the request.
+    """
+
+    def waiting(reason: str | None):
+        if trace is not None:
+            trace.waiting(reason)
+        if on_wait is not None:
+            on_wait(reason)
+
+    markdown = bot_message(page, message_container, "", "text")
+    stream = MarkdownStream(
+        markdown,
+        record=message_container.records[-1],
+        updates=scheduler(page),
+        relocate=lambda record: getattr(
+            message_container.find(record), "content", None
+        ),
+    )
+
+    if not settings.api_url:
+        stream.write("Set your **Api Url** in the settings to start chatting.")
+        stream.close()
+        if trace is not None:
+            trace.finish("failed")
+        return ""
+
+    reply = ""
+    status = "ok"
+    try:
+        client = get_client(settings.api_url, settings.http2)
+        # the cache is shared by every session, a reply is only replayed to
+        # the same token that paid for it
+        key = request_key(
+            {
+                "url": completions_url(settings.api_url),
+                "token": settings.token,
+                "model": settings.model,
+                "messages": messages,
+            }
+        )
+        async with aclosing(
+            cached_stream(
+                cache if settings.cache_responses else None,
+                key,
+                lambda: scheduled_stream(
+                    open_request_scheduler(
+                        settings.api_url,
+                        settings.token,
+                        settings.requests_per_minute,
+                        settings.max_in_flight,
+                    ),
+                    page.session_id,
+                    lambda: stream_chat(
+                        settings.api_url,
+                        messages,
+                        settings.token,
+                        settings.model,
+                        client,
+                        trace.http if trace is not None else None,
+                        settings.timeout,
+                    ),
+                    waiting,
                 ),
-                padding=15,
-                ink=True,
-                ink_color=ft.colors.BLACK26,
-                on_long_press=lambda _x: page.open(show_bot_message_menu()),
-                theme=ft.Theme(
-                    text_theme=ft.TextTheme(
-                        display_large=ft.TextStyle(
-                            size=34,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # Large display text
-                        display_medium=ft.TextStyle(
-                            size=30,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # Medium display text
-                        display_small=ft.TextStyle(
-                            size=26,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # Small display text
-                        title_large=ft.TextStyle(
-                            size=24,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # H2
-                        title_medium=ft.TextStyle(
-                            size=22,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # H3
-                        title_small=ft.TextStyle(
-                            size=20,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # H4
-                        headline_large=ft.TextStyle(
-                            size=28,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # H1
-                        headline_medium=ft.TextStyle(
-                            size=24,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # H2
-                        headline_small=ft.TextStyle(
-                            size=20,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # H3
-                        body_large=ft.TextStyle(
-                            size=18,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # Body text
-                        body_medium=ft.TextStyle(
-                            size=16,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # Body text
-                        body_small=ft.TextStyle(
-                            size=14,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # Smaller body text
-                        label_large=ft.TextStyle(
-                            size=18,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # Large labels
-                        label_medium=ft.TextStyle(
-                            size=16,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # Medium labels
-                        label_small=ft.TextStyle(
-                            size=14,
-                            color=color_config.TEXT_COLOR,
-                            font_family="Montserrat",
-                        ),  # Small labels
-                    )
+                refresh=refresh,
+            )
+        ) as deltas:
+            async for delta in deltas:
+                if trace is not None:
+                    trace.token()
+                stream.write(delta)
+        reply = stream.value
+    except asyncio.CancelledError:
+        # stopped by the user, the http stream is already closed at this point
+        reply = stream.value
+        stream.write("\n\n*Response stopped.*")
+        status = "stopped"
+    except (httpx.HTTPError, httpx.InvalidURL) as error:
+        reply = stream.value
+        stream.write(f"\n\n*Request failed: {error}*")
+        status = "failed"
+    finally:
+        stream.close()
+        if trace is not None:
+            trace.finish(status)
+    return reply
+
+
+def api_summarizer(settings: Settings, owner: str) -> Summarizer:
+    """
+    Summarizer asking the model of the settings, its requests wait in the
+    request scheduler with the replies of the owner.
+    """
+
+    async def summarize(summary: str, messages: list[dict]) -> str:
+        client = get_client(settings.api_url, settings.http2)
+        request = summary_request(summary, messages)
+        parts = []
+        async with aclosing(
+            scheduled_stream(
+                open_request_scheduler(
+                    settings.api_url,
+                    settings.token,
+                    settings.requests_per_minute,
+                    settings.max_in_flight,
+                ),
+                owner,
+                lambda: stream_chat(
+                    settings.api_url,
+                    request,
+                    settings.token,
+                    settings.model,
+                    client,
+                    timeout=settings.timeout,
                 ),
             )
-        )
-    message_container.update()
+        ) as deltas:
+            async for delta in deltas:
+                parts.append(delta)
+        return "".join(parts).strip()
+
+    return summarize
 
 
-def navigation_drawer(page: ft.Page):
+def navigation_drawer(
+    page: ft.Page, message_container: MessageList, conversation: Conversation
+):
     """
     Navigation menu
     """
 
+    def on_new_chat(_: ft.ControlEvent):
+        conversation.new()
+        message_container.clear()
+        message_container.update()
+        page.close(drawer)
+
+    def open_conversation(conversation_id: int):
+        conversation.open(conversation_id)
+        message_container.clear()
+        add_messages(page, message_container, conversation.messages())
+        page.close(drawer)
+
     new_chat_button = ft.Container(
         content=ft.Row(
             controls=[
-                ft.Icon(name=ft.icons.OPEN_IN_NEW, color=color_config.TEXT_COLOR),
-                ft.Text(value="New Chat", color=color_config.TEXT_COLOR),
+                themed_icon(page, ft.icons.OPEN_IN_NEW),
+                themed_text(page, "New Chat"),
             ],
         ),
         padding=16,
         ink=True,
-        on_click=lambda _: "",
+        on_click=on_new_chat,
     )
     settings_button = ft.Container(
         content=ft.Row(
             controls=[
-                ft.Icon(name=ft.icons.SETTINGS, color=color_config.TEXT_COLOR),
-                ft.Text(value="Settings", color=color_config.TEXT_COLOR),
+                themed_icon(page, ft.icons.SETTINGS),
+                themed_text(page, "Settings"),
             ],
         ),
         padding=16,
@@ -301,71 +1387,127 @@ def navigation_drawer(page: ft.Page):
         on_click=lambda _: page.go("/settings"),
     )
 
-    settings_container = ft.Container(
-        content=ft.Column(
-            controls=[
-                new_chat_button,
-                settings_button,
-            ],
+    settings_container = color_config.of(page).themed(
+        ft.Container(
+            content=ft.Column(
+                controls=[
+                    new_chat_button,
+                    settings_button,
+                ],
+            ),
         ),
-        border=ft.Border(top=ft.BorderSide(width=1, color=color_config.TEXT_COLOR)),
+        border=lambda c: ft.Border(top=ft.BorderSide(width=1, color=c.TEXT_COLOR)),
     )
 
-    message_history_container = ft.ListView()
-    message_history_container.controls.append(message_history_date("Today"))
-    message_history_container.controls.append(message_history_item("Hello, World!"))
-    message_history_container.controls.append(
-        message_history_item("Hello, Another World!")
+    def on_search(e: ft.ControlEvent):
+        text = e.control.value or ""
+        searching = bool(text.strip()) and conversation.store is not None
+        if searching:
+            search_results.controls = [
+                message_search_result(
+                    page,
+                    result["title"],
+                    result["snippet"],
+                    on_open=partial(open_conversation, result["conversation_id"]),
+                )
+                for result in conversation.store.search(text, owner=conversation.owner)
+            ]
+        else:
+            search_results.controls = []
+        # the loaded history pages stay as they are while searching
+        search_results.visible = searching
+        message_history_container.visible = not searching
+        scheduler(page).mark(search_results, message_history_container)
+
+    search_field = color_config.of(page).themed(
+        ft.TextField(
+            hint_text="Search messages",
+            text_size=14,
+            prefix_icon=ft.icons.SEARCH,
+            border_radius=26,
+            content_padding=ft.Padding(top=9, left=15, bottom=9, right=15),
+            on_change=on_search,
+        ),
+        hint_style=lambda c: ft.TextStyle(
+            size=14, color=ft.colors.with_opacity(0.5, c.TEXT_COLOR)
+        ),
+        color="TEXT_COLOR",
+        border_color="TEXT_COLOR",
     )
-    message_history_container.controls.append(message_history_date("Yesterday"))
-    message_history_container.controls.append(
-        message_history_item("Best library for mobile app development")
+
+    message_history_container = HistoryList(
+        conversation.store,
+        owner=conversation.owner,
+        build_item=lambda item: message_history_item(
+            page, item["title"], on_open=partial(open_conversation, item["id"])
+        ),
+        build_header=partial(message_history_date, page),
+        expand=True,
     )
+    search_results = ft.ListView(expand=True, visible=False)
+    page.run_task(message_history_container.load_more)
 
-    navigation_container = ft.Container(
-        content=ft.Column(
-            controls=[
-                ft.Column(
-                    controls=[
-                        ft.Container(
-                            content=ft.Text(
-                                value="Message History",
-                                weight=ft.FontWeight.BOLD,
-                                size=16,
-                                color=color_config.TEXT_COLOR,
+    navigation_container = color_config.of(page).themed(
+        ft.Container(
+            content=ft.Column(
+                controls=[
+                    ft.Column(
+                        controls=[
+                            ft.Container(
+                                content=themed_text(
+                                    page,
+                                    "Message History",
+                                    weight=ft.FontWeight.BOLD,
+                                    size=16,
+                                ),
+                                padding=ft.Padding(top=0, left=16, bottom=0, right=16),
                             ),
-                            padding=ft.Padding(top=0, left=16, bottom=0, right=16),
-                        ),
-                        message_history_container,
-                    ],
-                ),
-                settings_container,
-            ],
-            alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                            ft.Container(
+                                content=search_field,
+                                padding=ft.Padding(top=0, left=16, bottom=0, right=16),
+                            ),
+                            message_history_container,
+                            search_results,
+                        ],
+                        expand=True,
+                    ),
+                    settings_container,
+                ],
+                alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+            ),
+            padding=ft.Padding(top=16, left=0, bottom=16, right=0),
+            height=page.height,
         ),
-        bgcolor=color_config.BACKGROUND_COLOR,
-        padding=ft.Padding(top=16, left=0, bottom=16, right=0),
-        height=page.height,
+        bgcolor="BACKGROUND_COLOR",
     )
 
-    return ft.NavigationDrawer(controls=[navigation_container])
+    # the history list, for refreshing it when the drawer is opened again
+    drawer = ft.NavigationDrawer(
+        controls=[navigation_container], data=message_history_container
+    )
+    return drawer
 
 
-def message_history_item(title: str):
+def message_history_item(
+    page: ft.Page, title: str, on_open: Callable[[], None] | None = None
+):
     """
     Message history item in the navbar
     """
 
     def on_message_history_clicked(_: ft.ControlEvent):
         """
-        TODO: CLEAR THE MESSAGE CONTENT AND ADD SELECTED COLOR
+        TODO: ADD SELECTED COLOR
         """
 
+        if on_open is not None:
+            on_open()
+
     message_item = ft.Container(
-        content=ft.Text(
-            value=title,
+        content=themed_text(
+            page,
+            title,
             size=14,
-            color=color_config.TEXT_COLOR,
             expand=True,
             overflow=ft.TextOverflow.ELLIPSIS,
         ),
@@ -377,34 +1519,75 @@ def message_history_item(title: str):
     return message_item
 
 
-def message_history_date(date: str):
+def message_search_result(
+    page: ft.Page,
+    title: str,
+    snippet: str,
+    on_open: Callable[[], None] | None = None,
+):
+    """
+    Search result in the navbar, the conversation title and the matching text
+    """
+
+    return ft.Container(
+        content=ft.Column(
+            controls=[
+                themed_text(
+                    page,
+                    title,
+                    size=14,
+                    weight=ft.FontWeight.BOLD,
+                    overflow=ft.TextOverflow.ELLIPSIS,
+                ),
+                color_config.of(page).themed(
+                    ft.Text(
+                        value=snippet,
+                        size=12,
+                        max_lines=2,
+                        overflow=ft.TextOverflow.ELLIPSIS,
+                    ),
+                    color=lambda c: ft.colors.with_opacity(0.6, c.TEXT_COLOR),
+                ),
+            ],
+            spacing=2,
+        ),
+        padding=16,
+        ink=True,
+        on_click=lambda _: on_open() if on_open is not None else None,
+    )
+
+
+def message_history_date(page: ft.Page, date: str):
     """Message history date"""
     return ft.Container(
-        content=ft.Text(
-            value=date,
-            size=12,
-            color=ft.colors.with_opacity(0.4, color_config.TEXT_COLOR),
-            expand=True,
+        content=color_config.of(page).themed(
+            ft.Text(value=date, size=12, expand=True),
+            color=lambda c: ft.colors.with_opacity(0.4, c.TEXT_COLOR),
         ),
         padding=ft.Padding(top=16, left=16, bottom=0, right=16),
     )
 
 
-def show_user_message_menu(page: ft.Page):
+def show_user_message_menu(page: ft.Page, on_edit: Callable[[], None] | None = None):
     """
     Menu option for editing the messages and history
     """
 
+    def edit(_: ft.ControlEvent):
+        page.close(menu)
+        if on_edit is not None:
+            on_edit()
+
     def button(
         button_name: str, icon: ft.Icon, on_click: Callable[[ft.ControlEvent], None]
     ):
         return ft.Container(
             content=ft.Row(
                 controls=[
-                    ft.Icon(name=icon, color=color_config.TEXT_COLOR),
-                    ft.Text(
-                        value=button_name,
-                        color=color_config.TEXT_COLOR,
+                    themed_icon(page, icon),
+                    themed_text(
+                        page,
+                        button_name,
                         size=16,
                         text_align=ft.TextAlign.CENTER,
                     ),
@@ -421,43 +1604,64 @@ def show_user_message_menu(page: ft.Page):
     def go(_):
         page.go("/select_text")
 
-    return ft.BottomSheet(
-        content=ft.Container(
-            content=ft.Column(
-                controls=[
-                    button("Copy", ft.icons.COPY_SHARP, test),
-                    button(
-                        "Select Text",
-                        ft.icons.TEXT_FIELDS_OUTLINED,
-                        go,
-                    ),
-                    button("Edit Message", ft.icons.EDIT_SHARP, test),
-                ],
-                alignment=ft.MainAxisAlignment.END,
-                tight=True,
-                spacing=0,
-            ),
-            border_radius=ft.BorderRadius(
-                top_left=32, top_right=32, bottom_left=0, bottom_right=0
+    menu = color_config.of(page).themed(
+        ft.BottomSheet(
+            content=ft.Container(
+                content=ft.Column(
+                    controls=[
+                        button("Copy", ft.icons.COPY_SHARP, test),
+                        button(
+                            "Select Text",
+                            ft.icons.TEXT_FIELDS_OUTLINED,
+                            go,
+                        ),
+                        button("Edit Message", ft.icons.EDIT_SHARP, edit),
+                    ],
+                    alignment=ft.MainAxisAlignment.END,
+                    tight=True,
+                    spacing=0,
+                ),
+                border_radius=ft.BorderRadius(
+                    top_left=32, top_right=32, bottom_left=0, bottom_right=0
+                ),
             ),
         ),
-        bgcolor=color_config.BACKGROUND_COLOR,
+        bgcolor="BACKGROUND_COLOR",
     )
+    return menu
 
 
-def show_bot_message_menu():
+def show_bot_message_menu(
+    page: ft.Page,
+    on_regenerate: Callable[[], None] | None = None,
+    on_read_aloud: Callable[[], None] | None = None,
+):
     """
     Menu options for bot message
     """
 
-    def button(button_name: str, icon: ft.Icon):
+    def regenerate(_: ft.ControlEvent):
+        page.close(menu)
+        if on_regenerate is not None:
+            on_regenerate()
+
+    def read_aloud(_: ft.ControlEvent):
+        page.close(menu)
+        if on_read_aloud is not None:
+            on_read_aloud()
+
+    def button(
+        button_name: str,
+        icon: ft.Icon,
+        on_click: Callable[[ft.ControlEvent], None] | None = None,
+    ):
         return ft.Container(
             content=ft.Row(
                 controls=[
-                    ft.Icon(name=icon, color=color_config.TEXT_COLOR),
-                    ft.Text(
-                        value=button_name,
-                        color=color_config.TEXT_COLOR,
+                    themed_icon(page, icon),
+                    themed_text(
+                        page,
+                        button_name,
                         size=16,
                         text_align=ft.TextAlign.CENTER,
                     ),
@@ -465,157 +1669,279 @@ def show_bot_message_menu():
             ),
             padding=20,
             ink=True,
-            on_click="",
+            on_click=on_click,
         )
 
-    return ft.BottomSheet(
-        content=ft.Container(
-            content=ft.Column(
-                controls=[
-                    button("Copy", ft.icons.COPY_SHARP),
-                    button("Select Text", ft.icons.TEXT_FIELDS_OUTLINED),
-                    button("Regenerate Response", ft.icons.REPEAT_SHARP),
-                    button("Read Aloud", ft.icons.MULTITRACK_AUDIO_SHARP),
-                ],
-                alignment=ft.MainAxisAlignment.END,
-                tight=True,
-                spacing=0,
-            ),
-            border_radius=ft.BorderRadius(
-                top_left=32, top_right=32, bottom_left=0, bottom_right=0
+    menu = color_config.of(page).themed(
+        ft.BottomSheet(
+            content=ft.Container(
+                content=ft.Column(
+                    controls=[
+                        button("Copy", ft.icons.COPY_SHARP),
+                        button("Select Text", ft.icons.TEXT_FIELDS_OUTLINED),
+                        button(
+                            "Regenerate Response", ft.icons.REPEAT_SHARP, regenerate
+                        ),
+                        button(
+                            "Read Aloud", ft.icons.MULTITRACK_AUDIO_SHARP, read_aloud
+                        ),
+                    ],
+                    alignment=ft.MainAxisAlignment.END,
+                    tight=True,
+                    spacing=0,
+                ),
+                border_radius=ft.BorderRadius(
+                    top_left=32, top_right=32, bottom_left=0, bottom_right=0
+                ),
             ),
         ),
-        bgcolor=color_config.BACKGROUND_COLOR,
+        bgcolor="BACKGROUND_COLOR",
     )
+    return menu
 
 
 # I will be putting more components here lol
-def settings_page():
+def settings_page(
+    page: ft.Page,
+    settings: Settings,
+    on_debug_overlay: Callable[[bool], None] | None = None,
+):
     """
     Settings page for the app
+
+    Every field writes straight into the given settings.
+
+    Parameters:
+    - on_debug_overlay = shows or hides the debug overlay of the chat
     """
 
+    def toggle_debug_overlay(e: ft.ControlEvent):
+        settings.debug_overlay = e.control.value
+        if on_debug_overlay is not None:
+            on_debug_overlay(settings.debug_overlay)
+
+    def save(name: str):
+        def on_change(e: ft.ControlEvent):
+            setattr(settings, name, e.control.value)
+
+        return on_change
+
+    def save_number(name: str):
+        # half typed or invalid numbers keep the value before
+        def on_change(e: ft.ControlEvent):
+            try:
+                value = int(e.control.value)
+            except (TypeError, ValueError):
+                return
+            if value > 0:
+                setattr(settings, name, value)
+
+        return on_change
+
+    def save_limit(name: str):
+        # the limits are shared by every session of the api url and token,
+        # changed here on purpose and not by whoever sends next
+        save_value = save_number(name)
+
+        async def on_change(e: ft.ControlEvent):
+            save_value(e)
+            if settings.api_url:
+                open_request_scheduler(
+                    settings.api_url,
+                    settings.token,
+                    settings.requests_per_minute,
+                    settings.max_in_flight,
+                ).configure(settings.requests_per_minute, settings.max_in_flight)
+
+        return on_change
+
+    def settings_card(**kwargs):
+        return color_config.of(page).themed(
+            ft.Container(**kwargs), bgcolor="CONTAINER_COLOR"
+        )
+
+    def themed_field(**kwargs):
+        return color_config.of(page).themed(
+            ft.TextField(**kwargs),
+            hint_style=lambda c: ft.TextStyle(color=c.TEXT_COLOR),
+            color="TEXT_COLOR",
+            border_color="TEXT_COLOR",
+        )
+
+    def voice_option(name: str):
+        return color_config.of(page).themed(
+            ft.dropdown.Option(name),
+            text_style=lambda c: ft.TextStyle(color=c.TEXT_COLOR),
+        )
+
     settings_container = ft.Container(
         content=ft.Column(
             controls=[
                 # container for each settings
-                ft.Container(
+                settings_card(
                     content=ft.Column(
                         controls=[
-                            ft.Text("Model Instruction", color=color_config.TEXT_COLOR),
-                            ft.TextField(
+                            themed_text(page, "Model Instruction"),
+                            themed_field(
                                 multiline=True,
                                 min_lines=5,
                                 max_lines=5,
+                                value=settings.model_instruction,
                                 hint_text="Act like a [someone], you must be [something]"
                                 " and be [what you want] ...",
-                                hint_style=ft.TextStyle(color=color_config.TEXT_COLOR),
-                                color=color_config.TEXT_COLOR,
-                                border_color=color_config.TEXT_COLOR,
+                                on_change=save("model_instruction"),
                             ),
                         ]
                     ),
-                    bgcolor=color_config.CONTAINER_COLOR,
                     padding=15,
                     border_radius=16,
                 ),
                 # for the api url
-                ft.Container(
+                settings_card(
                     content=ft.Column(
                         controls=[
-                            ft.Text("Api Url", color=color_config.TEXT_COLOR),
-                            ft.TextField(
+                            themed_text(page, "Api Url"),
+                            themed_field(
+                                value=settings.api_url,
                                 hint_text="enter your api url here",
-                                hint_style=ft.TextStyle(color=color_config.TEXT_COLOR),
-                                color=color_config.TEXT_COLOR,
-                                border_color=color_config.TEXT_COLOR,
+                                on_change=save("api_url"),
                             ),
                         ]
                     ),
-                    bgcolor=color_config.CONTAINER_COLOR,
                     padding=15,
                     border_radius=16,
                 ),
                 # for the token
-                ft.Container(
+                settings_card(
                     content=ft.Column(
                         controls=[
                             ft.Row(
                                 controls=[
-                                    ft.Text("Api Token", color=color_config.TEXT_COLOR),
+                                    themed_text(page, "Api Token"),
                                     ft.Switch(
-                                        value=True,
+                                        value=settings.use_api_token,
                                         tooltip="Turn off if no api token needed for your api.",
+                                        on_change=save("use_api_token"),
                                     ),
                                 ],
                                 alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
                             ),
-                            ft.TextField(
+                            themed_field(
+                                value=settings.api_token,
                                 hint_text="enter your api token here",
-                                hint_style=ft.TextStyle(color=color_config.TEXT_COLOR),
-                                color=color_config.TEXT_COLOR,
-                                border_color=color_config.TEXT_COLOR,
+                                on_change=save("api_token"),
                             ),
                         ]
                     ),
-                    bgcolor=color_config.CONTAINER_COLOR,
                     padding=15,
                     border_radius=16,
                 ),
-                # for choosing voice models
-                ft.Container(
+                # for the limits of the api, shared by every user of the token
+                settings_card(
                     content=ft.Column(
                         controls=[
-                            ft.Text("Voice Model", color=color_config.TEXT_COLOR),
-                            ft.Dropdown(
-                                value="Alloy",
-                                border_color=color_config.TEXT_COLOR,
-                                bgcolor=color_config.PRIMARY,
-                                filled=True,
-                                fill_color=color_config.CONTAINER_COLOR,
-                                icon_enabled_color=color_config.TEXT_COLOR,
-                                options=[
-                                    ft.dropdown.Option(
-                                        "Alloy",
-                                        text_style=ft.TextStyle(
-                                            color=color_config.TEXT_COLOR,
-                                        ),
-                                    ),
-                                    ft.dropdown.Option(
-                                        "Echo",
-                                        text_style=ft.TextStyle(
-                                            color=color_config.TEXT_COLOR
-                                        ),
-                                    ),
-                                    ft.dropdown.Option(
-                                        "Fable",
-                                        text_style=ft.TextStyle(
-                                            color=color_config.TEXT_COLOR
-                                        ),
-                                    ),
-                                    ft.dropdown.Option(
-                                        "Onyx",
-                                        text_style=ft.TextStyle(
-                                            color=color_config.TEXT_COLOR
-                                        ),
-                                    ),
-                                    ft.dropdown.Option(
-                                        "Nova",
-                                        text_style=ft.TextStyle(
-                                            color=color_config.TEXT_COLOR
-                                        ),
-                                    ),
-                                    ft.dropdown.Option(
-                                        "Shimmer",
-                                        text_style=ft.TextStyle(
-                                            color=color_config.TEXT_COLOR
-                                        ),
+                            themed_text(page, "Rate Limit"),
+                            themed_field(
+                                value=str(settings.requests_per_minute),
+                                label="Requests per minute",
+                                keyboard_type=ft.KeyboardType.NUMBER,
+                                on_change=save_limit("requests_per_minute"),
+                            ),
+                            themed_field(
+                                value=str(settings.max_in_flight),
+                                label="Parallel requests",
+                                keyboard_type=ft.KeyboardType.NUMBER,
+                                on_change=save_limit("max_in_flight"),
+                            ),
+                        ]
+                    ),
+                    padding=15,
+                    border_radius=16,
+                ),
+                # for replaying replies to identical requests, demos and tests
+                settings_card(
+                    content=ft.Row(
+                        controls=[
+                            themed_text(page, "Cache Replies"),
+                            ft.Switch(
+                                value=settings.cache_responses,
+                                tooltip="Replay the stored reply when the same messages are sent again.",
+                                on_change=save("cache_responses"),
+                            ),
+                        ],
+                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                    ),
+                    padding=15,
+                    border_radius=16,
+                ),
+                # for keeping the requests of long chats small
+                settings_card(
+                    content=ft.Column(
+                        controls=[
+                            ft.Row(
+                                controls=[
+                                    themed_text(page, "Summarize Long Chats"),
+                                    ft.Switch(
+                                        value=settings.summarize_history,
+                                        tooltip="Send a summary instead of the older messages.",
+                                        on_change=save("summarize_history"),
                                     ),
                                 ],
+                                alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                            ),
+                            themed_field(
+                                value=str(settings.summary_threshold),
+                                label="Summarize after tokens",
+                                keyboard_type=ft.KeyboardType.NUMBER,
+                                on_change=save_number("summary_threshold"),
+                            ),
+                        ]
+                    ),
+                    padding=15,
+                    border_radius=16,
+                ),
+                # for choosing voice models
+                settings_card(
+                    content=ft.Column(
+                        controls=[
+                            themed_text(page, "Voice Model"),
+                            color_config.of(page).themed(
+                                ft.Dropdown(
+                                    value=settings.voice_model,
+                                    filled=True,
+                                    on_change=save("voice_model"),
+                                    options=[
+                                        voice_option("Alloy"),
+                                        voice_option("Echo"),
+                                        voice_option("Fable"),
+                                        voice_option("Onyx"),
+                                        voice_option("Nova"),
+                                        voice_option("Shimmer"),
+                                    ],
+                                ),
+                                border_color="TEXT_COLOR",
+                                bgcolor="PRIMARY",
+                                fill_color="CONTAINER_COLOR",
+                                icon_enabled_color="TEXT_COLOR",
                             ),
                         ],
                     ),
-                    bgcolor=color_config.CONTAINER_COLOR,
+                    padding=15,
+                    border_radius=16,
+                ),
+                # for measuring the requests
+                settings_card(
+                    content=ft.Row(
+                        controls=[
+                            themed_text(page, "Debug Overlay"),
+                            ft.Switch(
+                                value=settings.debug_overlay,
+                                tooltip="Show the timings of the last request over the chat.",
+                                on_change=toggle_debug_overlay,
+                            ),
+                        ],
+                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                    ),
                     padding=15,
                     border_radius=16,
                 ),
@@ -625,15 +1951,19 @@ def settings_page():
         )
     )
 
-    return ft.View(
-        "/settings",
-        controls=[settings_container],
-        appbar=ft.AppBar(
-            title=ft.Text("Settings", size=16),
-            bgcolor=ft.colors.TRANSPARENT,
-            color=color_config.TEXT_COLOR,
-            force_material_transparency=True,
+    return color_config.of(page).themed(
+        ft.View(
+            "/settings",
+            controls=[settings_container],
+            appbar=color_config.of(page).themed(
+                ft.AppBar(
+                    title=ft.Text("Settings", size=16),
+                    bgcolor=ft.colors.TRANSPARENT,
+                    force_material_transparency=True,
+                ),
+                color="TEXT_COLOR",
+            ),
+            scroll=ft.ScrollMode.AUTO,
         ),
-        bgcolor=color_config.BACKGROUND_COLOR,
-        scroll=ft.ScrollMode.AUTO,
+        bgcolor="BACKGROUND_COLOR",
     )
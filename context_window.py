@@ -0,0 +1,171 @@
+"""
+Messages sent to the model, fitted into a token budget.
+"""
+
+import re
+from bisect import bisect_left
+from typing import Callable
+
+# tokens of prompt sent per request unless the settings say otherwise
+DEFAULT_BUDGET = 16_000
+# tokens of history from which on the older messages may be summarized
+SUMMARY_THRESHOLD = 8_000
+# tokens the api adds around every message (role, separators)
+MESSAGE_OVERHEAD = 4
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def approximate_tokens(text: str) -> int:
+    """
+    Token count of the text without a vocabulary.
+
+    Punctuation counts as one token and words as one token per four
+    characters, close to what BPE tokenizers give for english and code.
+    """
+
+    return sum((len(word) + 3) // 4 for word in _WORD_PATTERN.findall(text))
+
+
+def tiktoken_counter(encoding: str = "o200k_base") -> Callable[[str], int]:
+    """
+    Exact token counts from tiktoken, when it is installed and its encoding
+    is in the local cache.
+    """
+
+    import tiktoken  # type: ignore  # pylint: disable=import-outside-toplevel
+
+    tokenizer = tiktoken.get_encoding(encoding)
+    return lambda text: len(tokenizer.encode(text, disallowed_special=()))
+
+
+class ContextWindow:
+    """
+    Picks the newest messages of a history that fit into a token budget.
+
+    Token counts are cached per message with a running total, so a send only
+    counts the messages added since the last one. The history is expected to
+    grow and shrink at the end, or to be replaced from some message on by an
+    edit; only the messages after the last unchanged one are counted again.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int] = approximate_tokens,
+        message_overhead: int = MESSAGE_OVERHEAD,
+    ):
+        self.count_tokens = count_tokens
+        self.message_overhead = message_overhead
+        self._history: list[dict] | None = None
+        # the messages counted, to notice the ones replaced since
+        self._counted: list[dict] = []
+        # tokens of the first i messages of the history
+        self._totals = [0]
+        self._instruction = ("", 0)
+        self._summary: tuple[dict | None, int] = (None, 0)
+
+    @property
+    def total(self) -> int:
+        """Tokens of the whole history."""
+        return self._totals[-1]
+
+    @property
+    def counted(self) -> int:
+        """Messages counted and held on to."""
+        return len(self._counted)
+
+    def reset(self):
+        """
+        Let go of the counted messages, e.g. once they are evicted. They are
+        counted again with the next sync.
+        """
+
+        self._history = None
+        self._counted = []
+        self._totals = [0]
+        self._summary = (None, 0)
+
+    def message_tokens(self, message: dict) -> int:
+        """Tokens a message takes up in a request."""
+        return self.count_tokens(message["content"]) + self.message_overhead
+
+    def instruction_tokens(self, instruction: str) -> int:
+        """Tokens the model instruction takes up in a request."""
+        if instruction != self._instruction[0]:
+            self._instruction = (
+                instruction,
+                self.message_tokens({"content": instruction}),
+            )
+        return self._instruction[1]
+
+    def summary_tokens(self, summary: dict) -> int:
+        """Tokens a summary message takes up in a request."""
+        if summary is not self._summary[0]:
+            self._summary = (summary, self.message_tokens(summary))
+        return self._summary[1]
+
+    def tokens(self, start: int = 0, end: int | None = None) -> int:
+        """Tokens of the synced messages from the start to the end."""
+        if end is None:
+            end = len(self._totals) - 1
+        return self._totals[end] - self._totals[start]
+
+    def fitting(self, budget: int, start: int = 0) -> int:
+        """
+        First message from the start on from which the rest of the synced
+        history fits into the budget.
+        """
+
+        return bisect_left(
+            self._totals, self._totals[-1] - budget, start, len(self._totals) - 1
+        )
+
+    def sync(self, history: list[dict]):
+        """
+        Count the messages added to the history since the last call.
+        """
+
+        if history is not self._history:
+            self._history = history
+            self._counted = []
+            self._totals = [0]
+        counted = min(len(self._counted), len(history))
+        # messages removed from the end, or replaced from some point on
+        while counted and history[counted - 1] is not self._counted[counted - 1]:
+            counted -= 1
+        del self._counted[counted:]
+        del self._totals[counted + 1 :]
+        for message in history[counted:]:
+            self._counted.append(message)
+            self._totals.append(self._totals[-1] + self.message_tokens(message))
+
+    def build(
+        self,
+        history: list[dict],
+        instruction: str = "",
+        budget: int = DEFAULT_BUDGET,
+        summary: dict | None = None,
+        start: int = 0,
+    ) -> list[dict]:
+        """
+        Messages of a request: the instruction as system message followed by
+        the newest messages of the history that fit into the budget.
+
+        A ``summary`` message standing in for the messages before ``start``
+        is sent after the instruction, the history is only taken from the
+        start on. The newest message is always sent, even when it alone is
+        over budget.
+        """
+
+        self.sync(history)
+        messages = []
+        if instruction:
+            budget -= self.instruction_tokens(instruction)
+            messages.append({"role": "system", "content": instruction})
+        if summary is not None:
+            budget -= self.summary_tokens(summary)
+            messages.append(summary)
+        if not history:
+            return messages
+        start = min(self.fitting(budget, min(start, len(history))), len(history) - 1)
+        return messages + history[start:]
@@ -0,0 +1,192 @@
+"""
+Conversation shown in the app.
+"""
+
+from storage import ConversationStore
+
+# length of the conversation title taken from the first message
+TITLE_LENGTH = 60
+
+
+class Conversation:
+    """
+    Messages of the open conversation and where they are stored.
+
+    The conversation is only written to the store once the user sends its
+    first message.
+
+    Stored messages form a tree: editing a message forks a branch off its
+    parent, sharing every message before it with the other branches. The
+    history is the branch currently shown, ``ids`` holds the store ids of
+    its messages (None for messages that are only shown) and ``forks`` the
+    replies of every message that has more than one.
+
+    The conversations are those of the owner, the user of the session.
+    """
+
+    def __init__(self, store: ConversationStore | None = None, owner: str = ""):
+        self.store = store
+        self.owner = owner
+        self.id: int | None = None
+        self.history: list[dict] = []
+        self.ids: list[int | None] = []
+        self.forks: dict[int | None, list[int]] = {}
+        # messages stored so far, every one starts or updates a conversation
+        self.stored = 0
+
+    def append(self, role: str, content: str) -> int | None:
+        """
+        Add a message to the history and queue it for storage.
+
+        Returns the id of the stored message.
+        """
+
+        self.history.append({"role": role, "content": content})
+        message_id = None
+        if self.store is not None:
+            if self.id is None:
+                title = content.strip().split("\n")[0][:TITLE_LENGTH] or "New Chat"
+                self.id = self.store.create_conversation(title, self.owner)
+            message_id = self.store.append_message(self.id, role, content)
+            self.stored += 1
+        self.ids.append(message_id)
+        return message_id
+
+    def show(self, messages: list[dict]):
+        """
+        Add messages to the history without storing them.
+        """
+
+        self.history.extend(messages)
+        self.ids.extend([None] * len(messages))
+
+    def pop(self) -> dict:
+        """
+        Remove the last message from the history and the store.
+        """
+
+        message = self.history.pop()
+        message_id = self.ids.pop()
+        if self.store is not None and self.id is not None and message_id is not None:
+            head_id = self.ids[-1] if self.ids else None
+            self.store.delete_message(self.id, message_id, head_id)
+            siblings = self.forks.get(head_id)
+            if siblings is not None and message_id in siblings:
+                siblings.remove(message_id)
+        return message
+
+    def edit(self, index: int, content: str) -> int | None:
+        """
+        Replace the message at the index and everything after it by the
+        edited message, stored as a new branch next to the original.
+
+        Returns the id of the stored message.
+        """
+
+        role = self.history[index]["role"]
+        original_id = self.ids[index]
+        parent_id = self.ids[index - 1] if index else None
+        # in place, the context window only counts the new message
+        del self.history[index:]
+        del self.ids[index:]
+        self.history.append({"role": role, "content": content})
+        message_id = None
+        if self.store is not None and self.id is not None:
+            message_id = self.store.fork_message(self.id, parent_id, role, content)
+            self.stored += 1
+            siblings = self.forks.setdefault(parent_id, [])
+            if not siblings and original_id is not None:
+                siblings.append(original_id)
+            siblings.append(message_id)
+        self.ids.append(message_id)
+        return message_id
+
+    def branch(self, index: int) -> tuple[int, int] | None:
+        """
+        Position of the message at the index among its siblings and their
+        number, counting from 1. None when it has no siblings.
+        """
+
+        siblings = self.forks.get(self.ids[index - 1] if index else None)
+        message_id = self.ids[index]
+        if not siblings or message_id not in siblings:
+            return None
+        return siblings.index(message_id) + 1, len(siblings)
+
+    def switch(self, index: int, step: int) -> bool:
+        """
+        Show the sibling ``step`` places away from the message at the index,
+        with the newest replies under it. Only the history from the index on
+        changes. Returns whether there was such a sibling.
+        """
+
+        branch = self.branch(index)
+        if branch is None or self.store is None or self.id is None:
+            return False
+        position = branch[0] - 1 + step
+        siblings = self.forks[self.ids[index - 1] if index else None]
+        if not 0 <= position < len(siblings):
+            return False
+        # the branch may still be queued for writing
+        self.store.flush()
+        rows = self.store.get_latest_path(siblings[position])
+        del self.history[index:]
+        del self.ids[index:]
+        self.history.extend(
+            {"role": row["role"], "content": row["content"]} for row in rows
+        )
+        self.ids.extend(row["id"] for row in rows)
+        self.store.set_head(self.id, self.ids[-1])
+        return True
+
+    def index(self, message_id: int | None) -> int | None:
+        """Position of a stored message in the history, None if not shown."""
+        if message_id is None:
+            return None
+        for index in range(len(self.ids) - 1, -1, -1):
+            if self.ids[index] == message_id:
+                return index
+        return None
+
+    def messages(self, start: int = 0) -> list[dict]:
+        """
+        Messages of the history from the start on with their store id and,
+        for edited ones, their branch position.
+        """
+
+        messages = []
+        for index in range(start, len(self.history)):
+            message = dict(self.history[index], id=self.ids[index])
+            branch = self.branch(index)
+            if branch is not None:
+                message["branch"] = branch
+            messages.append(message)
+        return messages
+
+    def open(self, conversation_id: int):
+        """
+        Load the branch of a stored conversation that was shown last. The
+        conversation of another owner opens as a new one.
+        """
+
+        assert self.store is not None
+        rows = self.store.get_branch(conversation_id, self.owner)
+        if not rows:
+            self.new()
+            return
+        self.id = conversation_id
+        self.history = [
+            {"role": row["role"], "content": row["content"]} for row in rows
+        ]
+        self.ids = [row["id"] for row in rows]
+        self.forks = self.store.get_forks(conversation_id, self.owner)
+
+    def new(self):
+        """
+        Start an empty conversation.
+        """
+
+        self.id = None
+        self.history = []
+        self.ids = []
+        self.forks = {}
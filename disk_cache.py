@@ -0,0 +1,159 @@
+"""
+Size-bounded file cache with least recently used eviction.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """
+    One file per key in ``directory``, evicting the least recently used
+    files once they add up to more than ``max_bytes``.
+
+    Recency survives restarts through the modification time of the files.
+    Files are written to a temporary name and moved in place, so a reader
+    never sees a partial file.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(suffix):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[: -len(suffix)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+        with self._lock:
+            self._evict()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def path(self, key: str) -> str:
+        """File of the key, whether it is cached or not."""
+        return os.path.join(self.directory, key + self.suffix)
+
+    def temporary_path(self, key: str) -> str:
+        """File to write the key to before ``commit``."""
+        return f"{self.path(key)}.{threading.get_ident()}.tmp"
+
+    def lookup(self, key: str) -> str | None:
+        """
+        File of a cached key, marked as recently used. None on a miss.
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            self.discard(key)
+            return None
+        return self.path(key)
+
+    def discard(self, key: str):
+        """
+        Forget a key whose file turned out to be unreadable, its lookup
+        counts as a miss.
+        """
+
+        with self._lock:
+            self._forget(key)
+            self.hits -= 1
+            self.misses += 1
+        self._remove(key)
+
+    def commit(self, key: str, temporary: str):
+        """
+        Move a fully written temporary file in place as the key.
+        """
+
+        try:
+            size = os.path.getsize(temporary)
+            os.replace(temporary, self.path(key))
+        except OSError:
+            logger.exception("Could not cache %s", key)
+            return
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+
+    def write(self, key: str, data: bytes):
+        """
+        Store the data as the key.
+        """
+
+        temporary = self.temporary_path(key)
+        try:
+            with open(temporary, "wb") as file:
+                file.write(data)
+        except OSError:
+            logger.exception("Could not cache %s", key)
+            return
+        self.commit(key, temporary)
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters and the size of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+    def clear(self):
+        """
+        Remove every cached file.
+        """
+
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+            self._size = 0
+        for key in keys:
+            self._remove(key)
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._size -= size
+
+    def _remove(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self._remove(key)
+            self.evictions += 1
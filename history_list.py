@@ -0,0 +1,135 @@
+"""
+Paginated list of past conversations for the navigation drawer.
+"""
+
+import asyncio
+from datetime import date, datetime
+from typing import Callable
+
+import flet as ft  # type: ignore
+
+from storage import ConversationStore
+
+# conversations read from the store per page
+PAGE_SIZE = 50
+# pixels before the end of the list from which on the next page is loaded
+LOAD_AHEAD = 600
+
+
+def history_date_label(timestamp: float, today: date | None = None) -> str:
+    """
+    Date group of a conversation in the message history
+    """
+
+    day = datetime.fromtimestamp(timestamp).date()
+    days_ago = ((today or date.today()) - day).days
+    if days_ago <= 0:
+        return "Today"
+    if days_ago == 1:
+        return "Yesterday"
+    if days_ago < 7:
+        return "Previous 7 Days"
+    return day.strftime("%B %Y")
+
+
+class HistoryList(ft.ListView):
+    """
+    List view of the stored conversations of the owner, most recent first,
+    read from the store one page at a time as the user scrolls towards its
+    end.
+
+    The conversations come sorted by date, so every page only adds a date
+    header where its label differs from the one before, continuing the
+    groups of the pages already shown. ``refresh`` starts over from the
+    first page, for conversations started or updated since.
+
+    Parameters:
+    - build_item = turns a conversation row into its control
+    - build_header = turns a date label into its header control
+    - page_size = conversations read per page
+    - owner = the user whose conversations are listed
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore | None,
+        build_item: Callable[[dict], ft.Control],
+        build_header: Callable[[str], ft.Control],
+        page_size: int = PAGE_SIZE,
+        owner: str = "",
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.store = store
+        self.build_item = build_item
+        self.build_header = build_header
+        self.page_size = page_size
+        self.owner = owner
+        self.loaded = 0
+        self.exhausted = store is None
+        # (updated_at, id) of the last conversation shown
+        self._cursor: tuple[float, int] | None = None
+        self._last_label: str | None = None
+        self._today: date | None = None
+        self._lock = asyncio.Lock()
+        self.on_scroll_interval = 100
+        self.on_scroll = self._on_scroll
+
+    async def load_more(self) -> int:
+        """
+        Add the next page of conversations, returns how many were added.
+
+        The store is read in a worker thread, and the list only sends the
+        controls of the new page.
+        """
+
+        return await self._load(reset=False)
+
+    async def refresh(self) -> int:
+        """
+        Show the first page again, e.g. once a conversation was started or
+        got new messages, returns how many conversations it has.
+        """
+
+        return await self._load(reset=True)
+
+    async def _load(self, reset: bool) -> int:
+        async with self._lock:
+            if self.store is None or (self.exhausted and not reset):
+                return 0
+            rows = await asyncio.to_thread(
+                self.store.list_conversations,
+                self.page_size,
+                None if reset else self._cursor,
+                self.owner,
+            )
+            if reset:
+                # the pages shown are only replaced once the first one is read
+                self.controls.clear()
+                self.loaded = 0
+                self._cursor = self._last_label = self._today = None
+            self.exhausted = len(rows) < self.page_size
+            if rows:
+                self._cursor = (rows[-1]["updated_at"], rows[-1]["id"])
+            self.controls.extend(self._build(rows))
+            self.loaded += len(rows)
+        if (rows or reset) and self.page is not None:
+            self.update()
+        return len(rows)
+
+    def _build(self, rows: list[dict]) -> list[ft.Control]:
+        if self._today is None:
+            # one day for the whole list, the groups stay put past midnight
+            self._today = date.today()
+        controls = []
+        for row in rows:
+            label = history_date_label(row["updated_at"], self._today)
+            if label != self._last_label:
+                controls.append(self.build_header(label))
+                self._last_label = label
+            controls.append(self.build_item(row))
+        return controls
+
+    async def _on_scroll(self, e: ft.OnScrollEvent):
+        if not self.exhausted and e.pixels >= e.max_scroll_extent - LOAD_AHEAD:
+            await self.load_more()
@@ -2,23 +2,36 @@
 Main application
 """
 
+import os
+
 import flet as ft  # type: ignore
 
 from components import (
+    add_messages,
     appbar,
-    bot_message,
+    message_area,
     message_content,
     navigation_drawer,
     user_input_options,
-    user_message,
     settings_page,
+    show_debug_overlay,
+    switch_color_mode,
+    themed_text,
 )
 
+from attachments import UPLOAD_DIRECTORY
 from color_scheme import color_config
+from conversation import Conversation
+from router import Router
+from session import Session, load_owner, sessions
+from response_cache import open_cache
+from storage import open_store
 
 
 # generate random messages
-def generate_message(page: ft.Page, message_container: ft.ListView):
+def generate_message(
+    page: ft.Page, message_container: ft.ListView, conversation: Conversation
+):
     """
     Generate sample message
     """
@@ -43,21 +56,9 @@ def generate_message(page: ft.Page, message_container: ft.ListView):
             "content": "Great, if you need anything, just ask right away.",
         },
     ]
-    for message in messages:
-        if message.get("role") == "user":
-            user_message(
-                page=page,
-                message_container=message_container,
-                message=message.get("content", ""),
-                message_type="text",
-            )
-        else:
-            bot_message(
-                page=page,
-                message_container=message_container,
-                message=message.get("content", ""),
-                message_type="text",
-            )
+    # sample messages are only shown, they are not stored
+    conversation.show(messages)
+    add_messages(page, message_container, messages)
 
 
 async def main(page: ft.Page):
@@ -69,71 +70,88 @@ async def main(page: ft.Page):
     page.window.always_on_top = True
 
     # set color theme
-    color_config.mode = page.platform_brightness.value
+    color_config.of(page).mode = page.platform_brightness.value
 
     # set font
     page.fonts = {"Montserrat": "fonts/Montserrat-Regular.ttf"}
     page.theme = ft.Theme(font_family="Montserrat")
 
-    message_container = message_content()
+    session = Session(page, open_store(), open_cache(), await load_owner(page))
+    sessions.add(session)
+    settings = session.settings
+    conversation = session.conversation
+
+    message_container = session.message_container = message_content(page, session)
+
+    # the navigation menu and its message history are built when first opened,
+    # the history is read again when messages were stored since
+    listed = conversation.stored
+
+    def open_navigation_menu():
+        nonlocal listed
+        if main_app.drawer is None:
+            main_app.drawer = navigation_drawer(page, message_container, conversation)
+        elif conversation.stored != listed:
+            page.run_task(main_app.drawer.data.refresh)
+        listed = conversation.stored
+        # added and opened in one update of the view
+        main_app.drawer.open = True
+        main_app.update()
 
-    # add message logs on navigation menu
-    navigation_menu = navigation_drawer(page)
+    area = message_area(page, message_container)
 
     # main app
-    main_app = ft.View(
-        "/",
-        controls=[
-            message_container,
-            user_input_options(page, message_container=message_container),
-        ],
-        appbar=appbar(page=page, navigation_menu=navigation_menu),
-        drawer=navigation_menu,
-        bgcolor=color_config.BACKGROUND_COLOR,
-        padding=0,
+    main_app = color_config.of(page).themed(
+        ft.View(
+            "/",
+            controls=[
+                area,
+                user_input_options(page, session),
+            ],
+            appbar=appbar(page=page, open_menu=open_navigation_menu),
+            padding=0,
+        ),
+        bgcolor="BACKGROUND_COLOR",
     )
 
-    # settings
-    settings_page_view = settings_page()
-
     # select text
-    select_text_page = ft.View(
-        "/select_text",
-        controls=[
-            ft.Text(
-                "This is a sample text",
-                size=16,
-                color=color_config.TEXT_COLOR,
-                selectable=True,
-            )
-        ],
-        appbar=ft.AppBar(
-            title=ft.Text("Select Text", size=24, color=color_config.TEXT_COLOR)
+    def select_text_page():
+        return ft.View(
+            "/select_text",
+            controls=[
+                themed_text(page, "This is a sample text", size=16, selectable=True)
+            ],
+            appbar=ft.AppBar(title=themed_text(page, "Select Text", size=24)),
+        )
+
+    # views other than the main app are only built when first visited
+    router = Router(page)
+    router.register("/", lambda: main_app)
+    router.register(
+        "/settings",
+        lambda: settings_page(
+            page,
+            settings,
+            on_debug_overlay=lambda visible: show_debug_overlay(
+                page, session, area, visible
+            ),
         ),
     )
+    router.register("/select_text", select_text_page)
 
-    def route_change(_: ft.RouteChangeEvent):
-        page.views.clear()
-        page.views.append(main_app)
-
-        if page.route == "/select_text":
-            page.views.append(select_text_page)
-
-        if page.route == "/settings":
-            page.views.append(settings_page_view)
-
-        page.update()
-
-    def view_pop(_: ft.ViewPopEvent):
-        page.views.pop()
-        top_view = page.views[-1]
-        page.go(top_view.route)
-
-    page.on_route_change = route_change
-    page.on_view_pop = view_pop
+    page.on_route_change = router.route_change
+    page.on_view_pop = router.view_pop
     page.go("/")
 
-    message_container.did_mount = lambda: generate_message(page, message_container)
+    # follow the light and dark mode of the device without rebuilding
+    page.on_platform_brightness_change = lambda _: switch_color_mode(
+        page, page.platform_brightness.value
+    )
+
+    message_container.did_mount = lambda: generate_message(
+        page, message_container, conversation
+    )
 
 
-ft.app(main)
+if __name__ == "__main__":
+    ft.app(main, upload_dir=os.path.abspath(UPLOAD_DIRECTORY))
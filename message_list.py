@@ -0,0 +1,244 @@
+"""
+Windowed list view for long conversations.
+"""
+
+from bisect import bisect_right
+from typing import Callable
+
+import flet as ft  # type: ignore
+
+from streaming import shown_text
+
+# rough size of a message bubble, only used to size the off-screen spacers
+LINE_HEIGHT = 24
+CHARS_PER_LINE = 40
+BUBBLE_PADDING = 30
+# height of an attached image thumbnail
+IMAGE_HEIGHT = 256
+
+
+def estimate_height(record: dict) -> float:
+    """
+    Estimate the rendered height of a message from its content.
+
+    Collapsed code blocks of bot messages only count their first lines.
+    """
+
+    content = record.get("content", "")
+    if record.get("role") == "assistant":
+        content = shown_text(content, record.get("expanded", ()))
+    lines = sum(1 + len(line) // CHARS_PER_LINE for line in content.split("\n"))
+    image = IMAGE_HEIGHT if record.get("type") == "image" else 0
+    return BUBBLE_PADDING + lines * LINE_HEIGHT + image
+
+
+class MessageList(ft.ListView):
+    """
+    List view that only keeps the visible messages plus a margin as controls.
+
+    Every message is kept as a lightweight record (a {"role", "content"}
+    dict), off-screen messages are replaced by two spacers with their
+    estimated height and are rebuilt from their record with ``build`` when
+    the user scrolls back to them.
+
+    Parameters:
+    - build = turns a record into its message control
+    - window = number of messages kept alive around the visible region
+    - margin = messages kept alive past each edge of the window
+    """
+
+    def __init__(
+        self,
+        build: Callable[[dict], ft.Control],
+        window: int = 40,
+        margin: int = 10,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.build_message = build
+        self.window = window
+        self.margin = margin
+        self.records: list[dict] = []
+        self.start = 0
+        self.end = 0
+        self._live: dict[int, ft.Control] = {}
+        self._tops = [0.0]
+        self._top_spacer = ft.Container(height=0, visible=False)
+        self._bottom_spacer = ft.Container(height=0, visible=False)
+        self._follow = bool(self.auto_scroll)
+        self.controls = [self._top_spacer, self._bottom_spacer]
+        self.on_scroll_interval = 100
+        self.on_scroll = self._on_scroll
+
+    def append(self, record: dict, control: ft.Control | None = None) -> ft.Control:
+        """
+        Add a message at the end, building its control unless one is given.
+
+        The caller sends the update.
+        """
+
+        index = len(self.records)
+        self.records.append(record)
+        self._tops.append(
+            self._tops[-1] + estimate_height(record) + (self.spacing or 0)
+        )
+        if control is None:
+            control = self.build_message(record)
+        control.data = record
+
+        if self.end == index and self._follow:
+            # the user is at the bottom, keep following the conversation
+            self._live[index] = control
+            self.end = index + 1
+            self.controls.insert(len(self.controls) - 1, control)
+            if self.end - self.start > self.window + self.margin:
+                self._set_window(self.end - self.window, self.end)
+        else:
+            self._sync_spacers()
+        return control
+
+    def extend(self, records: list[dict]):
+        """
+        Add many messages at the end, only building the ones that end up in
+        the window.
+
+        The caller sends the update.
+        """
+
+        if not records:
+            return
+        following = self.end == len(self.records) and self._follow
+        spacing = self.spacing or 0
+        for record in records:
+            self.records.append(record)
+            self._tops.append(self._tops[-1] + estimate_height(record) + spacing)
+
+        if following:
+            end = len(self.records)
+            start = self.start
+            if end - start > self.window + self.margin:
+                start = end - self.window
+            self._set_window(start, end)
+        else:
+            self._sync_spacers()
+
+    def pop(self) -> dict:
+        """
+        Remove the last message and return its record.
+
+        The caller sends the update.
+        """
+
+        index = len(self.records) - 1
+        record = self.records.pop()
+        self._tops.pop()
+        control = self._live.pop(index, None)
+        if control is not None:
+            self.controls.remove(control)
+        self.end = min(self.end, len(self.records))
+        self.start = min(self.start, self.end)
+        self._sync_spacers()
+        return record
+
+    def truncate(self, length: int):
+        """
+        Remove the messages from ``length`` on, the ones before keep their
+        controls.
+
+        The caller sends the update.
+        """
+
+        if length >= len(self.records):
+            return
+        del self.records[length:]
+        del self._tops[length + 1 :]
+        for index in [index for index in self._live if index >= length]:
+            self.controls.remove(self._live.pop(index))
+        self.end = min(self.end, length)
+        self.start = min(self.start, self.end)
+        self._sync_spacers()
+
+    def position(self, record: dict) -> int | None:
+        """Index of the record in the list, None if it is not in it."""
+        for index in range(len(self.records) - 1, -1, -1):
+            if self.records[index] is record:
+                return index
+        return None
+
+    def clear(self):
+        """
+        Remove every message.
+        """
+
+        self.records.clear()
+        self._live.clear()
+        self._tops = [0.0]
+        self.start = self.end = 0
+        self._sync_spacers()
+        self.controls = [self._top_spacer, self._bottom_spacer]
+
+    def find(self, record: dict) -> ft.Control | None:
+        """
+        Control currently showing the record, None if it is off-screen.
+        """
+
+        for control in self._live.values():
+            if control.data is record:
+                return control
+        return None
+
+    def live_count(self) -> int:
+        """Number of messages currently backed by a control."""
+        return len(self._live)
+
+    def _set_window(self, start: int, end: int):
+        start = max(0, start)
+        end = min(len(self.records), end)
+        for index in list(self._live):
+            if not start <= index < end:
+                # off-screen, only the record stays behind
+                del self._live[index]
+        for index in range(start, end):
+            if index not in self._live:
+                self._live[index] = self.build_message(self.records[index])
+                self._live[index].data = self.records[index]
+        self.start, self.end = start, end
+        self._sync_spacers()
+        self.controls = (
+            [self._top_spacer]
+            + [self._live[index] for index in range(start, end)]
+            + [self._bottom_spacer]
+        )
+
+    def _sync_spacers(self):
+        # spacers stand in for the messages outside the window, minus the
+        # list spacing flet already puts around them
+        spacing = self.spacing or 0
+        self._top_spacer.height = max(0, self._tops[self.start] - spacing)
+        self._top_spacer.visible = self.start > 0
+        self._bottom_spacer.height = max(
+            0, self._tops[-1] - self._tops[self.end] - spacing
+        )
+        self._bottom_spacer.visible = self.end < len(self.records)
+
+    async def _on_scroll(self, e: ft.OnScrollEvent):
+        if not self.records:
+            return
+
+        at_bottom = e.pixels >= e.max_scroll_extent - LINE_HEIGHT
+        first = bisect_right(self._tops, e.pixels) - 1
+        last = bisect_right(self._tops, e.pixels + e.viewport_dimension)
+        changed = at_bottom != self._follow
+        self._follow = at_bottom
+
+        if (first < self.start + self.margin // 2 and self.start > 0) or (
+            last > self.end - self.margin // 2 and self.end < len(self.records)
+        ):
+            extra = max(0, self.window - (last - first)) // 2
+            self._set_window(first - self.margin - extra, last + self.margin + extra)
+            changed = True
+
+        if changed:
+            # auto scroll would yank a user reading old messages to the bottom
+            self.auto_scroll = self._follow
+            self.update()
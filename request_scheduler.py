@@ -0,0 +1,306 @@
+"""
+Requests to the api shared fairly between the sessions of the process.
+"""
+
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Hashable
+
+import httpx
+
+from chat_api import endpoint_origin
+
+# limits of an endpoint until the settings say otherwise
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_MAX_IN_FLIGHT = 32
+# attempts of a request answered with a retryable error before giving up
+MAX_ATTEMPTS = 5
+# seconds of the first backoff, doubled with every attempt up to the most
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# responses worth another try, the rest are the request's fault
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def backoff_delay(
+    attempt: int, retry_after: float | None = None, rng: random.Random = random
+) -> float:
+    """
+    Seconds to wait before the next attempt, jittered over the whole
+    exponential window so retrying sessions spread out instead of coming
+    back together. A ``Retry-After`` of the server is waited at least.
+    """
+
+    delay = rng.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+    return max(delay, retry_after or 0.0)
+
+
+def retry_after(response: httpx.Response) -> float | None:
+    """Seconds the server asked to wait in its ``Retry-After``, if any."""
+    try:
+        return max(0.0, float(response.headers.get("retry-after", "")))
+    except ValueError:
+        return None
+
+
+class RequestScheduler:
+    """
+    Admits the requests to one endpoint and token.
+
+    A request goes out once a token of the bucket is free, refilled at
+    ``requests_per_minute``, and fewer than ``max_in_flight`` requests are
+    open. Waiting requests are queued per owner, usually a session, and
+    admitted round robin between the owners, so one session sending a lot
+    does not hold up the others.
+
+    A rate limited response holds the whole endpoint for the backoff, the
+    other sessions would only run into the same limit.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.admitted = 0
+        self.retries = 0
+        self.max_waiting = 0
+        self.total_wait = 0.0
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._hold_until = 0.0
+        # owner -> its waiting requests, the owner to admit next first
+        self._queues: OrderedDict[Hashable, deque[asyncio.Future]] = OrderedDict()
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def burst(self) -> float:
+        """Requests that may go out at once after a quiet while."""
+        return max(1.0, min(self.max_in_flight, self.requests_per_minute / 60))
+
+    @property
+    def waiting(self) -> int:
+        """Requests waiting to be admitted."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def configure(self, requests_per_minute: float, max_in_flight: int):
+        """
+        Change the limits, requests already admitted are not affected.
+        """
+
+        self._refill()
+        self.requests_per_minute = max(1.0, requests_per_minute)
+        self.max_in_flight = max(1, max_in_flight)
+        self._tokens = min(self._tokens, self.burst)
+        self._dispatch()
+
+    async def acquire(self, owner: Hashable) -> bool:
+        """
+        Wait for the turn of a request of the owner. Returns whether it had
+        to wait.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(owner, deque()).append(future)
+        self._dispatch()
+        if future.done():
+            return False
+
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # admitted just as it was cancelled, hand the slot on
+                self.release()
+            else:
+                self._remove(owner, future)
+            raise
+        self.total_wait += time.monotonic() - start
+        return True
+
+    def release(self):
+        """
+        A request is done, admit the next one.
+        """
+
+        self.in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, owner: Hashable, on_wait: Callable[[], None] | None = None):
+        """
+        Hold one request slot for the owner, ``on_wait`` is called first
+        when the request has to queue.
+        """
+
+        if on_wait is not None and not self._free():
+            on_wait()
+        await self.acquire(owner)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def hold(self, seconds: float):
+        """
+        Admit nothing for the seconds, the endpoint asked to slow down.
+        """
+
+        self._hold_until = max(self._hold_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        """How many requests were admitted and how long they waited."""
+        return {
+            "admitted": self.admitted,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "mean_wait_ms": round(self.total_wait / max(1, self.admitted) * 1000, 1),
+        }
+
+    def _free(self) -> bool:
+        self._refill()
+        return (
+            not self._queues
+            and self.in_flight < self.max_in_flight
+            and self._tokens >= 1
+            and time.monotonic() >= self._hold_until
+        )
+
+    def _refill(self):
+        now = time.monotonic()
+        rate = self.requests_per_minute / 60
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+
+    def _remove(self, owner: Hashable, future: asyncio.Future):
+        queue = self._queues.get(owner)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self._queues[owner]
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        now = time.monotonic()
+        while self._queues and self.in_flight < self.max_in_flight:
+            if now < self._hold_until or self._tokens < 1:
+                break
+            owner, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                # the owner waits for its next turn behind the others
+                self._queues.move_to_end(owner)
+            else:
+                del self._queues[owner]
+            if future.done():
+                continue
+            future.set_result(None)
+            self._tokens -= 1
+            self.in_flight += 1
+            self.admitted += 1
+
+        if self._queues and self.in_flight < self.max_in_flight:
+            # blocked by the bucket or a hold, not by open requests
+            rate = self.requests_per_minute / 60
+            delay = max(self._hold_until - now, (1 - self._tokens) / rate, 0.0)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+
+async def scheduled_stream(
+    requests: RequestScheduler,
+    owner: Hashable,
+    stream: Callable[[], AsyncIterator[str]],
+    on_wait: Callable[[str | None], None] | None = None,
+    rng: random.Random = random,
+) -> AsyncIterator[str]:
+    """
+    Stream ``stream()`` once the scheduler admits it.
+
+    A request failing with a retryable status or before it was answered is
+    tried again after a jittered backoff, up to ``MAX_ATTEMPTS`` times. Once
+    the reply started streaming errors are passed on, a retry would repeat
+    what was shown. ``on_wait`` is told why the request is waiting, and
+    None once it goes out after waiting.
+    """
+
+    waited = False
+
+    def queued():
+        nonlocal waited
+        waited = True
+        if on_wait is not None:
+            ahead = requests.waiting
+            on_wait(f"Queued, {ahead} ahead" if ahead else "Queued")
+
+    for attempt in range(MAX_ATTEMPTS):
+        streamed = False
+        try:
+            async with requests.slot(owner, queued):
+                if waited and on_wait is not None:
+                    on_wait(None)
+                waited = False
+                deltas = stream()
+                try:
+                    async for delta in deltas:
+                        streamed = True
+                        yield delta
+                finally:
+                    await deltas.aclose()
+            return
+        except httpx.HTTPStatusError as error:
+            status = error.response.status_code
+            if status not in RETRY_STATUSES or attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = backoff_delay(attempt, retry_after(error.response), rng)
+            if status == 429:
+                requests.hold(delay)
+        except (httpx.ConnectError, httpx.RemoteProtocolError, httpx.ReadError):
+            if streamed or attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = backoff_delay(attempt, rng=rng)
+        requests.retries += 1
+        waited = True
+        if on_wait is not None:
+            on_wait(f"Retrying in {delay:.0f} s")
+        await asyncio.sleep(delay)
+
+
+# (endpoint origin, token) -> its scheduler
+_schedulers: dict[tuple[str, str | None], RequestScheduler] = {}
+
+
+def open_request_scheduler(
+    api_url: str,
+    token: str | None,
+    requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+) -> RequestScheduler:
+    """
+    Request scheduler of the endpoint and token, shared by every session of
+    the process.
+
+    The limits are those of the first call, later calls get the scheduler
+    as it is. Sending a request does not change the limits for everybody,
+    only ``RequestScheduler.configure`` does.
+    """
+
+    key = (endpoint_origin(api_url), token)
+    requests = _schedulers.get(key)
+    if requests is None:
+        requests = _schedulers[key] = RequestScheduler(
+            requests_per_minute, max_in_flight
+        )
+    return requests
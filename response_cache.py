@@ -0,0 +1,104 @@
+"""
+On-disk cache of streamed model replies.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import AsyncIterator, Callable
+
+from disk_cache import DiskCache
+
+DEFAULT_DIRECTORY = "response_cache"
+# bytes of replies kept on disk before the least recently used are dropped
+DEFAULT_MAX_BYTES = 50 * 2**20
+
+
+def request_key(payload: dict) -> str:
+    """
+    Hash of a request payload, the same for the same endpoint, token, model
+    and messages.
+    """
+
+    data = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResponseCache(DiskCache):
+    """
+    Replies stored as the list of deltas they were streamed in, one file per
+    request, evicting the least recently used once over ``max_bytes``.
+    """
+
+    def __init__(
+        self, directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        super().__init__(directory, max_bytes, ".json")
+
+    def get(self, key: str) -> list[str] | None:
+        """
+        Deltas of the cached reply, None on a miss.
+        """
+
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            self.discard(key)
+            return None
+
+    def put(self, key: str, deltas: list[str]):
+        """
+        Store the deltas of a complete reply.
+        """
+
+        self.write(key, json.dumps(deltas, separators=(",", ":")).encode())
+
+
+async def cached_stream(
+    cache: ResponseCache | None,
+    key: str,
+    stream: Callable[[], AsyncIterator[str]],
+    refresh: bool = False,
+) -> AsyncIterator[str]:
+    """
+    Stream a reply from the cache, or from ``stream()`` storing it once it
+    is complete. ``refresh`` skips the lookup, the new reply replaces the
+    cached one. Without a cache the stream is passed through.
+    """
+
+    deltas = cache.get(key) if cache is not None and not refresh else None
+    if deltas is not None:
+        for delta in deltas:
+            yield delta
+            # give the ui the same chances to render as a real stream
+            await asyncio.sleep(0)
+        return
+
+    recorded = []
+    deltas_stream = stream()
+    try:
+        async for delta in deltas_stream:
+            recorded.append(delta)
+            yield delta
+    finally:
+        await deltas_stream.aclose()
+    if cache is not None:
+        cache.put(key, recorded)
+
+
+_caches: dict[str, ResponseCache] = {}
+
+
+def open_cache(directory: str = DEFAULT_DIRECTORY) -> ResponseCache:
+    """
+    Cache for the directory, shared by every session of the process.
+    """
+
+    cache = _caches.get(directory)
+    if cache is None:
+        cache = _caches[directory] = ResponseCache(directory)
+    return cache
@@ -0,0 +1,73 @@
+"""
+Routing between the views of the app.
+"""
+
+from typing import Callable
+
+import flet as ft  # type: ignore
+
+
+class Router:
+    """
+    Views of the app by route, each built the first time it is visited.
+
+    Every route is shown on top of the "/" view. On a route change only the
+    views that differ from the current stack are popped and pushed, the
+    views that stay are neither rebuilt nor resent.
+    """
+
+    def __init__(self, page: ft.Page):
+        self.page = page
+        self._builders: dict[str, Callable[[], ft.View]] = {}
+        self._views: dict[str, ft.View] = {}
+
+    def register(self, route: str, build: Callable[[], ft.View]):
+        """
+        Add the view builder of a route.
+        """
+
+        self._builders[route] = build
+
+    def view(self, route: str) -> ft.View:
+        """
+        View of the route, built and cached on first use.
+        """
+
+        view = self._views.get(route)
+        if view is None:
+            view = self._views[route] = self._builders[route]()
+        return view
+
+    def stack(self, route: str) -> list[ft.View]:
+        """
+        Views shown for the route, bottom first.
+        """
+
+        if route == "/" or route not in self._builders:
+            return [self.view("/")]
+        return [self.view("/"), self.view(route)]
+
+    def route_change(self, _: ft.RouteChangeEvent):
+        """
+        Show the views of the current route.
+        """
+
+        views = self.page.views
+        wanted = self.stack(self.page.route)
+        kept = 0
+        while kept < min(len(views), len(wanted)) and views[kept] is wanted[kept]:
+            kept += 1
+        if kept == len(views) == len(wanted):
+            return
+        del views[kept:]
+        views.extend(wanted[kept:])
+        self.page.update()
+
+    def view_pop(self, _: ft.ViewPopEvent):
+        """
+        Go back to the view below the top one.
+        """
+
+        if len(self.page.views) > 1:
+            # route_change pops the top view
+            self.page.go(self.page.views[-2].route)
@@ -0,0 +1,279 @@
+"""
+Per-session state and its memory budget.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable
+
+import flet as ft  # type: ignore
+
+from context_window import ContextWindow
+from conversation import Conversation
+from message_list import MessageList
+from response_cache import ResponseCache
+from settings import Settings
+from storage import ConversationStore
+from summary import RollingSummary
+
+logger = logging.getLogger(__name__)
+
+# characters of message content a session may keep in memory while idle
+SESSION_BUDGET = 1_000_000
+# seconds a session is idle before its messages are evicted to the store
+IDLE_TIMEOUT = 300
+# seconds an idle session over its budget is kept
+OVER_BUDGET_TIMEOUT = 30
+# seconds between two sweeps for idle sessions
+SWEEP_INTERVAL = 15
+# seconds stopping waits for a cancelled reply to release its request
+STOP_TIMEOUT = 2
+
+# client storage key of the id of the user of the app
+OWNER_KEY = "chat.owner"
+
+# lifecycle states of the app in which nobody looks at it
+HIDDEN_STATES = {
+    ft.AppLifecycleState.HIDE,
+    ft.AppLifecycleState.INACTIVE,
+    ft.AppLifecycleState.PAUSE,
+}
+
+
+async def load_owner(page: ft.Page) -> str:
+    """
+    Id of the user of the page, kept in the client storage so every visit
+    from the same browser or device sees the same conversations. A client
+    that does not answer gets an id for the session only.
+    """
+
+    try:
+        owner = await page.client_storage.get_async(OWNER_KEY)
+        if not owner:
+            owner = uuid.uuid4().hex
+            await page.client_storage.set_async(OWNER_KEY, owner)
+        return owner
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        # flet raises a bare Exception for errors of the client
+        logger.warning("Could not read the user id from the client: %s", error)
+        return uuid.uuid4().hex
+
+
+class Session:
+    """
+    Everything one user session holds on to.
+
+    The messages of an idle session can be evicted, they are stored anyway,
+    and are read back from the store once the user comes back.
+    """
+
+    def __init__(
+        self,
+        page: ft.Page,
+        store: ConversationStore | None = None,
+        cache: ResponseCache | None = None,
+        owner: str = "",
+    ):
+        self.page = page
+        self.cache = cache
+        self.settings = Settings()
+        self.conversation = Conversation(store, owner)
+        self.context = ContextWindow()
+        self.summary = RollingSummary(self.context)
+        self.message_container: MessageList | None = None
+        self.reply_task: asyncio.Task | None = None
+        # asks for the last reply again, set by the input options
+        self.regenerate: Callable[[], Awaitable[None]] | None = None
+        # forks a user message record into a new version, set likewise
+        self.edit: Callable[[dict, str], Awaitable[None]] | None = None
+        # plays Read Aloud, added to the page overlay on first use
+        self.player: ft.Audio | None = None
+        # timings of the last request, built when first shown
+        self.debug_panel: ft.Text | None = None
+        self.idle_since: float | None = None
+        self.evicted = False
+
+    async def stop(self):
+        """
+        Cancel the reply being streamed, if any.
+        """
+
+        task = self.reply_task
+        if task is not None:
+            task.cancel()
+            # the request unwinds on its own, only wait a bounded time for it
+            await asyncio.wait({task}, timeout=STOP_TIMEOUT)
+
+    def memory(self) -> int:
+        """
+        Characters of message content held by the session.
+
+        Shown and stored messages may share their strings, so this is an
+        upper bound.
+        """
+
+        size = sum(len(message["content"]) for message in self.conversation.history)
+        if self.message_container is not None:
+            size += sum(
+                len(record.get("content", ""))
+                for record in self.message_container.records
+            )
+        return size
+
+    def idle_for(self, now: float) -> float:
+        """Seconds since the user left, 0 while they are around."""
+        return 0 if self.idle_since is None else now - self.idle_since
+
+    def pause(self):
+        """
+        The user left, the session may be evicted from now on.
+        """
+
+        if self.idle_since is None:
+            self.idle_since = time.monotonic()
+
+    def resume(self):
+        """
+        The user is back, bring back the evicted messages.
+        """
+
+        self.idle_since = None
+        self.restore()
+
+    def evict(self) -> bool:
+        """
+        Drop the messages of the open conversation from memory.
+
+        Only a conversation that is stored and not waiting for a reply can be
+        evicted. Returns whether the messages were dropped.
+        """
+
+        conversation = self.conversation
+        if (
+            self.evicted
+            or self.reply_task is not None
+            or conversation.store is None
+            or conversation.id is None
+        ):
+            return False
+        conversation.history = []
+        conversation.ids = []
+        # the context window and the summary point at the messages as well
+        self.context.reset()
+        self.summary.release()
+        if self.message_container is not None:
+            self.message_container.clear()
+            if self.message_container.page is not None:
+                self.message_container.update()
+        self.evicted = True
+        return True
+
+    def restore(self):
+        """
+        Read the evicted messages back from the store and show them again.
+        """
+
+        if not self.evicted:
+            return
+        self.evicted = False
+        conversation = self.conversation
+        assert conversation.store is not None and conversation.id is not None
+        # the last messages may still be queued for writing
+        conversation.store.flush()
+        conversation.open(conversation.id)
+        if self.message_container is not None:
+            self.message_container.extend(
+                [dict(message, type="text") for message in conversation.messages()]
+            )
+            if self.message_container.page is not None:
+                self.message_container.update()
+
+
+class SessionManager:
+    """
+    Sessions of the process, evicting the idle ones.
+
+    A session is idle while its client is disconnected or the app is hidden.
+    Idle sessions are evicted after ``idle_timeout`` seconds, or after
+    ``over_budget_timeout`` seconds when they hold more than ``budget``
+    characters of messages.
+    """
+
+    def __init__(
+        self,
+        budget: int = SESSION_BUDGET,
+        idle_timeout: float = IDLE_TIMEOUT,
+        over_budget_timeout: float = OVER_BUDGET_TIMEOUT,
+    ):
+        self.budget = budget
+        self.idle_timeout = idle_timeout
+        self.over_budget_timeout = over_budget_timeout
+        self.sessions: dict[str, Session] = {}
+        self._timer: asyncio.TimerHandle | None = None
+
+    def add(self, session: Session):
+        """
+        Track a new session until its page is closed, which stops its reply.
+        The session owns the connection and close handlers of its page.
+        """
+
+        page = session.page
+        session_id = page.session_id
+        self.sessions[session_id] = session
+
+        def on_lifecycle_change(e: ft.AppLifecycleStateChangeEvent):
+            if e.state in HIDDEN_STATES:
+                session.pause()
+            else:
+                session.resume()
+
+        page.on_connect = lambda _: session.resume()
+        page.on_disconnect = lambda _: session.pause()
+
+        async def on_close(_: ft.ControlEvent):
+            self.sessions.pop(session_id, None)
+            # nobody is left to read the reply, do not keep streaming it
+            await session.stop()
+
+        page.on_app_lifecycle_state_change = on_lifecycle_change
+        page.on_close = on_close
+
+        if self._timer is None:
+            self._timer = page.loop.call_later(
+                SWEEP_INTERVAL, self._on_timer, page.loop
+            )
+
+    def sweep(self, now: float | None = None) -> int:
+        """
+        Evict the sessions idle for too long, returns how many were evicted.
+        """
+
+        now = time.monotonic() if now is None else now
+        evicted = 0
+        for session in list(self.sessions.values()):
+            idle_for = session.idle_for(now)
+            if not idle_for or session.evicted:
+                continue
+            if idle_for >= self.idle_timeout or (
+                idle_for >= self.over_budget_timeout and session.memory() > self.budget
+            ):
+                evicted += session.evict()
+        return evicted
+
+    def memory(self) -> int:
+        """Characters of message content held by every session."""
+        return sum(session.memory() for session in self.sessions.values())
+
+    def _on_timer(self, loop: asyncio.AbstractEventLoop):
+        self._timer = None
+        try:
+            self.sweep()
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Sweeping idle sessions failed")
+        if self.sessions:
+            self._timer = loop.call_later(SWEEP_INTERVAL, self._on_timer, loop)
+
+
+sessions = SessionManager()
@@ -0,0 +1,48 @@
+"""
+User settings for this application.
+"""
+
+import httpx
+
+from context_window import DEFAULT_BUDGET, SUMMARY_THRESHOLD
+from request_scheduler import DEFAULT_MAX_IN_FLIGHT, DEFAULT_REQUESTS_PER_MINUTE
+
+
+class Settings:
+    """
+    Values collected from the settings page.
+    """
+
+    def __init__(self):
+        self.model_instruction = ""
+        self.api_url = ""
+        self.api_token = ""
+        self.use_api_token = True
+        self.voice_model = "Alloy"
+        self.model = "gpt-4o-mini"
+        self.http2 = False
+        self.connect_timeout = 10.0
+        self.read_timeout = 60.0
+        # tokens of history and instruction sent per request
+        self.context_budget = DEFAULT_BUDGET
+        # send a rolling summary instead of the older messages of long chats
+        self.summarize_history = False
+        self.summary_threshold = SUMMARY_THRESHOLD
+        # replay replies to identical requests from the response cache, for
+        # demos and tests, normal chats always ask the api
+        self.cache_responses = False
+        # limits of the api url and token, shared by every session using them
+        self.requests_per_minute = DEFAULT_REQUESTS_PER_MINUTE
+        self.max_in_flight = DEFAULT_MAX_IN_FLIGHT
+        # timings of the last request over the messages
+        self.debug_overlay = False
+
+    @property
+    def token(self):
+        """Api token to send, or None when the token switch is off."""
+        return self.api_token if self.use_api_token and self.api_token else None
+
+    @property
+    def timeout(self):
+        """Timeouts of the api requests."""
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
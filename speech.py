@@ -0,0 +1,245 @@
+"""
+Read Aloud: synthesized speech, cached on disk and streamed to the player.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import AsyncIterator, Callable
+
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = "speech_cache"
+# bytes of audio kept on disk before the least recently used are dropped
+DEFAULT_MAX_BYTES = 200 * 2**20
+# bytes sent to the player per chunk when serving from the cache
+CHUNK_SIZE = 64 * 1024
+# texts the server remembers how to synthesize
+MAX_PENDING = 256
+
+
+def speech_key(text: str, voice: str) -> str:
+    """
+    Cache key of a text read by a voice.
+    """
+
+    return f"{hashlib.sha256(text.encode()).hexdigest()}-{voice.lower()}"
+
+
+class AudioCache(DiskCache):
+    """
+    Synthesized mp3 audio, one file per text and voice.
+    """
+
+    def __init__(
+        self, directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        super().__init__(directory, max_bytes, ".mp3")
+
+
+class Synthesis:
+    """
+    Audio of one text being synthesized, written to the cache while any
+    number of listeners read it as it comes in.
+    """
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.done = False
+        self.error: Exception | None = None
+        self._changed = asyncio.Condition()
+
+    async def feed(self, source: AsyncIterator[bytes], cache: AudioCache, key: str):
+        """
+        Pull the audio from the source into the listeners and the cache.
+        """
+
+        temporary = cache.temporary_path(key)
+        try:
+            with open(temporary, "wb") as file:
+                async for chunk in source:
+                    file.write(chunk)
+                    self.chunks.append(chunk)
+                    async with self._changed:
+                        self._changed.notify_all()
+            cache.commit(key, temporary)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            logger.warning("Speech synthesis failed: %s", error)
+            self.error = error
+            with contextlib.suppress(OSError):
+                os.remove(temporary)
+        finally:
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def read(self) -> AsyncIterator[bytes]:
+        """
+        The audio from its first chunk on, waiting for the chunks to come.
+        """
+
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: index < len(self.chunks) or self.done
+                )
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done and index == len(self.chunks):
+                break
+        if self.error is not None:
+            raise self.error
+
+
+class SpeechServer:
+    """
+    Local http server the audio player streams Read Aloud from.
+
+    Every text and voice gets its own url. The first request for it
+    synthesizes the speech, passing it on to the player from the first
+    chunk while writing it to the cache, requests after that are served
+    from the cache. Requests arriving during the synthesis share it.
+    """
+
+    def __init__(self, cache: AudioCache, host: str = "127.0.0.1"):
+        self.cache = cache
+        self.host = host
+        self.port: int | None = None
+        self.syntheses = 0
+        self._server: asyncio.Server | None = None
+        # key -> how to synthesize it, the most recent last
+        self._sources: OrderedDict[str, Callable[[], AsyncIterator[bytes]]] = (
+            OrderedDict()
+        )
+        self._running: dict[str, Synthesis] = {}
+
+    async def start(self):
+        """
+        Listen on a free port, unless already listening.
+        """
+
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle, self.host, 0)
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """
+        Stop listening.
+        """
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def url(self, key: str, source: Callable[[], AsyncIterator[bytes]]) -> str:
+        """
+        Url of the audio of the key, ``source()`` streams it when not cached.
+        """
+
+        await self.start()
+        self._remember(key, source)
+        return f"http://{self.host}:{self.port}/speech/{key}.mp3"
+
+    async def load(self, key: str, source: Callable[[], AsyncIterator[bytes]]) -> bytes:
+        """
+        The whole audio of the key, for players that cannot reach the
+        server. It is synthesized and cached first when not cached yet.
+        """
+
+        self._remember(key, source)
+        return b"".join([chunk async for chunk in self.audio(key)])
+
+    def _remember(self, key: str, source: Callable[[], AsyncIterator[bytes]]):
+        self._sources[key] = source
+        self._sources.move_to_end(key)
+        while len(self._sources) > MAX_PENDING:
+            self._sources.popitem(last=False)
+
+    def known(self, key: str) -> bool:
+        """Whether the server can serve the key."""
+        return key in self._sources or key in self._running
+
+    async def audio(self, key: str) -> AsyncIterator[bytes]:
+        """
+        Chunks of the audio of the key, from the cache or synthesized.
+        """
+
+        path = self.cache.lookup(key)
+        if path is not None:
+            with open(path, "rb") as file:
+                while chunk := file.read(CHUNK_SIZE):
+                    yield chunk
+            return
+
+        synthesis = self._running.get(key)
+        if synthesis is None:
+            synthesis = self._running[key] = Synthesis()
+            self.syntheses += 1
+            task = asyncio.create_task(
+                synthesis.feed(self._sources[key](), self.cache, key)
+            )
+            task.add_done_callback(lambda _: self._running.pop(key, None))
+        async for chunk in synthesis.read():
+            yield chunk
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            method, target, _ = (
+                request.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+            )
+            key = target.rsplit("/", 1)[-1].removesuffix(".mp3")
+            if (
+                method not in ("GET", "HEAD")
+                or not target.startswith("/speech/")
+                or not (self.known(key) or key in self.cache)
+            ):
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                return
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: audio/mpeg\r\n"
+                b"Transfer-Encoding: chunked\r\n"
+                b"Cache-Control: no-store\r\n"
+                b"Connection: close\r\n\r\n"
+            )
+            if method == "HEAD":
+                return
+            async for chunk in self.audio(key):
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except (ConnectionError, OSError) as error:
+            # the player went away or the synthesis failed, the cut off
+            # response tells the player something went wrong
+            logger.debug("Speech response aborted: %s", error)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            logger.warning("Speech response aborted: %s", error)
+        finally:
+            writer.close()
+
+
+_servers: dict[str, SpeechServer] = {}
+
+
+def open_speech_server(directory: str = DEFAULT_DIRECTORY) -> SpeechServer:
+    """
+    Speech server of the cache directory, shared by every session of the
+    process.
+    """
+
+    server = _servers.get(directory)
+    if server is None:
+        server = _servers[directory] = SpeechServer(AudioCache(directory))
+    return server
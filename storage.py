@@ -0,0 +1,525 @@
+"""
+Local conversation store on SQLite.
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = "chats.db"
+# newest matches of a search that get ranked
+SEARCH_CANDIDATES = 500
+# tries of a batch of writes while another process holds the database
+WRITE_ATTEMPTS = 5
+# seconds before the first retry, doubled for every next one
+RETRY_DELAY = 0.1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    head_id INTEGER,
+    owner TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS conversations_updated_at
+    ON conversations (updated_at, id);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations (id)
+        ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    parent_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS messages_conversation_id
+    ON messages (conversation_id, id);
+"""
+
+# messages form a tree, every edit forks a branch off the edited message's
+# parent and the conversation shows the path from its head up to the root
+BRANCH_SCHEMA = """
+CREATE INDEX IF NOT EXISTS messages_parent_id ON messages (parent_id, id);
+"""
+
+# stores from before branches hold one linear path per conversation
+BRANCH_MIGRATION = """
+ALTER TABLE conversations ADD COLUMN head_id INTEGER;
+ALTER TABLE messages ADD COLUMN parent_id INTEGER;
+UPDATE messages SET parent_id = (
+    SELECT MAX(previous.id) FROM messages AS previous
+    WHERE previous.conversation_id = messages.conversation_id
+        AND previous.id < messages.id
+);
+UPDATE conversations SET head_id = (
+    SELECT MAX(id) FROM messages WHERE conversation_id = conversations.id
+);
+"""
+
+# every user only sees their own conversations, stores from before owners
+# keep theirs under the empty owner
+OWNER_MIGRATION = """
+ALTER TABLE conversations ADD COLUMN owner TEXT NOT NULL DEFAULT '';
+"""
+OWNER_SCHEMA = """
+CREATE INDEX IF NOT EXISTS conversations_owner_updated_at
+    ON conversations (owner, updated_at, id);
+"""
+
+# full-text index of the messages, kept in sync by triggers
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    content, content='messages', content_rowid='id', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages
+BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+
+def locked(error: sqlite3.Error) -> bool:
+    """Whether the write failed because the database was busy, not itself."""
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+def search_query(text: str) -> str:
+    """
+    Turn what the user typed into an fts5 query.
+
+    Every word is matched literally. While the user is still typing the last
+    word (no trailing space) it is matched as a prefix.
+    """
+
+    words = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+    if words and not text[-1].isspace():
+        words[-1] += "*"
+    return " ".join(words)
+
+
+class ConversationStore:
+    """
+    Conversations and their messages, stored in SQLite in WAL mode.
+
+    Writes never block the caller: they are queued and a writer thread
+    commits them in batches of up to ``batch_size``. Ids are handed out
+    right away so callers can refer to rows that are not written yet, so a
+    batch is retried while the database is locked and a write that fails
+    is dropped alone.
+    Reads use one connection per thread and are keyset paginated.
+
+    Every conversation belongs to an owner, the user who started it, and
+    the reads of conversations only see those of the owner given.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, batch_size: int = 256):
+        self.path = path
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._id_lock = threading.Lock()
+        self._writes: queue.Queue = queue.Queue()
+
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        columns = {
+            row["name"] for row in connection.execute("PRAGMA table_info(messages)")
+        }
+        if "parent_id" not in columns:
+            connection.executescript(f"BEGIN; {BRANCH_MIGRATION} COMMIT;")
+        connection.executescript(BRANCH_SCHEMA)
+        columns = {
+            row["name"]
+            for row in connection.execute("PRAGMA table_info(conversations)")
+        }
+        if "owner" not in columns:
+            connection.executescript(f"BEGIN; {OWNER_MIGRATION} COMMIT;")
+        connection.executescript(OWNER_SCHEMA)
+        indexed = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+        ).fetchone()
+        connection.executescript(SEARCH_SCHEMA)
+        if not indexed:
+            # index the messages stored before search existed
+            with connection:
+                connection.execute(
+                    "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')"
+                )
+        self._last_conversation_id = connection.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM conversations"
+        ).fetchone()[0]
+        self._last_message_id = connection.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM messages"
+        ).fetchone()[0]
+
+        self._writer = threading.Thread(
+            target=self._write_loop, name="conversation-store-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    # writes
+
+    def create_conversation(self, title: str, owner: str = "") -> int:
+        """
+        Queue a new conversation of the owner and return its id.
+        """
+
+        now = time.time()
+        with self._id_lock:
+            self._last_conversation_id += 1
+            conversation_id = self._last_conversation_id
+        self._writes.put(
+            (
+                "INSERT INTO conversations (id, title, created_at, updated_at, owner)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, title, now, now, owner),
+            )
+        )
+        return conversation_id
+
+    def append_message(self, conversation_id: int, role: str, content: str) -> int:
+        """
+        Queue a message after the head of a conversation and return its id.
+        """
+
+        return self._insert_message(
+            conversation_id,
+            role,
+            content,
+            "(SELECT head_id FROM conversations WHERE id = ?)",
+            conversation_id,
+        )
+
+    def fork_message(
+        self, conversation_id: int, parent_id: int | None, role: str, content: str
+    ) -> int:
+        """
+        Queue a message under the parent, a new root when None, and return its
+        id. The message becomes the head, its siblings stay as branches.
+        """
+
+        return self._insert_message(conversation_id, role, content, "?", parent_id)
+
+    def _insert_message(
+        self, conversation_id: int, role: str, content: str, parent: str, *params
+    ) -> int:
+        now = time.time()
+        with self._id_lock:
+            self._last_message_id += 1
+            message_id = self._last_message_id
+        self._writes.put(
+            (
+                "INSERT INTO messages"
+                " (id, conversation_id, role, content, created_at, parent_id)"
+                f" VALUES (?, ?, ?, ?, ?, {parent})",
+                (message_id, conversation_id, role, content, now, *params),
+            )
+        )
+        self._writes.put(
+            (
+                "UPDATE conversations SET updated_at = ?, head_id = ? WHERE id = ?",
+                (now, message_id, conversation_id),
+            )
+        )
+        return message_id
+
+    def delete_message(
+        self, conversation_id: int, message_id: int, head_id: int | None
+    ):
+        """
+        Queue the removal of a message without replies and move the head of
+        its conversation.
+        """
+
+        self._writes.put(("DELETE FROM messages WHERE id = ?", (message_id,)))
+        self.set_head(conversation_id, head_id)
+
+    def set_head(self, conversation_id: int, head_id: int | None):
+        """
+        Queue switching the conversation to the branch ending in the message.
+        """
+
+        self._writes.put(
+            (
+                "UPDATE conversations SET head_id = ? WHERE id = ?",
+                (head_id, conversation_id),
+            )
+        )
+
+    def delete_conversation(self, conversation_id: int):
+        """
+        Queue the removal of a conversation and its messages.
+        """
+
+        self._writes.put(("DELETE FROM conversations WHERE id = ?", (conversation_id,)))
+
+    def flush(self, timeout: float | None = None):
+        """
+        Wait until every queued write is committed.
+        """
+
+        done: Future = Future()
+        self._writes.put(done)
+        done.result(timeout)
+
+    def close(self):
+        """
+        Commit the queued writes and stop the writer thread.
+        """
+
+        self._writes.put(None)
+        self._writer.join()
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _write_loop(self):
+        connection = self._connect()
+        running = True
+        while running:
+            batch = [self._writes.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            writes = []
+            waiting = []
+            for write in batch:
+                if write is None:
+                    running = False
+                elif isinstance(write, Future):
+                    waiting.append(write)
+                else:
+                    writes.append(write)
+            if writes:
+                self._commit(connection, writes)
+            for done in waiting:
+                done.set_result(None)
+        connection.close()
+
+    def _commit(self, connection: sqlite3.Connection, writes: list[tuple]):
+        # one transaction per batch, a write that fails is rolled back to its
+        # savepoint alone, the ids of the others are already handed out
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                with connection:
+                    connection.execute("BEGIN")
+                    for write in writes:
+                        connection.execute("SAVEPOINT write")
+                        try:
+                            connection.execute(*write)
+                        except sqlite3.Error as error:
+                            if locked(error):
+                                raise
+                            connection.execute("ROLLBACK TO write")
+                            logger.error("Dropped a write (%s): %s", error, write[0])
+                        connection.execute("RELEASE write")
+                return
+            except sqlite3.Error as error:
+                if connection.in_transaction:
+                    # a failed commit leaves the transaction open
+                    connection.rollback()
+                if not locked(error) or attempt == WRITE_ATTEMPTS - 1:
+                    logger.exception("Dropped a batch of %d writes", len(writes))
+                    return
+                logger.warning("Store busy, retrying a batch of %d writes", len(writes))
+                time.sleep(RETRY_DELAY * 2**attempt)
+
+    # reads
+
+    def list_conversations(
+        self,
+        limit: int = 50,
+        before: tuple[float, int] | None = None,
+        owner: str = "",
+    ) -> list[dict]:
+        """
+        Conversations of the owner, most recently updated first.
+
+        Pass the (updated_at, id) of the last conversation of a page as
+        ``before`` to get the next page.
+        """
+
+        if before is None:
+            rows = self._reader().execute(
+                "SELECT id, title, created_at, updated_at FROM conversations"
+                " WHERE owner = ?"
+                " ORDER BY updated_at DESC, id DESC LIMIT ?",
+                (owner, limit),
+            )
+        else:
+            rows = self._reader().execute(
+                "SELECT id, title, created_at, updated_at FROM conversations"
+                " WHERE owner = ? AND (updated_at, id) < (?, ?)"
+                " ORDER BY updated_at DESC, id DESC LIMIT ?",
+                (owner, *before, limit),
+            )
+        return [dict(row) for row in rows]
+
+    def get_messages(
+        self, conversation_id: int, limit: int = 500, after_id: int = 0
+    ) -> list[dict]:
+        """
+        Messages of a conversation, oldest first.
+
+        Pass the id of the last message of a page as ``after_id`` to get the
+        next page.
+        """
+
+        rows = self._reader().execute(
+            "SELECT id, role, content, created_at FROM messages"
+            " WHERE conversation_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (conversation_id, after_id, limit),
+        )
+        return [dict(row) for row in rows]
+
+    def get_branch(self, conversation_id: int, owner: str = "") -> list[dict]:
+        """
+        Messages on the path from the root to the head of a conversation of
+        the owner, oldest first.
+        """
+
+        rows = self._reader().execute(
+            "WITH RECURSIVE path (id, depth) AS ("
+            " SELECT head_id, 0 FROM conversations WHERE id = ? AND owner = ?"
+            " UNION ALL"
+            " SELECT messages.parent_id, path.depth + 1"
+            " FROM messages JOIN path ON messages.id = path.id"
+            ")"
+            " SELECT messages.id, parent_id, role, content, created_at"
+            " FROM path JOIN messages ON messages.id = path.id"
+            " ORDER BY path.depth DESC",
+            (conversation_id, owner),
+        )
+        return [dict(row) for row in rows]
+
+    def get_latest_path(self, message_id: int) -> list[dict]:
+        """
+        The message followed by its newest reply, the newest reply to that
+        and so on, down to a message without replies.
+        """
+
+        rows = self._reader().execute(
+            "WITH RECURSIVE path (id, depth) AS ("
+            " SELECT ?, 0"
+            " UNION ALL"
+            " SELECT (SELECT MAX(child.id) FROM messages AS child"
+            "  WHERE child.parent_id = path.id), path.depth + 1"
+            " FROM path WHERE path.id IS NOT NULL"
+            ")"
+            " SELECT messages.id, parent_id, role, content, created_at"
+            " FROM path JOIN messages ON messages.id = path.id"
+            " ORDER BY path.depth",
+            (message_id,),
+        )
+        return [dict(row) for row in rows]
+
+    def get_forks(
+        self, conversation_id: int, owner: str = ""
+    ) -> dict[int | None, list[int]]:
+        """
+        Messages of a conversation of the owner with more than one reply, the
+        root (None) included when it was edited, mapped to the ids of their
+        replies.
+        """
+
+        rows = self._reader().execute(
+            "SELECT messages.parent_id, messages.id FROM messages"
+            " JOIN (SELECT parent_id FROM messages WHERE conversation_id = ?"
+            "  GROUP BY parent_id HAVING COUNT(*) > 1) AS forks"
+            " ON messages.parent_id IS forks.parent_id"
+            " JOIN conversations ON conversations.id = messages.conversation_id"
+            " WHERE messages.conversation_id = ? AND conversations.owner = ?"
+            " ORDER BY messages.id",
+            (conversation_id, conversation_id, owner),
+        )
+        forks: dict[int | None, list[int]] = {}
+        for parent_id, message_id in rows:
+            forks.setdefault(parent_id, []).append(message_id)
+        return forks
+
+    def search(self, text: str, limit: int = 20, owner: str = "") -> list[dict]:
+        """
+        Messages of the conversations of the owner matching the text, best
+        match first, with a snippet of the matching part.
+        """
+
+        query = search_query(text)
+        if not query:
+            return []
+        # ranking every match of a common word is what makes search slow, so
+        # only the newest SEARCH_CANDIDATES matches are ranked
+        connection = self._reader()
+        oldest = connection.execute(
+            "SELECT messages_fts.rowid FROM messages_fts"
+            " JOIN messages ON messages.id = messages_fts.rowid"
+            " JOIN conversations ON conversations.id = messages.conversation_id"
+            " WHERE messages_fts MATCH ? AND conversations.owner = ?"
+            " ORDER BY messages_fts.rowid DESC LIMIT 1 OFFSET ?",
+            (query, owner, SEARCH_CANDIDATES - 1),
+        ).fetchone()
+        rows = connection.execute(
+            "SELECT messages.id, messages.conversation_id, messages.role,"
+            " conversations.title, matches.snippet"
+            " FROM ("
+            "  SELECT messages_fts.rowid, rank,"
+            "  snippet(messages_fts, 0, '', '', '...', 12) AS snippet"
+            "  FROM messages_fts"
+            "  JOIN messages ON messages.id = messages_fts.rowid"
+            "  JOIN conversations ON conversations.id = messages.conversation_id"
+            "  WHERE messages_fts MATCH ? AND messages_fts.rowid >= ?"
+            "  AND conversations.owner = ?"
+            "  ORDER BY rank LIMIT ?"
+            " ) AS matches"
+            " JOIN messages ON messages.id = matches.rowid"
+            " JOIN conversations ON conversations.id = messages.conversation_id"
+            " ORDER BY matches.rank",
+            (query, oldest[0] if oldest else 0, owner, limit),
+        )
+        return [dict(row) for row in rows]
+
+
+_stores: dict[str, ConversationStore] = {}
+
+
+def open_store(path: str = DEFAULT_PATH) -> ConversationStore:
+    """
+    Store for the path, shared by every session of the process.
+    """
+
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = ConversationStore(path)
+    return store
@@ -0,0 +1,333 @@
+"""
+Incremental rendering of streamed bot replies.
+"""
+
+import asyncio
+import re
+import time
+from typing import Callable, Iterable
+
+import flet as ft  # type: ignore
+
+from update_scheduler import UpdateScheduler, scheduler
+
+# characters of plain markdown per segment, ended at the next blank line
+SEGMENT_CHARS = 2000
+# code blocks longer than this many lines only show their first lines
+CODE_PREVIEW_LINES = 30
+
+FENCE = re.compile(r" {0,3}(`{3,}|~{3,})")
+
+
+def split_segments(text: str) -> list[tuple[str, str]]:
+    """
+    Split markdown into ("text" | "code", source) segments, one per fenced
+    code block and one per run of paragraphs of about ``SEGMENT_CHARS``
+    characters. Joined, the sources give back the text.
+
+    Segments only end at complete lines, so a text that grows keeps the
+    segments it had, except the last one.
+    """
+
+    segments = []
+    start = position = 0
+    fence = None
+    for line in text.splitlines(keepends=True):
+        end = position + len(line)
+        complete = line.endswith("\n")
+        if fence is not None:
+            closing = line.strip()
+            if (
+                complete
+                and closing.startswith(fence)
+                and closing == fence[0] * len(closing)
+            ):
+                segments.append(("code", text[start:end]))
+                start, fence = end, None
+        elif match := FENCE.match(line):
+            if position > start:
+                segments.append(("text", text[start:position]))
+            start, fence = position, match.group(1)
+        elif complete and not line.strip() and end - start >= SEGMENT_CHARS:
+            segments.append(("text", text[start:end]))
+            start = end
+        position = end
+    if start < len(text) or not segments:
+        segments.append(("code" if fence is not None else "text", text[start:]))
+    return segments
+
+
+def code_lines(source: str) -> int:
+    """Lines of code of a fenced block, without its fences."""
+    lines = source.splitlines()
+    closed = len(lines) > 1 and FENCE.fullmatch(lines[-1].strip()) is not None
+    return len(lines) - 1 - closed
+
+
+def code_preview(source: str, preview_lines: int = CODE_PREVIEW_LINES) -> str | None:
+    """
+    First lines of a fenced code block, closed again, None when the block
+    is short enough to be shown whole.
+    """
+
+    if code_lines(source) <= preview_lines:
+        return None
+    lines = source.splitlines(keepends=True)
+    fence = FENCE.match(lines[0]).group(1)
+    return "".join(lines[: preview_lines + 1]) + fence
+
+
+def shown_text(text: str, expanded: Iterable[int] = ()) -> str:
+    """
+    Markdown as shown by ``SegmentedMarkdown``, long code blocks cut to
+    their preview unless their segment index is in ``expanded``.
+    """
+
+    shown = []
+    for index, (kind, source) in enumerate(split_segments(text)):
+        preview = code_preview(source) if kind == "code" else None
+        shown.append(source if preview is None or index in expanded else preview)
+    return "".join(shown)
+
+
+class CodeBlock(ft.Column):
+    """
+    Fenced code block that shows its first ``preview_lines`` lines until it
+    is expanded. The rest of a long block is only sent to the client once
+    the user asks for it, and while it streams in collapsed only the line
+    count changes.
+
+    Parameters:
+    - build_markdown = makes the empty markdown control of the block
+    - on_toggle = told whether the block was expanded or collapsed
+    """
+
+    def __init__(
+        self,
+        source: str,
+        build_markdown: Callable[[], ft.Markdown],
+        expanded: bool = False,
+        preview_lines: int = CODE_PREVIEW_LINES,
+        on_toggle: Callable[[bool], None] | None = None,
+    ):
+        super().__init__(spacing=0)
+        self.expanded = expanded
+        self.preview_lines = preview_lines
+        self.on_toggle = on_toggle
+        self.markdown = build_markdown()
+        self.toggle = ft.TextButton(on_click=self._toggle, visible=False)
+        self.controls = [self.markdown, self.toggle]
+        self._source = ""
+        self.source = source
+
+    @property
+    def source(self) -> str:
+        """Markdown of the whole block, fences included."""
+        return self._source
+
+    @source.setter
+    def source(self, source: str):
+        self._source = source
+        preview = code_preview(source, self.preview_lines)
+        value = source if preview is None or self.expanded else preview
+        if self.markdown.value != value:
+            self.markdown.value = value
+        self.toggle.visible = preview is not None
+        if preview is not None:
+            self.toggle.text = (
+                "Show less" if self.expanded else f"Show all {code_lines(source)} lines"
+            )
+
+    def _toggle(self, _: ft.ControlEvent):
+        self.expanded = not self.expanded
+        self.source = self._source
+        if self.on_toggle is not None:
+            self.on_toggle(self.expanded)
+        scheduler(self.page).mark(self)
+
+
+class SegmentedMarkdown(ft.Column):
+    """
+    Markdown shown as a column of segments, see ``split_segments``.
+
+    Setting ``value`` only touches the segments whose source changed, so a
+    streamed reply re-sends its last paragraphs instead of the whole text,
+    and a mode switch only re-themes the code blocks. Long code blocks are
+    ``CodeBlock``s.
+
+    Parameters:
+    - build_markdown = makes an empty markdown control, themed for code
+      when called with True
+    - expanded = indexes of the segments of the expanded code blocks, may be
+      shared with the message record so they stay expanded when rebuilt
+    """
+
+    def __init__(
+        self,
+        value: str,
+        build_markdown: Callable[[bool], ft.Markdown],
+        expanded: set[int] | None = None,
+        **kwargs,
+    ):
+        super().__init__(spacing=0, **kwargs)
+        self.build_markdown = build_markdown
+        self.expanded = expanded if expanded is not None else set()
+        self.controls = []
+        self._segments: list[tuple[str, str]] = []
+        self._value = ""
+        self.value = value
+
+    @property
+    def value(self) -> str:
+        """The whole markdown."""
+        return self._value
+
+    @value.setter
+    def value(self, value: str):
+        # unchanged segments before the last one are kept, only the text
+        # after them is split again
+        keep = offset = 0
+        for _, source in self._segments[:-1]:
+            if not value.startswith(source, offset):
+                break
+            keep += 1
+            offset += len(source)
+        segments = self._segments[:keep] + split_segments(value[offset:])
+
+        for index in range(keep, len(segments)):
+            kind, source = segments[index]
+            if index < len(self._segments) and self._segments[index][0] == kind:
+                if self._segments[index][1] != source:
+                    self._patch(self.controls[index], kind, source)
+                continue
+            control = self._build(index, kind, source)
+            if index < len(self.controls):
+                self.controls[index] = control
+            else:
+                self.controls.append(control)
+        del self.controls[len(segments) :]
+        self._segments = segments
+        self._value = value
+
+    def _build(self, index: int, kind: str, source: str) -> ft.Control:
+        if kind == "text":
+            markdown = self.build_markdown(False)
+            markdown.value = source
+            return markdown
+
+        def on_toggle(expanded: bool):
+            if expanded:
+                self.expanded.add(index)
+            else:
+                self.expanded.discard(index)
+
+        return CodeBlock(
+            source,
+            lambda: self.build_markdown(True),
+            expanded=index in self.expanded,
+            on_toggle=on_toggle,
+        )
+
+    @staticmethod
+    def _patch(control: ft.Control, kind: str, source: str):
+        if kind == "text":
+            control.value = source
+        else:
+            control.source = source
+
+
+class MarkdownStream:
+    """
+    Grow a markdown control in place while text is streamed into it.
+
+    The control can be anything with a ``value``, a ``SegmentedMarkdown``
+    only re-sends the segments the new text touches.
+
+    Calling ``update()`` for every token floods the websocket, so writes are
+    buffered and flushed at most once per ``interval`` seconds, or right away
+    once ``max_chars`` characters are pending.
+
+    When a message ``record`` is given its content is kept in sync, and
+    ``relocate`` is asked for the control showing the record whenever the
+    markdown is no longer on the page (e.g. rebuilt after scrolling).
+
+    With ``updates`` the flushes are marked on the update scheduler of the
+    page and go out with the other changes of the frame.
+    """
+
+    def __init__(
+        self,
+        markdown: ft.Markdown | SegmentedMarkdown,
+        interval: float = 0.05,
+        max_chars: int = 512,
+        record: dict | None = None,
+        relocate: Callable[[dict], ft.Control | None] | None = None,
+        updates: UpdateScheduler | None = None,
+    ):
+        self.markdown = markdown
+        self.interval = interval
+        self.max_chars = max_chars
+        self.record = record
+        self.relocate = relocate
+        self.updates = updates
+        self.flush_count = 0
+        self._parts: list[str] = [markdown.value or ""]
+        self._pending = 0
+        self._last_flush = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def value(self) -> str:
+        """Everything written so far, flushed or not."""
+        return "".join(self._parts)
+
+    def write(self, text: str):
+        """
+        Buffer text, flushing when the time or size budget is spent.
+        """
+
+        if not text:
+            return
+        self._parts.append(text)
+        self._pending += len(text)
+
+        elapsed = time.monotonic() - self._last_flush
+        if self._pending >= self.max_chars or elapsed >= self.interval:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.interval - elapsed, self.flush
+            )
+
+    def flush(self):
+        """
+        Send pending text to the client in one update.
+        """
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        value = self.value
+        self._parts = [value]
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        if self.record is not None:
+            self.record["content"] = value
+            if self.markdown.page is None and self.relocate is not None:
+                self.markdown = self.relocate(self.record) or self.markdown
+        self.markdown.value = value
+        if self.updates is not None:
+            self.updates.mark(self.markdown)
+            self.flush_count += 1
+        elif self.markdown.page is not None:
+            self.markdown.update()
+            self.flush_count += 1
+
+    def close(self):
+        """
+        Flush whatever is left and stop the timer.
+        """
+
+        self.flush()
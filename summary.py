@@ -0,0 +1,191 @@
+"""
+Rolling summary standing in for the older messages of a long conversation.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+import httpx
+
+from context_window import SUMMARY_THRESHOLD, ContextWindow
+
+logger = logging.getLogger(__name__)
+
+# share of the threshold kept as the newest messages, sent as they are
+RECENT_SHARE = 0.5
+# share of the threshold the messages not yet summarized may grow to before
+# the summary is brought up to date
+STALE_SHARE = 0.25
+
+SUMMARY_PROMPT = (
+    "You keep a running summary of a conversation between a user and an "
+    "assistant. Update the summary with the new messages. Keep facts, "
+    "decisions, names, numbers, code identifiers and open questions, drop "
+    "pleasantries. Answer with the summary only."
+)
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+# (summary so far, messages to add to it) -> the new summary
+Summarizer = Callable[[str, list[dict]], Awaitable[str]]
+
+
+def summary_request(summary: str, messages: list[dict]) -> list[dict]:
+    """Messages asking the model to fold the messages into the summary."""
+    transcript = "\n\n".join(
+        f"{message['role']}: {message['content']}" for message in messages
+    )
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {
+            "role": "user",
+            "content": f"Summary so far:\n{summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}",
+        },
+    ]
+
+
+class RollingSummary:
+    """
+    Summary of the oldest messages of a history, sent in their place once
+    the history is longer than a threshold.
+
+    The summary is made in the background and folds in the messages that
+    fell out of the newest ones since, once they are worth a request. Until
+    then the summary there is goes out with the messages after it, so a send
+    never waits for it. Editing a summarized message drops the summary.
+
+    The messages a summary covers are recognized by their store id, or by
+    identity for messages that are not stored, so it outlives a conversation
+    being evicted and read back.
+    """
+
+    def __init__(self, context: ContextWindow):
+        self.context = context
+        self.text = ""
+        self.refreshes = 0
+        # messages covered, the last of them and its store id
+        self._count = 0
+        self._covered: dict | None = None
+        self._covered_id: int | None = None
+        self._message: dict | None = None
+        # end of the messages being summarized, like the covered ones
+        self._pending: tuple[int, dict, int | None] | None = None
+        # changes whenever the history the refresh summarizes went away, its
+        # summary is ignored then
+        self._generation = 0
+        self._task: asyncio.Task | None = None
+
+    @property
+    def covered(self) -> int:
+        """Messages of the history the summary stands for."""
+        return self._count
+
+    def compact(
+        self,
+        history: list[dict],
+        summarize: Summarizer,
+        threshold: int = SUMMARY_THRESHOLD,
+        ids: list[int | None] | None = None,
+    ) -> tuple[dict | None, int]:
+        """
+        Summary message and the number of messages of the history it stands
+        for, (None, 0) while there is none to send. Starts bringing the
+        summary up to date when it fell behind.
+        """
+
+        self.context.sync(history)
+        if not self._holds(history, ids, self._count, self._covered, self._covered_id):
+            self.drop()
+        elif self._pending is not None and not self._holds(
+            history, ids, *self._pending
+        ):
+            self._generation += 1
+            self._pending = None
+        if self.context.total < threshold:
+            return None, 0
+
+        # messages before the newest ones are summarized
+        end = self.context.fitting(int(threshold * RECENT_SHARE))
+        stale = self.context.tokens(self._count, max(end, self._count))
+        if self._task is None and stale >= threshold * STALE_SHARE:
+            last_id = ids[end - 1] if ids is not None else None
+            self._pending = (end, history[end - 1], last_id)
+            self._task = asyncio.create_task(
+                self._refresh(summarize, history[self._count : end])
+            )
+        if not self.text:
+            return None, 0
+        if self._message is None:
+            self._message = {"role": "system", "content": SUMMARY_HEADER + self.text}
+        return self._message, self._count
+
+    def drop(self):
+        """
+        Forget the summary, e.g. for another conversation.
+        """
+
+        self._generation += 1
+        self.text = ""
+        self._count = 0
+        self._covered = self._covered_id = self._message = self._pending = None
+
+    def release(self):
+        """
+        Let go of the messages of the history, e.g. once they are evicted.
+        A summary of stored messages is kept, it is recognized by their id
+        when they are read back.
+        """
+
+        if self._covered_id is None:
+            self.drop()
+            return
+        self._covered = None
+        if self._pending is not None:
+            # the refresh running is ignored, and started again once needed
+            self._generation += 1
+            self._pending = None
+
+    async def wait(self):
+        """
+        Wait for the refresh running, if any.
+        """
+
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    @staticmethod
+    def _holds(
+        history: list[dict],
+        ids: list[int | None] | None,
+        count: int,
+        last: dict | None,
+        last_id: int | None,
+    ) -> bool:
+        # whether the first count messages of the history end with the last
+        # one, or with the same stored message read back, whose id stands for
+        # its ancestors as well
+        if not count:
+            return True
+        if len(history) < count:
+            return False
+        return history[count - 1] is last or (
+            last_id is not None and ids is not None and ids[count - 1] == last_id
+        )
+
+    async def _refresh(self, summarize: Summarizer, messages: list[dict]):
+        generation = self._generation
+        try:
+            text = await summarize(self.text, messages)
+        except (httpx.HTTPError, httpx.InvalidURL) as error:
+            # the messages go out in full until the next try
+            logger.warning("Could not summarize the conversation: %s", error)
+            return
+        finally:
+            self._task = None
+        if generation != self._generation or not text:
+            return
+        self.text = text
+        self._count, self._covered, self._covered_id = self._pending
+        self._pending = self._message = None
+        self.refreshes += 1
@@ -0,0 +1,407 @@
+"""
+Where the time of a chat request goes, for the debug overlay and for
+export to local files.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+
+import flet as ft  # type: ignore
+from flet_core.protocol import CommandEncoder  # type: ignore
+
+from update_scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# environment variable naming the file the telemetry of the process is
+# exported to, Prometheus text when it ends in .prom, json lines otherwise
+EXPORT_PATH_VARIABLE = "CHAT_TELEMETRY_FILE"
+# requests kept for the percentiles of the overlay and the metrics
+WINDOW = 200
+QUANTILES = (0.5, 0.95, 0.99)
+# summarized request metrics and their help text
+METRICS = {
+    "queue_s": "Seconds waiting for the request scheduler.",
+    "connect_s": "Seconds of tcp and tls handshakes.",
+    "first_token_s": "Seconds from send to the first token.",
+    "tokens_per_s": "Tokens per second after the first token.",
+    "flushes": "Ui flushes per reply.",
+    "bytes_per_update": "Bytes per ui update sent to the client.",
+}
+
+
+class Traffic:
+    """
+    Counts the updates a page sends to its client and their bytes.
+
+    Flet does not expose the connection of a page, the counters wrap the
+    ``send_commands`` of the one the page holds, once per connection, and
+    the new one after a reconnect. A connection may serve every session of
+    the process, so only the commands of the page's session are counted.
+    They are encoded once more to be measured, so only while ``counting``
+    is set.
+
+    The counter only holds its page weakly, it is kept with the page.
+    """
+
+    def __init__(self, page: ft.Page):
+        self._page = weakref.ref(page)
+        self.session_id = page.session_id
+        self.counting = True
+        self.updates = 0
+        self.bytes_sent = 0
+        self._connection: weakref.ref | None = None
+
+    def watch(self):
+        """
+        Count from now on, wrapping the current connection if needed.
+        """
+
+        page = self._page()
+        # pylint: disable-next=protected-access
+        connection = getattr(page, "_Page__conn", None)
+        if connection is None or (
+            self._connection is not None and self._connection() is connection
+        ):
+            return
+        _counters(connection)[self.session_id] = self
+        self._connection = weakref.ref(connection)
+
+    def count(self, commands: list):
+        """
+        The session sent the commands.
+        """
+
+        if self.counting:
+            self.updates += 1
+            self.bytes_sent += len(
+                json.dumps(commands, cls=CommandEncoder, separators=(",", ":"))
+            )
+
+
+# connection -> the counters of its sessions by session id
+_connections: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _counters(connection) -> weakref.WeakValueDictionary:
+    counters = _connections.get(connection)
+    if counters is None:
+        counters = _connections[connection] = weakref.WeakValueDictionary()
+        send_commands = connection.send_commands
+
+        def counted(session_id, commands):
+            counter = counters.get(session_id)
+            if counter is not None:
+                counter.count(commands)
+            return send_commands(session_id, commands)
+
+        connection.send_commands = counted
+    return counters
+
+
+_traffic: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def traffic(page: ft.Page, counting: bool = True) -> Traffic | None:
+    """
+    Update counter of the page, None while it is not counting. A page is
+    left alone until it is counted for the first time.
+    """
+
+    counter = _traffic.get(page)
+    if counter is None:
+        if not counting:
+            return None
+        counter = _traffic[page] = Traffic(page)
+    counter.counting = counting
+    if not counting:
+        return None
+    counter.watch()
+    return counter
+
+
+class RequestTrace:
+    """
+    Timings of one chat request, from the tap on send to the end of the
+    reply, in seconds.
+
+    - queue = waiting for the request scheduler, backoffs included
+    - connect = tcp and tls handshakes, 0 on a pooled connection
+    - first_token = tap to the first token of the reply
+    - tokens_per_s = tokens after the first one per second
+    - flushes, updates, bytes_sent = ui patches sent while it ran, counted
+      only when ``count_bytes`` is set
+    """
+
+    def __init__(self, page: ft.Page, count_bytes: bool = False):
+        self.started = time.monotonic()
+        self.wall_time = time.time()
+        self.status = "ok"
+        self.cached = True
+        self.queue = 0.0
+        self.connect = 0.0
+        self.first_token: float | None = None
+        self.tokens = 0
+        self.duration: float | None = None
+        self._updates = scheduler(page)
+        self._flushes = self._updates.flushes
+        self._traffic = traffic(page, count_bytes)
+        self._sent = (
+            (self._traffic.updates, self._traffic.bytes_sent) if self._traffic else None
+        )
+        self._waiting_since: float | None = None
+        self._connecting: dict[str, float] = {}
+        self.flushes = 0
+        self.updates: int | None = None
+        self.bytes_sent: int | None = None
+
+    def waiting(self, reason: str | None):
+        """
+        The request started (``reason``) or stopped (None) waiting.
+        """
+
+        now = time.monotonic()
+        if reason is not None and self._waiting_since is None:
+            self._waiting_since = now
+        elif reason is None and self._waiting_since is not None:
+            self.queue += now - self._waiting_since
+            self._waiting_since = None
+
+    async def http(self, event: str, _info: dict):
+        """
+        Trace hook of httpx, times the handshakes of the request.
+        """
+
+        self.cached = False
+        step, _, stage = event.rpartition(".")
+        if step not in ("connection.connect_tcp", "connection.start_tls"):
+            return
+        if stage == "started":
+            self._connecting[step] = time.monotonic()
+        elif stage == "complete" and step in self._connecting:
+            self.connect += time.monotonic() - self._connecting.pop(step)
+
+    def token(self):
+        """
+        A delta of the reply arrived.
+        """
+
+        if self.first_token is None:
+            self.first_token = time.monotonic() - self.started
+        self.tokens += 1
+
+    def finish(self, status: str = "ok"):
+        """
+        The reply is complete, stopped or failed.
+        """
+
+        self.waiting(None)
+        self.status = status
+        self.duration = time.monotonic() - self.started
+        self.flushes = self._updates.flushes - self._flushes
+        if self._traffic is not None:
+            self.updates = self._traffic.updates - self._sent[0]
+            self.bytes_sent = self._traffic.bytes_sent - self._sent[1]
+
+    @property
+    def tokens_per_s(self) -> float | None:
+        """Streaming rate of the reply after its first token."""
+        if self.first_token is None or self.duration is None or self.tokens < 2:
+            return None
+        streaming = self.duration - self.first_token
+        return (self.tokens - 1) / streaming if streaming > 0 else None
+
+    @property
+    def bytes_per_update(self) -> float | None:
+        """Mean size of the ui patches sent while the request ran."""
+        if not self.updates:
+            return None
+        return self.bytes_sent / self.updates
+
+    def as_dict(self) -> dict:
+        """The trace as a json line."""
+
+        def rounded(value: float | None, digits: int = 4):
+            return None if value is None else round(value, digits)
+
+        return {
+            "time": round(self.wall_time, 3),
+            "status": self.status,
+            "cached": self.cached,
+            "queue_s": rounded(self.queue),
+            "connect_s": rounded(self.connect),
+            "first_token_s": rounded(self.first_token),
+            "duration_s": rounded(self.duration),
+            "tokens": self.tokens,
+            "tokens_per_s": rounded(self.tokens_per_s, 1),
+            "flushes": self.flushes,
+            "updates": self.updates,
+            "bytes_sent": self.bytes_sent,
+            "bytes_per_update": rounded(self.bytes_per_update, 1),
+        }
+
+
+def describe(trace: RequestTrace | None, summary: dict) -> str:
+    """
+    Lines of the debug overlay, the last request and the quantiles of the
+    recent requests of every session.
+    """
+
+    if trace is None:
+        return "No requests yet"
+
+    def seconds(value: float | None) -> str:
+        return "-" if value is None else f"{value:.2f} s"
+
+    def number(value: float | None, unit: str) -> str:
+        return "-" if value is None else f"{value:.0f} {unit}"
+
+    lines = [
+        f"{trace.status}{' (cached)' if trace.cached else ''}"
+        f" in {seconds(trace.duration)}",
+        f"queue {seconds(trace.queue)}  connect {seconds(trace.connect)}",
+        f"first token {seconds(trace.first_token)}"
+        f"  {number(trace.tokens_per_s, 'tok/s')}",
+        f"{trace.flushes} flushes  {number(trace.updates, 'updates')}"
+        f"  {number(trace.bytes_per_update, 'B/update')}",
+    ]
+    if "first_token_s" in summary or "queue_s" in summary:
+        lines.append("recent requests of all sessions")
+    for name, label in (("first_token_s", "first token"), ("queue_s", "queue")):
+        if name in summary:
+            quantiles = summary[name]
+            lines.append(
+                f"{label} p50 {quantiles[0.5]:.2f} s  p95 {quantiles[0.95]:.2f} s"
+            )
+    return "\n".join(lines)
+
+
+def quantile(values: list[float], q: float) -> float:
+    """Nearest rank quantile of sorted values."""
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+class Telemetry:
+    """
+    The recent request traces of every session of the process.
+
+    With an ``export_path`` every trace is appended to a json lines file,
+    or the metrics of the recent requests written to a Prometheus text
+    file, e.g. for the textfile collector of the node exporter. The format
+    follows the file extension, ``.prom`` for Prometheus.
+    """
+
+    def __init__(self, window: int = WINDOW, export_path: str = ""):
+        self.traces: deque[RequestTrace] = deque(maxlen=window)
+        self.requests: dict[str, int] = {}
+        self.export_path = export_path
+        self._lock = threading.Lock()
+
+    async def record(self, trace: RequestTrace):
+        """
+        Keep a finished trace, and export it when there is a file to.
+
+        The file is written in a worker thread, the event loop goes on.
+        """
+
+        self.traces.append(trace)
+        self.requests[trace.status] = self.requests.get(trace.status, 0) + 1
+        path = self.export_path
+        if not path:
+            return
+        try:
+            if path.endswith(".prom"):
+                # the metrics are taken here, the traces change on the loop
+                await asyncio.to_thread(self.write_prometheus, path, self.prometheus())
+            else:
+                await asyncio.to_thread(
+                    self._append, path, json.dumps(trace.as_dict()) + "\n"
+                )
+        except OSError as error:
+            logger.warning("Could not export telemetry to %s: %s", path, error)
+
+    def _append(self, path: str, line: str):
+        with self._lock, open(path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+    def summary(self) -> dict:
+        """
+        Quantiles of the recent requests that reached the api.
+        """
+
+        traces = [trace for trace in self.traces if not trace.cached]
+        values = {
+            "queue_s": [trace.queue for trace in traces],
+            "connect_s": [trace.connect for trace in traces],
+            "first_token_s": [
+                trace.first_token for trace in traces if trace.first_token is not None
+            ],
+            "tokens_per_s": [
+                trace.tokens_per_s for trace in traces if trace.tokens_per_s is not None
+            ],
+            "flushes": [trace.flushes for trace in traces],
+            "bytes_per_update": [
+                trace.bytes_per_update
+                for trace in traces
+                if trace.bytes_per_update is not None
+            ],
+        }
+        summary = {}
+        for name, samples in values.items():
+            if samples:
+                samples = sorted(samples)
+                summary[name] = {q: quantile(samples, q) for q in QUANTILES}
+        return summary
+
+    def prometheus(self) -> str:
+        """
+        The metrics in the Prometheus text format.
+        """
+
+        lines = [
+            "# HELP chat_requests_total Chat requests by how they ended.",
+            "# TYPE chat_requests_total counter",
+        ]
+        for status, count in sorted(self.requests.items()):
+            lines.append(f'chat_requests_total{{status="{status}"}} {count}')
+        for name, quantiles in self.summary().items():
+            metric = f"chat_request_{name}"
+            lines.append(f"# HELP {metric} {METRICS[name]}")
+            lines.append(f"# TYPE {metric} summary")
+            for q, value in quantiles.items():
+                lines.append(f'{metric}{{quantile="{q}"}} {value:.6g}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, text: str | None = None):
+        """
+        Replace the file with the metrics, the current ones unless given,
+        readers never see it half written.
+        """
+
+        text = self.prometheus() if text is None else text
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with self._lock:
+            with open(temporary, "w", encoding="utf-8") as file:
+                file.write(text)
+            os.replace(temporary, path)
+
+
+_telemetry: Telemetry | None = None
+
+
+def open_telemetry() -> Telemetry:
+    """
+    Telemetry shared by every session of the process, exported to the file
+    named by the ``CHAT_TELEMETRY_FILE`` environment variable.
+    """
+
+    global _telemetry  # pylint: disable=global-statement
+    if _telemetry is None:
+        _telemetry = Telemetry(export_path=os.environ.get(EXPORT_PATH_VARIABLE, ""))
+    return _telemetry
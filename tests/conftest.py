@@ -0,0 +1,24 @@
+"""
+The tests import the app modules from the project root, and run in one
+temporary working directory.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def workdir(tmp_path_factory):
+    """
+    The app opens its store and caches in the working directory, once per
+    process, so every test shares the same one.
+    """
+
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    yield
+    os.chdir(cwd)
@@ -0,0 +1,82 @@
+"""
+Files attached in a browser are uploaded to the server before they are sent
+to the api.
+"""
+
+import asyncio
+import json
+import os
+
+import flet as ft  # type: ignore
+from flet_core.event import Event  # type: ignore
+
+from attachments import UPLOAD_DIRECTORY
+from benchmarks.headless import make_page, run_app
+
+
+def find_attach_button(control: ft.Control) -> ft.IconButton | None:
+    """The attach button among the descendants of the control."""
+    if isinstance(control, ft.IconButton) and control.icon == ft.icons.ATTACH_FILE:
+        return control
+    for child in control._get_children():  # pylint: disable=protected-access
+        button = find_attach_button(child)
+        if button is not None:
+            return button
+    return None
+
+
+def test_web_attachments_are_uploaded_first(monkeypatch):
+    # pylint: disable=import-outside-toplevel
+    import components
+    import main as app
+    from session import sessions
+
+    async def test():
+        page, _ = make_page(asyncio.get_running_loop())
+        page._set_attr("web", True)  # pylint: disable=protected-access
+        await run_app(app.main, page)
+        session = sessions.sessions[page.session_id]
+        session.settings.api_url = "http://127.0.0.1:9/v1"
+        page.get_upload_url = lambda name, _: f"http://localhost/upload/{name}"
+        attached = []
+
+        async def upload_attachment(_page, _session, record):
+            attached.append(record)
+
+        monkeypatch.setattr(components, "upload_attachment", upload_attachment)
+
+        button = find_attach_button(page.views[0])
+        await page.on_event_async(Event(button.uid, "click", ""))
+        await run_app(lambda _: asyncio.sleep(0), page)
+        (picker,) = [c for c in page.overlay if isinstance(c, ft.FilePicker)]
+
+        files = [{"name": name, "path": None, "size": 5} for name in ("a.txt", "b.png")]
+        data = json.dumps({"path": None, "files": files})
+        await page.on_event_async(Event(picker.uid, "result", data))
+        await run_app(lambda _: asyncio.sleep(0), page)
+        # pylint: disable-next=protected-access
+        uploads = picker._FilePicker__upload
+        assert [upload.name.split("-", 1)[1] for upload in uploads] == [
+            "a.txt",
+            "b.png",
+        ]
+        assert not attached
+
+        # the first file arrives on the server, the second was lost on the way
+        first, second = (upload.name for upload in uploads)
+        os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
+        with open(os.path.join(UPLOAD_DIRECTORY, first), "w", encoding="utf-8") as f:
+            f.write("hello")
+        for name in (first, second):
+            data = json.dumps({"file_name": name, "progress": 1.0, "error": None})
+            await page.on_event_async(Event(picker.uid, "upload", data))
+        await run_app(lambda _: asyncio.sleep(0), page)
+
+        (record,) = attached
+        assert record["content"] == "a.txt"
+        assert record["path"] == os.path.join(UPLOAD_DIRECTORY, first)
+        assert record["size"] == 5
+        notes = [c.content.value for c in page.overlay if isinstance(c, ft.SnackBar)]
+        assert len(notes) == 1 and notes[0].startswith("Could not attach b.png")
+
+    asyncio.run(test())
@@ -0,0 +1,66 @@
+"""
+Shared clients of chat_api against a local stand-in endpoint.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from benchmarks.stub_llm import StubLLM
+from chat_api import close_clients, get_client, stream_chat, warm_up
+
+MESSAGES = [{"role": "user", "content": "Hi"}]
+
+
+async def reply(api_url: str, **kwargs) -> str:
+    return "".join([delta async for delta in stream_chat(api_url, MESSAGES, **kwargs)])
+
+
+def run(test):
+    async def main():
+        stub = StubLLM(token_rate=1000, latency=0.0, jitter=0.0, reply_tokens=5)
+        api_url = await stub.start()
+        try:
+            await test(stub, api_url)
+        finally:
+            await close_clients()
+            await stub.close()
+
+    asyncio.run(main())
+
+
+def test_client_is_shared_per_endpoint():
+    async def test(_: StubLLM, api_url: str):
+        client = get_client(api_url)
+        assert get_client(api_url + "/chat/completions") is client
+        assert get_client(api_url.replace("127.0.0.1", "localhost")) is not client
+
+    run(test)
+
+
+def test_warm_up_connection_is_reused():
+    async def test(_: StubLLM, api_url: str):
+        await warm_up(api_url)
+        events = []
+
+        async def trace(event: str, _info: dict):
+            events.append(event)
+
+        assert await reply(api_url, trace=trace)
+        assert events
+        assert not [event for event in events if "connect_tcp" in event]
+
+    run(test)
+
+
+def test_timeout_applies_per_request():
+    async def test(stub: StubLLM, api_url: str):
+        # the first request creates the shared client with a long timeout
+        await warm_up(api_url, timeout=httpx.Timeout(60))
+        stub.latency = 0.5
+        with pytest.raises(httpx.ReadTimeout):
+            await reply(api_url, timeout=httpx.Timeout(0.1))
+        assert await reply(api_url, timeout=httpx.Timeout(5))
+
+    run(test)
@@ -0,0 +1,30 @@
+"""
+Controls take the colors of their page, whatever context builds them.
+"""
+
+import asyncio
+import contextvars
+
+from benchmarks.headless import make_page, run_app
+
+
+def test_controls_built_outside_the_page_context_follow_its_mode():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from color_scheme import color_config
+    from components import switch_color_mode, themed_text
+
+    async def test():
+        page, _ = make_page(asyncio.get_running_loop())
+        await run_app(app.main, page)
+        switch_color_mode(page, "dark")
+        dark = color_config.of(page).TEXT_COLOR
+
+        # flet awaits async handlers without the page in context
+        text = contextvars.Context().run(themed_text, page, "Hi")
+        assert text.color == dark
+
+        switch_color_mode(page, "light")
+        assert text.color == color_config.of(page).TEXT_COLOR != dark
+
+    asyncio.run(test())
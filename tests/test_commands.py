@@ -0,0 +1,72 @@
+"""
+Slash commands run from the message field.
+"""
+
+import asyncio
+import base64
+import os
+
+from benchmarks.headless import make_page, run_app
+
+
+def test_export_downloads_on_the_client():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from commands import commands
+    from session import sessions
+
+    async def test():
+        page, _ = make_page(asyncio.get_running_loop())
+        page._set_attr("web", True)  # pylint: disable=protected-access
+        await run_app(app.main, page)
+        session = sessions.sessions[page.session_id]
+        session.conversation.new()
+        session.conversation.append("user", "Hi")
+        opened = []
+        page.launch_url = opened.append
+
+        command, args = commands.parse("/export ../../etc/chat.md")
+        files = set(os.listdir())
+        note = await command.handler(session, args)
+
+        assert note == "Exported, see your downloads"
+        assert set(os.listdir()) == files
+        (url,) = opened
+        data = url.removeprefix("data:application/octet-stream;base64,")
+        assert base64.b64decode(data).decode() == "**user**\n\nHi\n"
+
+    asyncio.run(test())
+
+
+def test_export_saves_on_mobile(tmp_path, monkeypatch):
+    # pylint: disable=import-outside-toplevel
+    import commands as module
+    import main as app
+    from session import sessions
+
+    async def test():
+        page, _ = make_page(asyncio.get_running_loop())
+        page.platform = "android"
+        await run_app(app.main, page)
+        session = sessions.sessions[page.session_id]
+        session.conversation.new()
+        session.conversation.append("user", "Hi")
+        opened = []
+        page.launch_url = opened.append
+        command, args = module.commands.parse("/export")
+
+        picked = [None, str(tmp_path / "chat.md")]
+
+        async def save_dialog(_page, _file_name):
+            return picked.pop(0)
+
+        monkeypatch.setattr(module, "save_dialog", save_dialog)
+        assert await command.handler(session, args) is None
+        assert not (tmp_path / "chat.md").exists()
+
+        note = await command.handler(session, args)
+        assert note == f"Exported to {tmp_path / 'chat.md'}"
+        assert (tmp_path / "chat.md").read_text() == "**user**\n\nHi\n"
+        assert not opened
+
+    asyncio.run(test())
@@ -0,0 +1,74 @@
+"""
+The navigation drawer lists the conversations stored since it was built, and
+the chat opened from it replaces the messages on the client.
+"""
+
+import asyncio
+
+from flet_core.event import Event  # type: ignore
+
+from benchmarks.headless import make_page, run_app
+
+
+def test_drawer_refreshes_when_reopened():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from session import sessions
+
+    async def settle(page):
+        # the click handler runs on the worker thread, the refresh on the loop
+        await asyncio.sleep(0)
+        await page.loop.run_in_executor(page.executor, lambda: None)
+        pending = asyncio.all_tasks() - {asyncio.current_task()}
+        if pending:
+            await asyncio.wait(pending)
+
+    async def test():
+        page, _ = make_page(asyncio.get_running_loop())
+        await run_app(app.main, page)
+        session = sessions.sessions[page.session_id]
+        menu = page.views[0].appbar.leading
+        while not isinstance(menu, app.ft.IconButton):
+            menu = menu.content
+
+        await page.on_event_async(Event(menu.uid, "click", ""))
+        await settle(page)
+        history = page.views[0].drawer.data
+        listed = history.loaded
+
+        conversation = session.conversation
+        conversation.new()
+        conversation.append("user", "A new chat")
+        conversation.store.flush()
+        await page.on_event_async(Event(menu.uid, "click", ""))
+        await settle(page)
+        assert history.loaded == listed + 1
+        titles = [
+            control.content.value
+            for control in history.controls
+            if isinstance(control.content, app.ft.Text)
+        ]
+        assert "A new chat" in titles
+
+    asyncio.run(test())
+
+
+def test_empty_chat_clears_the_client():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from components import add_messages
+    from session import sessions
+
+    async def test():
+        page, connection = make_page(asyncio.get_running_loop())
+        await run_app(app.main, page)
+        container = sessions.sessions[page.session_id].message_container
+        add_messages(page, container, [{"role": "user", "content": "Hi"}])
+
+        sent = connection.messages_sent
+        container.clear()
+        add_messages(page, container, [])
+        assert connection.messages_sent > sent
+        assert not container.records
+
+    asyncio.run(test())
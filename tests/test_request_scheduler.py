@@ -0,0 +1,138 @@
+"""
+Requests to an endpoint are admitted fairly and within its limits.
+"""
+
+import asyncio
+import random
+import time
+
+import request_scheduler
+from benchmarks.stub_llm import StubLLM
+from chat_api import close_clients, stream_chat
+from request_scheduler import RequestScheduler, open_request_scheduler, scheduled_stream
+
+MESSAGES = [{"role": "user", "content": "Hi"}]
+
+
+async def reply(requests: RequestScheduler, owner: str, api_url: str) -> str:
+    deltas = scheduled_stream(
+        requests, owner, lambda: stream_chat(api_url, MESSAGES), rng=random.Random(0)
+    )
+    return "".join([delta async for delta in deltas])
+
+
+async def reply_direct(api_url: str) -> str:
+    return "".join([delta async for delta in stream_chat(api_url, MESSAGES)])
+
+
+def run(test, **stub_options):
+    async def main():
+        stub = StubLLM(
+            **{"token_rate": 1000, "latency": 0.0, "jitter": 0.0, "reply_tokens": 5}
+            | stub_options
+        )
+        api_url = await stub.start()
+        try:
+            await test(stub, api_url)
+        finally:
+            await close_clients()
+            await stub.close()
+
+    asyncio.run(main())
+
+
+def test_limits_are_set_once_per_endpoint():
+    first = open_request_scheduler("http://127.0.0.1:9/v1", "token", 60, 2)
+    again = open_request_scheduler("http://127.0.0.1:9/v1/chat", "token", 6000, 50)
+    assert again is first
+    assert (again.requests_per_minute, again.max_in_flight) == (60, 2)
+
+    other = open_request_scheduler("http://127.0.0.1:9/v1", None, 6000, 50)
+    assert other is not first
+    assert (other.requests_per_minute, other.max_in_flight) == (6000, 50)
+
+
+def test_owners_take_turns():
+    async def test(_: StubLLM, api_url: str):
+        requests = RequestScheduler(requests_per_minute=6000, max_in_flight=1)
+        answered = []
+
+        async def send(owner: str):
+            await reply(requests, owner, api_url)
+            answered.append(owner)
+
+        # the busy session queues all its requests before the others ask
+        await asyncio.gather(
+            *(send("busy") for _ in range(5)), send("first"), send("second")
+        )
+        assert answered == ["busy", "busy", "first", "second", "busy", "busy", "busy"]
+
+    run(test)
+
+
+def test_bucket_keeps_to_the_rate_limit():
+    async def test(stub: StubLLM, api_url: str):
+        # a burst of 10, then 10 a second, a little under the limit of the api
+        requests = RequestScheduler(requests_per_minute=600, max_in_flight=20)
+        start = time.monotonic()
+        await asyncio.gather(*(reply(requests, str(n), api_url) for n in range(14)))
+        # the last 4 waited for the bucket to refill
+        assert time.monotonic() - start >= 0.35
+        assert stub.requests == 14 and not stub.rate_limited
+
+        # the same requests sent straight away run into the limit
+        await asyncio.sleep(1.1)
+        await asyncio.gather(
+            *(reply_direct(api_url) for _ in range(14)), return_exceptions=True
+        )
+        assert stub.rate_limited
+
+    run(test, rate_limit=12)
+
+
+def test_rate_limited_response_holds_every_owner(monkeypatch):
+    # the backoff is the Retry-After of the api, 1 s
+    monkeypatch.setattr(request_scheduler, "BACKOFF_BASE", 0.01)
+
+    async def test(stub: StubLLM, api_url: str):
+        requests = RequestScheduler(requests_per_minute=6000, max_in_flight=10)
+        assert await reply(requests, "first", api_url)
+
+        start = time.monotonic()
+        retried = asyncio.create_task(reply(requests, "second", api_url))
+        while not stub.rate_limited:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        # another session is held too, it would only be rate limited as well
+        assert await requests.acquire("third")
+        waited = time.monotonic() - start
+        requests.release()
+
+        assert await retried
+        assert waited >= 0.9
+        assert stub.rate_limited == 1 and requests.retries == 1
+
+    run(test, rate_limit=1)
+
+
+def test_cancelled_request_leaves_the_queue():
+    async def test(stub: StubLLM, api_url: str):
+        requests = RequestScheduler(requests_per_minute=6000, max_in_flight=1)
+        first = asyncio.create_task(reply(requests, "first", api_url))
+        while not stub.streaming:
+            await asyncio.sleep(0.01)
+        queued = asyncio.create_task(reply(requests, "second", api_url))
+        while not requests.waiting:
+            await asyncio.sleep(0.01)
+
+        queued.cancel()
+        await asyncio.wait({queued})
+        assert requests.waiting == 0 and requests.in_flight == 1
+
+        assert await first
+        assert await reply(requests, "third", api_url)
+        assert requests.in_flight == 0
+        # the cancelled request never reached the api
+        assert stub.requests == 2
+
+    run(test, token_rate=50, reply_tokens=10)
@@ -0,0 +1,54 @@
+"""
+Cached replies are only replayed to the token that asked for them.
+"""
+
+import asyncio
+
+from benchmarks.headless import make_page, run_app
+from benchmarks.stub_llm import StubLLM
+from chat_api import close_clients
+
+
+def test_cached_reply_needs_the_same_token():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from components import stream_bot_reply
+    from session import sessions
+
+    async def test():
+        stub = StubLLM(token_rate=1000, latency=0.0, jitter=0.0, reply_tokens=5)
+        api_url = await stub.start()
+        try:
+            # started before any request, run_app waits for every task and
+            # the stub keeps its connections open
+            pages = []
+            for token in ("token-a", "token-a", "token-b"):
+                page, _ = make_page(asyncio.get_running_loop())
+                await run_app(app.main, page)
+                settings = sessions.sessions[page.session_id].settings
+                settings.api_url = api_url
+                settings.api_token = token
+                settings.cache_responses = True
+                pages.append(page)
+
+            async def send(index: int) -> str:
+                session = sessions.sessions[pages[index].session_id]
+                return await stream_bot_reply(
+                    pages[index],
+                    session.message_container,
+                    session.settings,
+                    [{"role": "user", "content": "Hi"}],
+                    cache=session.cache,
+                )
+
+            first = await send(0)
+            assert stub.requests == 1
+            assert await send(1) == first
+            assert stub.requests == 1
+            await send(2)
+            assert stub.requests == 2
+        finally:
+            await close_clients()
+            await stub.close()
+
+    asyncio.run(test())
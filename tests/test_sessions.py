@@ -0,0 +1,54 @@
+"""
+Sessions let go of their messages when idle and of everything when closed.
+"""
+
+import asyncio
+
+from flet_core.event import Event  # type: ignore
+
+from benchmarks.headless import make_page, run_app
+
+
+def test_evict_releases_counted_messages():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from session import sessions
+
+    async def test():
+        page, _ = make_page(asyncio.get_running_loop())
+        await run_app(app.main, page)
+        session = sessions.sessions[page.session_id]
+        conversation = session.conversation
+        conversation.new()
+        for index in range(20):
+            conversation.append("user" if index % 2 == 0 else "assistant", "Hi")
+        session.context.build(conversation.history)
+        assert session.context.counted == 20
+
+        assert session.evict()
+        assert session.context.counted == 0
+
+        session.restore()
+        assert len(session.context.build(conversation.history)) == 20
+
+    asyncio.run(test())
+
+
+def test_closed_page_drops_its_session():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from session import sessions
+
+    async def test():
+        page, _ = make_page(asyncio.get_running_loop())
+        await run_app(app.main, page)
+        session = sessions.sessions[page.session_id]
+        never_done = asyncio.get_running_loop().create_future()
+        session.reply_task = asyncio.ensure_future(never_done)
+
+        await page.on_event_async(Event("page", "close", ""))
+
+        assert page.session_id not in sessions.sessions
+        assert session.reply_task.cancelled()
+
+    asyncio.run(test())
@@ -0,0 +1,42 @@
+"""
+Read Aloud plays in the browser, which cannot reach the speech server.
+"""
+
+import asyncio
+import base64
+
+from benchmarks.headless import make_page, run_app
+from benchmarks.stub_tts import StubTTS
+
+
+def test_read_aloud_on_web_sends_the_audio():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from chat_api import close_clients
+    from components import read_aloud
+    from session import sessions
+    from speech import open_speech_server, speech_key
+
+    async def test():
+        page, _ = make_page(asyncio.get_running_loop())
+        page._set_attr("web", True)  # pylint: disable=protected-access
+        await run_app(app.main, page)
+        session = sessions.sessions[page.session_id]
+        stub = StubTTS(first_chunk_delay=0, chunk_delay=0)
+        try:
+            session.settings.api_url = await stub.start()
+            text = "Read this on the web"
+            await read_aloud(page, session, text)
+
+            player = session.player
+            assert player.src is None
+            audio = base64.b64decode(player.src_base64)
+            assert audio
+            key = speech_key(text, session.settings.voice_model)
+            with open(open_speech_server().cache.lookup(key), "rb") as file:
+                assert file.read() == audio
+        finally:
+            await close_clients()
+            await stub.close()
+
+    asyncio.run(test())
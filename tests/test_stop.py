@@ -0,0 +1,71 @@
+"""
+Stopping a reply mid-stream leaves no task or connection behind.
+"""
+
+import asyncio
+
+from benchmarks.headless import make_page, run_app
+from benchmarks.stub_llm import StubLLM
+from chat_api import close_clients, get_client
+
+
+def test_stop_mid_stream():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from components import stream_bot_reply
+    from session import STOP_TIMEOUT, sessions
+
+    async def test():
+        stub = StubLLM(token_rate=50, latency=0.0, jitter=0.0, reply_tokens=1000)
+        api_url = await stub.start()
+        try:
+            page, _ = make_page(asyncio.get_running_loop())
+            await run_app(app.main, page)
+            session = sessions.sessions[page.session_id]
+            session.settings.api_url = api_url
+            before = asyncio.all_tasks()
+
+            task = asyncio.create_task(
+                stream_bot_reply(
+                    page,
+                    session.message_container,
+                    session.settings,
+                    [{"role": "user", "content": "Hi"}],
+                )
+            )
+            while stub.tokens < 10:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.wait({task}, timeout=STOP_TIMEOUT)
+
+            assert task.done() and not task.cancelled()
+            reply = task.result()
+            assert reply and len(reply.split()) < stub.reply_tokens
+            assert (
+                "*Response stopped.*"
+                in session.message_container.records[-1]["content"]
+            )
+
+            # the server sees the connection go away
+            # pylint: disable=protected-access
+            for _ in range(100):
+                if not stub.streaming and not stub._connections:
+                    break
+                await asyncio.sleep(0.01)
+            assert stub.streaming == 0
+            assert not stub._connections
+
+            # nothing of the request is left running or pooled
+            left = {
+                task
+                for task in asyncio.all_tasks() - before
+                if task is not asyncio.current_task() and not task.done()
+            }
+            assert not left
+            # pylint: disable-next=protected-access
+            assert not get_client(api_url)._transport._pool.connections
+        finally:
+            await close_clients()
+            await stub.close()
+
+    asyncio.run(test())
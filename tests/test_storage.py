@@ -0,0 +1,90 @@
+"""
+Every user only sees their own conversations, and a write that fails does
+not take the others down with it.
+"""
+
+import asyncio
+import sqlite3
+import time
+
+import storage
+from benchmarks.headless import make_page, run_app
+from storage import ConversationStore
+
+
+def test_conversations_are_per_user():
+    # pylint: disable=import-outside-toplevel
+    import main as app
+    from session import sessions
+
+    async def test():
+        loop = asyncio.get_running_loop()
+        alice: dict = {}
+        pages = [make_page(loop, storage)[0] for storage in (alice, {}, alice)]
+        for page in pages:
+            await run_app(app.main, page)
+        first, other, again = (sessions.sessions[page.session_id] for page in pages)
+        assert first.conversation.owner == again.conversation.owner
+        assert first.conversation.owner != other.conversation.owner
+
+        conversation = first.conversation
+        conversation.new()
+        conversation.append("user", "a secret recipe")
+        store = conversation.store
+        store.flush()
+
+        owner = other.conversation.owner
+        assert not store.search("secret", owner=owner)
+        assert conversation.id not in {
+            row["id"] for row in store.list_conversations(owner=owner)
+        }
+        other.conversation.open(conversation.id)
+        assert other.conversation.id is None and not other.conversation.history
+
+        owner = again.conversation.owner
+        assert store.search("secret", owner=owner)
+        again.conversation.open(conversation.id)
+        assert again.conversation.history == conversation.history
+
+    asyncio.run(test())
+
+
+def test_failed_write_only_drops_itself(tmp_path):
+    store = ConversationStore(str(tmp_path / "chats.db"))
+    first = store.create_conversation("First")
+    # pylint: disable-next=protected-access
+    store._writes.put(("INSERT INTO missing (id) VALUES (?)", (1,)))
+    second = store.create_conversation("Second")
+    store.append_message(second, "user", "Hi")
+    store.close()
+
+    store = ConversationStore(str(tmp_path / "chats.db"))
+    titles = {row["id"]: row["title"] for row in store.list_conversations()}
+    assert titles == {first: "First", second: "Second"}
+    assert [row["content"] for row in store.get_branch(second)] == ["Hi"]
+    store.close()
+
+
+class QuickStore(ConversationStore):
+    """Store that gives up waiting for a lock right away."""
+
+    def _connect(self):
+        connection = super()._connect()
+        connection.execute("PRAGMA busy_timeout = 10")
+        return connection
+
+
+def test_batch_is_retried_while_the_database_is_locked(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "RETRY_DELAY", 0.01)
+    path = str(tmp_path / "chats.db")
+    store = QuickStore(path)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    conversation_id = store.create_conversation("Locked")
+    time.sleep(0.05)
+    other.execute("COMMIT")
+    other.close()
+
+    store.flush(timeout=5)
+    assert [row["id"] for row in store.list_conversations()] == [conversation_id]
+    store.close()
@@ -0,0 +1,71 @@
+"""
+The request timings are exported off the event loop, and the traffic of
+a page is counted without holding on to it.
+"""
+
+import asyncio
+import contextvars
+import gc
+import json
+import threading
+import weakref
+
+import flet as ft  # type: ignore
+
+from benchmarks.headless import HeadlessConnection, make_page
+from telemetry import RequestTrace, Telemetry, traffic
+
+
+def test_record_exports_in_a_worker_thread(tmp_path):
+    async def test():
+        page, _ = make_page(asyncio.get_running_loop())
+        path = str(tmp_path / "requests.jsonl")
+        telemetry = Telemetry(export_path=path)
+        writers = []
+        append = telemetry._append  # pylint: disable=protected-access
+
+        def watched(*args):
+            writers.append(threading.current_thread())
+            append(*args)
+
+        telemetry._append = watched  # pylint: disable=protected-access
+        for _ in range(2):
+            trace = RequestTrace(page)
+            trace.finish()
+            await telemetry.record(trace)
+
+        assert writers and threading.main_thread() not in writers
+        with open(path, encoding="utf-8") as file:
+            lines = [json.loads(line) for line in file]
+        assert [line["status"] for line in lines] == ["ok", "ok"]
+
+        prometheus = str(tmp_path / "metrics.prom")
+        telemetry.export_path = prometheus
+        await telemetry.record(trace)
+        with open(prometheus, encoding="utf-8") as file:
+            assert 'chat_requests_total{status="ok"} 3' in file.read()
+
+    asyncio.run(test())
+
+
+def test_traffic_counts_only_its_session():
+    async def test():
+        loop = asyncio.get_running_loop()
+        # one connection serving two sessions, like the desktop socket server
+        connection = HeadlessConnection()
+        pages = [ft.Page(connection, f"shared-{index}", loop=loop) for index in (1, 2)]
+        first, second = (traffic(page) for page in pages)
+        wrapped = connection.send_commands
+        assert traffic(pages[0]) is first and connection.send_commands is wrapped
+
+        pages[1].add(ft.Text("Hi"))
+        assert first.updates == 0 and second.updates == 1
+
+        freed = weakref.ref(pages[0])
+        del pages[0]
+        await asyncio.sleep(0)
+        gc.collect()
+        assert freed() is None
+
+    # flet keeps the page in the context it was made in, like a session
+    contextvars.Context().run(asyncio.run, test())
@@ -0,0 +1,38 @@
+"""
+The update scheduler of a page does not keep the page alive.
+"""
+
+import asyncio
+import contextvars
+import gc
+import weakref
+
+import flet as ft  # type: ignore
+
+from benchmarks.headless import make_page
+from update_scheduler import scheduler
+
+
+def test_page_is_freed_with_its_scheduler():
+    async def session():
+        page, _ = make_page(asyncio.get_running_loop())
+        text = ft.Text("Hi")
+        page.add(text)
+        updates = scheduler(page)
+        updates.mark(text)
+        await asyncio.sleep(0.05)
+        assert updates.flushes == 1
+        return weakref.ref(page), updates
+
+    async def test():
+        # flet keeps the page in the context it was made in, like a session
+        task = asyncio.create_task(session(), context=contextvars.Context())
+        freed, updates = await task
+        del task
+        # the loop lets go of the finished task on its next pass
+        await asyncio.sleep(0)
+        gc.collect()
+        assert freed() is None
+        assert updates.page is None
+
+    asyncio.run(test())
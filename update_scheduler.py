@@ -0,0 +1,163 @@
+"""
+Control updates coalesced into one patch per frame.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+import flet as ft  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# seconds between two patches sent to the client
+FRAME_INTERVAL = 1 / 60
+
+
+class UpdateScheduler:
+    """
+    Collects the controls that changed and sends them in a single
+    ``page.update(...)`` at the next frame tick.
+
+    Handlers mark controls instead of updating them, so a user action that
+    touches several controls costs one websocket message. A control whose
+    parent is marked as well is left to the update of the parent. Controls
+    that are not on the page by the time of the tick are skipped, they are
+    sent with whatever adds them.
+
+    ``mark`` may be called from the executor threads of sync handlers.
+
+    The scheduler only holds its page weakly, it is kept with the page and
+    must not keep the page alive.
+    """
+
+    def __init__(self, page: ft.Page, interval: float = FRAME_INTERVAL):
+        self._page = weakref.ref(page)
+        self.loop = page.loop
+        self.interval = interval
+        self.flushes = 0
+        self.controls_sent = 0
+        self.controls_skipped = 0
+        self.max_batch = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+        # marked controls in the order they were marked
+        self._dirty: dict[ft.Control, None] = {}
+        self._first_marked: float | None = None
+        self._last_flush = 0.0
+        self._scheduled = False
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def page(self) -> ft.Page | None:
+        """The page updated, None once it is gone."""
+        return self._page()
+
+    def mark(self, *controls: ft.Control):
+        """
+        Send the controls with the next frame.
+        """
+
+        with self._lock:
+            for control in controls:
+                self._dirty[control] = None
+            if self._first_marked is None:
+                self._first_marked = time.monotonic()
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._schedule()
+        else:
+            self.loop.call_soon_threadsafe(self._schedule)
+
+    def flush(self):
+        """
+        Send the marked controls now, in one update. Runs on the event loop.
+        """
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        with self._lock:
+            dirty = self._dirty
+            first_marked = self._first_marked
+            self._dirty = {}
+            self._first_marked = None
+            self._scheduled = False
+        page = self.page
+        if not dirty or page is None:
+            return
+
+        controls = [
+            control
+            for control in dirty
+            if control.page is not None and not self._covered(control, dirty)
+        ]
+        self._last_flush = time.monotonic()
+        if controls:
+            try:
+                page.update(*controls)
+            except ft.PageDisconnectedException:
+                # the client left, nobody is waiting for the patch
+                return
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Update of %d controls failed", len(controls))
+                return
+
+        latency = self._last_flush - first_marked
+        self.flushes += 1
+        self.controls_sent += len(controls)
+        self.controls_skipped += len(dirty) - len(controls)
+        self.max_batch = max(self.max_batch, len(controls))
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def stats(self) -> dict:
+        """Number and size of the patches sent and how long controls waited."""
+        flushes = self.flushes or 1
+        return {
+            "flushes": self.flushes,
+            "controls_sent": self.controls_sent,
+            "controls_skipped": self.controls_skipped,
+            "max_batch": self.max_batch,
+            "mean_batch": round(self.controls_sent / flushes, 2),
+            "mean_latency_ms": round(self.total_latency / flushes * 1000, 3),
+            "max_latency_ms": round(self.max_latency * 1000, 3),
+        }
+
+    def _schedule(self):
+        # right away after a quiet frame, otherwise at the next tick
+        delay = max(0.0, self._last_flush + self.interval - time.monotonic())
+        self._timer = self.loop.call_later(delay, self.flush)
+
+    @staticmethod
+    def _covered(control: ft.Control, dirty: dict) -> bool:
+        parent = control.parent
+        while parent is not None:
+            if parent in dirty:
+                return True
+            parent = parent.parent
+        return False
+
+
+# page -> its scheduler, forgotten with the page
+_schedulers: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def scheduler(page: ft.Page) -> UpdateScheduler:
+    """
+    Update scheduler of the page.
+    """
+
+    updates = _schedulers.get(page)
+    if updates is None:
+        updates = _schedulers[page] = UpdateScheduler(page)
+    return updates